@@ -14,3 +14,10 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'harbin_platform_backend.settings')
 
 application = get_asgi_application()
+
+
+from django.conf import settings  # noqa: E402
+
+if getattr(settings, 'ROADS_NETWORK_PRELOAD', False):
+    from roads.network import preload
+    preload()
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 
 # GDAL_LIBRARY_PATH = '/opt/homebrew/opt/gdal/lib/libgdal.dylib'
 # GEOS_LIBRARY_PATH = '/opt/homebrew/opt/geos/lib/libgeos_c.dylib'\
@@ -55,6 +56,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "roads.instrumentation.RequestTimingMiddleware",
+    "roads.sqlprofile.SQLProfileMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -147,3 +150,124 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# roads 路网快照
+# 快照每隔 ROADS_NETWORK_CHECK_INTERVAL 秒核对一次 bfmap_ways / highway 是否变化；
+# ROADS_NETWORK_PRELOAD 为 True 时 wsgi/asgi 模块导入后即起后台线程预热（要连库）。
+# 默认关闭：gunicorn --preload 等在 master 里导入应用再 fork 的部署不要打开
+ROADS_NETWORK_CHECK_INTERVAL = 300
+ROADS_NETWORK_PRELOAD = False
+
+# 矢量瓦片：内存 LRU 条数；ROADS_TILE_DIR 非空时瓦片同时落盘（按路网内容摘要分目录）
+ROADS_TILE_CACHE_SIZE = 4096
+ROADS_TILE_DIR = None
+
+# 排行缓存：每个 (维度, highway_name) 组合预计算前 K 名，TTL 秒后或物化视图刷新后重建
+ROADS_RANKING_TOP_K = 100
+ROADS_RANKING_TTL = 3600
+
+# 接客点列存储：配置路径后用 `manage.py build_pickup_store` 生成，各进程 mmap 共享。
+# 该路径是指向最新版本目录（同级的 <名字>.<时间戳>）的符号链接，见 roads/pickups.py；
+# 为 None 时首次使用从数据库载入，每隔 CHECK_INTERVAL 秒核对一次是否有新数据
+ROADS_PICKUP_STORE_DIR = None
+ROADS_PICKUP_STORE_CHECK_INTERVAL = 300
+
+# 进程间共享的缓存：接客点聚类结果等（FileBasedCache，多机部署时可换成 Redis）
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'roads': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'harbin_roads_cache'),
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+
+# 聚类结果缓存：进程内 LRU 条数 + 共享缓存别名（None 则只用进程内 LRU）；
+# `manage.py warm_pickup_clusters` 按日期预算下面的标准高峰窗口（本地时间）
+ROADS_CLUSTER_CACHE_SIZE = 512
+ROADS_CLUSTER_CACHE_ALIAS = 'roads'
+ROADS_STANDARD_PEAK_WINDOWS = {
+    'Morning Peak': ('07:00', '09:00'),
+    'Evening Peak': ('17:00', '19:00'),
+}
+# 批量聚类（pickup-clusters/batch/、manage.py cluster_windows）的进程数，None 为 CPU 核数 - 1
+ROADS_CLUSTER_WORKERS = None
+
+# 流量物化视图增量刷新（`manage.py refresh_flows` 或 POST /api/flows/refresh/，见 roads/refresh.py）
+# ROADS_REFRESH_VIEWS 为刷新阶段列表：阶段依次执行，阶段内的视图并行刷新；
+# 其他进程每隔 CHECK_INTERVAL 秒检查一次是否有新的刷新，以便清掉本进程缓存；
+# 逐日汇总表的日期和小时按 FLOW_TIME_ZONE 的本地时间划分
+ROADS_REFRESH_VIEWS = [[
+    'road_hourly_flow', 'road_day_flow', 'road_daily_count',
+    'road_hourly_count', 'road_peak_period_count', 'road_duration_stats',
+]]
+ROADS_REFRESH_CHECK_INTERVAL = 60
+ROADS_FLOW_TIME_ZONE = TIME_ZONE
+
+# 路段转移矩阵 + 路段→轨迹倒排索引（/api/road-transitions/）
+# DIR 非空时由 `manage.py build_transition_index` 生成、各进程 mmap 打开；
+# 为 None 时每个进程首次查询时在后台从 trip_road_data 构建（建好之前接口返回 503），
+# 之后每隔 CHECK_INTERVAL 秒在后台增量读入新轨迹。生产环境建议配置 DIR
+ROADS_TRANSITION_DIR = None
+ROADS_TRANSITION_CHECK_INTERVAL = 300
+
+# 批量查询（POST /api/batch/）：单次最多的子查询数、并发执行的线程数
+ROADS_BATCH_MAX_QUERIES = 50
+ROADS_BATCH_WORKERS = 8
+
+# 异步服务模式：用 ASGI 服务器（如 uvicorn harbin_platform_backend.asgi:application）部署时设为 True，
+# 只读接口换成 roads/async_views.py 的异步视图。数据库读取走 asyncpg 连接池
+# （可选依赖，pip install -r requirements-async.txt；没装时退回线程池里的同步 ORM），
+# POOL_MIN/MAX_SIZE 为每个进程的连接数上下限；聚类等 CPU 重活放进 WORKERS 个线程（None 为 CPU 核数 + 4，最多 32）
+ROADS_ASYNC_VIEWS = False
+ROADS_ASYNC_POOL_MIN_SIZE = 2
+ROADS_ASYNC_POOL_MAX_SIZE = 20
+ROADS_ASYNC_POOL_TIMEOUT = 30
+ROADS_ASYNC_WORKERS = None
+
+# 每请求计时（roads/instrumentation.py）：响应头 Server-Timing、/api/metrics/ 的 Prometheus 直方图，
+# 以及 logger "roads.requests" 的每请求一行 JSON（DEBUG 级别，见下面 LOGGING）。
+# METRICS_ALLOWED_IPS 默认只放行本机，监控机另外加上；设为 None 时不限来源
+ROADS_INSTRUMENTATION = True
+ROADS_METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# 基准测试（generate_benchmark_data 会清空并覆盖 roads 的表）只在专用的基准库上运行：
+# 用 --settings=harbin_platform_backend.settings_benchmark，它把 default 换成基准库并设置
+# ROADS_BENCHMARK_DATABASE。不论怎么配置，(HOST, NAME) 在 ROADS_PROTECTED_DATABASES 里的库都拒绝
+ROADS_BENCHMARK_DATABASE = None
+ROADS_PROTECTED_DATABASES = [('121.43.234.148', 'harbin_platform')]
+
+# SQL 剖析（调试用，roads/sqlprofile.py）：记录每个请求的全部 SQL，标出慢查询（SLOW_MS）、
+# 同一请求里重复 REPEAT_THRESHOLD 次以上的语句（N+1）、返回行数超过 MAX_ROWS 的、
+# 大表上不带 WHERE 也不带 LIMIT 的、直接取 WIDE_COLUMNS 大字段的；PostgreSQL 上超过 EXPLAIN_MS 的
+# SELECT 每种抓一次 EXPLAIN (ANALYZE, BUFFERS)。报告按接口写到 PROFILE_DIR，
+# 用 `manage.py sql_report` 查看。同一接口的报告最多每 FLUSH_SECONDS 秒写一次，进程退出时补写
+ROADS_SQL_PROFILE = False
+ROADS_SQL_PROFILE_DIR = os.path.join(tempfile.gettempdir(), 'harbin_roads_sqlprofile')
+ROADS_SQL_FLUSH_SECONDS = 5
+ROADS_SQL_SLOW_MS = 100
+ROADS_SQL_EXPLAIN_MS = 100
+ROADS_SQL_REPEAT_THRESHOLD = 5
+ROADS_SQL_MAX_ROWS = 10000
+ROADS_SQL_LARGE_TABLES = [
+    'bfmap_ways', 'taxi_pickups', 'trip_road_data', 'road_hourly_flow', 'road_day_flow',
+    'road_daily_count', 'road_hourly_count', 'road_hour_trip_counts', 'road_day_trip_counts',
+    'trip_day_index', 'ways',
+]
+ROADS_SQL_WIDE_COLUMNS = {'bfmap_ways': ['geom']}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        # 每请求一行的访问日志是 DEBUG 级别，排查时改成 'DEBUG'
+        'roads.requests': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+        'roads.sql': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+    },
+}
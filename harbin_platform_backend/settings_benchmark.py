@@ -0,0 +1,31 @@
+"""
+基准测试用的设置：
+
+    python manage.py generate_benchmark_data --settings=harbin_platform_backend.settings_benchmark
+    python manage.py run_benchmark --settings=harbin_platform_backend.settings_benchmark
+
+default 换成本地的基准库（连接参数取环境变量 ROADS_BENCH_DB_*），其余与 settings.py 相同。
+generate_benchmark_data 会清空并覆盖这个库里 roads 的表。
+基线也在这个库上生成，步骤见 roads/benchmark.py。
+"""
+import os
+
+from .settings import *  # noqa: F401,F403
+
+DATABASES = {
+    "default": {
+        'ENGINE': 'django.contrib.gis.db.backends.postgis',
+        "NAME": os.environ.get("ROADS_BENCH_DB_NAME", "harbin_benchmark"),
+        "USER": os.environ.get("ROADS_BENCH_DB_USER", "postgres"),
+        "PASSWORD": os.environ.get("ROADS_BENCH_DB_PASSWORD", ""),
+        "HOST": os.environ.get("ROADS_BENCH_DB_HOST", "localhost"),
+        "PORT": int(os.environ.get("ROADS_BENCH_DB_PORT", 5432)),
+    }
+}
+
+ROADS_BENCHMARK_DATABASE = "default"
+
+# metrics 场景要求打开计时、放行本机（测试客户端的 REMOTE_ADDR 是 127.0.0.1），
+# 不随 settings.py 的改动变成 404 / 403
+ROADS_INSTRUMENTATION = True
+ROADS_METRICS_ALLOWED_IPS = ["127.0.0.1"]
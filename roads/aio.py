@@ -0,0 +1,147 @@
+"""
+ASGI 部署下异步视图（async_views.py）用到的执行设施。
+
+- fetch_values(qs)：把 values() QuerySet 编译成 SQL，在 asyncpg 的连接池上
+  执行。连接数由 ROADS_ASYNC_POOL_MIN/MAX_SIZE 限定，等连接的请求只挂起
+  协程、不占线程。没装 asyncpg 时退回在线程池里用同步 ORM 执行。
+  （不用 psycopg 3：装上它 Django 会改用它做同步驱动，而 ingest_trips 等
+  命令依赖 psycopg2 的 copy_expert。）
+- offload(func, ...)：聚类、路网快照载入、排行缓存重建这类 CPU 重活或
+  同步代码，放进 ROADS_ASYNC_WORKERS 个线程的专用线程池，不阻塞事件循环，
+  也不挤占 Django 默认的单个 thread_sensitive 线程。
+- json_response(data)：与 DRF JSONRenderer 输出相同的 JSON 响应。
+- fetch_chunks / iterate：流式输出时逐批取数。服务端游标绑定在线程上，
+  跨线程池的多次调用没法共用，所以数据库来源按键集一页一页地查。
+
+连接池绑定在创建它的事件循环上；ASGI 服务器每个进程一个事件循环。
+"""
+import asyncio
+import functools
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpResponse
+from rest_framework.renderers import JSONRenderer
+
+from . import listing
+from .instrumentation import wrap_context
+
+try:
+    import asyncpg
+except ImportError:  # asyncpg 是可选依赖，没有就在线程池里走同步 ORM
+    asyncpg = None
+
+_pool = None
+_pool_loop = None
+_pool_lock = None
+_executor = None
+
+
+def _connect_kwargs(alias):
+    db = settings.DATABASES[alias]
+    kwargs = {
+        "database": db.get("NAME"),
+        "user": db.get("USER"),
+        "password": db.get("PASSWORD"),
+        "host": db.get("HOST") or None,
+        "port": int(db["PORT"]) if db.get("PORT") else None,
+    }
+    sslmode = db.get("OPTIONS", {}).get("sslmode")
+    if sslmode:
+        kwargs["ssl"] = sslmode
+    return {k: v for k, v in kwargs.items() if v is not None}
+
+
+# Django 编译出的 SQL 用 %s 占位、%% 转义，asyncpg 要 $1, $2, ...
+_PLACEHOLDER = re.compile(r"%[s%]")
+
+
+def _numbered(sql):
+    counter = iter(range(1, sql.count("%s") + 1))
+    return _PLACEHOLDER.sub(lambda m: "%" if m.group() == "%%" else f"${next(counter)}", sql)
+
+
+async def get_pool():
+    """当前事件循环的连接池；没有 asyncpg 时为 None"""
+    global _pool, _pool_loop, _pool_lock
+    if asyncpg is None:
+        return None
+    loop = asyncio.get_running_loop()
+    if _pool is not None and _pool_loop is loop:
+        return _pool
+    if _pool_lock is None or _pool_loop is not loop:
+        _pool, _pool_loop, _pool_lock = None, loop, asyncio.Lock()
+    async with _pool_lock:
+        if _pool is None:
+            _pool = await asyncpg.create_pool(
+                min_size=getattr(settings, "ROADS_ASYNC_POOL_MIN_SIZE", 2),
+                max_size=getattr(settings, "ROADS_ASYNC_POOL_MAX_SIZE", 20),
+                timeout=getattr(settings, "ROADS_ASYNC_POOL_TIMEOUT", 30),
+                **_connect_kwargs("default"),
+            )
+    return _pool
+
+
+def _executor_pool():
+    global _executor
+    if _executor is None:
+        workers = getattr(settings, "ROADS_ASYNC_WORKERS", None) or min(32, (os.cpu_count() or 1) + 4)
+        _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="roads-async")
+    return _executor
+
+
+def _close_connections(func, *args, **kwargs):
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()     # 线程池里的同步 ORM 调用同样遵循 CONN_MAX_AGE
+
+
+async def offload(func, *args, **kwargs):
+    """在专用线程池里执行同步函数"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _executor_pool(), wrap_context(functools.partial(_close_connections, func, *args, **kwargs)))
+
+
+async def fetch_values(qs):
+    """values() QuerySet → dict 列表，键和顺序与同步迭代 QuerySet 相同"""
+    pool = await get_pool()
+    if pool is None:
+        return await offload(list, qs)
+    query = qs.query
+    names = [*query.extra_select, *query.values_select, *query.annotation_select]
+    sql, params = query.sql_with_params()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(_numbered(sql), *params)
+    return [dict(zip(names, row.values())) for row in rows]
+
+
+async def fetch_chunks(qs, key, after=None, chunk_size=listing.STREAM_CHUNK):
+    """按 key 升序逐批产出 values() QuerySet 的行，每批一次键集查询"""
+    while True:
+        rows = await fetch_values(listing.keyset(qs, key, after)[:chunk_size])
+        if rows:
+            yield rows
+        if len(rows) < chunk_size:
+            return
+        after = rows[-1][key]
+
+
+async def iterate(iterator):
+    """同步迭代器每取一个元素放进线程池执行一次"""
+    done = object()
+    iterator = iter(iterator)
+    while True:
+        item = await offload(next, iterator, done)
+        if item is done:
+            return
+        yield item
+
+
+def json_response(data, status=200):
+    return HttpResponse(JSONRenderer().render(data), status=status,
+                        content_type="application/json")
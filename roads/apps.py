@@ -4,3 +4,29 @@ from django.apps import AppConfig
 class RoadsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'roads'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+        from . import instrumentation, network, rankings, refresh, sqlprofile, transitions
+        from .models import BfmapWay, Highway
+
+        # 通过 ORM 改路网时让快照失效；库外改动靠签名轮询发现
+        for model in (BfmapWay, Highway):
+            post_save.connect(network.on_network_changed, sender=model,
+                              dispatch_uid=f"roads-network-{model.__name__}-save")
+            post_delete.connect(network.on_network_changed, sender=model,
+                                dispatch_uid=f"roads-network-{model.__name__}-delete")
+
+        # 流量物化视图刷新后清空排行缓存
+        refresh.flows_refreshed.connect(rankings.on_flows_refreshed,
+                                        dispatch_uid="roads-rankings-flows-refreshed")
+        # 新轨迹入库刷新后，路段转移索引下次请求时立即检查增量
+        refresh.flows_refreshed.connect(transitions.on_flows_refreshed,
+                                        dispatch_uid="roads-transitions-flows-refreshed")
+
+        # 每个请求的 SQL 条数和耗时（Server-Timing、/api/metrics/）
+        if instrumentation.enabled():
+            instrumentation.install()
+        # 调试用：记录每个请求的全部 SQL（见 sqlprofile.py）
+        if sqlprofile.enabled():
+            sqlprofile.install()
@@ -0,0 +1,159 @@
+"""
+只读接口的异步版本，ASGI 部署时（ROADS_ASYNC_VIEWS = True）由 urls.py 换上。
+
+参数校验、查询构造与同步视图共用 queries.py，响应内容与同步版本一致。
+数据库读取走 aio.fetch_values（异步连接池），聚类、路网快照、排行缓存
+这类同步/CPU 重活交给 aio.offload 的线程池，事件循环只负责调度。
+
+逻辑几乎都在路网快照、瓦片、热力图聚合这类同步代码里的接口不再另写一份，
+用 offloaded() 把整个同步视图（连同 DRF 的渲染）放进 offload 的线程池：
+否则 Django 会把它们都排到唯一的 thread_sensitive 线程上，一个一个执行。
+"""
+import functools
+
+from django.http import HttpResponseNotAllowed
+
+from . import cluster_cache, geomcodec, listing, queries
+from .aio import fetch_chunks, fetch_values, iterate, json_response, offload
+from .lookup import attach_road_names
+from .network import get_network
+from .payloads import bfmap_ways_payload, payload_response
+from .pickups import get_pickup_store
+
+
+def _get_only(view):
+    # Django 4.2 的 require_GET 会把协程视图包成同步函数，这里自己判断
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ("GET", "HEAD"):
+            return HttpResponseNotAllowed(["GET"])
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def offloaded(view):
+    """同步视图 → 在 aio.offload 线程池里执行并渲染的异步视图"""
+    def call(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if callable(getattr(response, "render", None)):
+            response.render()
+        return response
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        return await offload(call, request, *args, **kwargs)
+    return wrapper
+
+
+def _bad_request(e):
+    return json_response({"detail": e.detail}, status=400)
+
+
+def _invalid(e):
+    return json_response({"detail": f"无效的参数: {e}"}, status=400)
+
+
+@_get_only
+async def list_all_bfmap_ways(request):
+    try:
+        params = listing.parse(request.GET)
+        fmt, precision = geomcodec.parse(request.GET, params.stream)
+    except ValueError as e:
+        return _invalid(e)
+
+    network = await offload(get_network)
+    if params.stream:
+        # 每批记录的构建放进线程池，事件循环只负责发送
+        chunks = listing.network_chunks(network, params.after, fmt=fmt, precision=precision)
+        return listing.stream_response(iterate(chunks), params.stream)
+    if not params.requested:
+        payload = await offload(bfmap_ways_payload, network, fmt=fmt, precision=precision)
+        return payload_response(request, payload)
+    if fmt in geomcodec.BINARY:
+        idx, next_after = listing.network_rows(network, params.after, params.limit)
+        resp = await offload(geomcodec.response, network, idx, fmt, precision)
+        return listing.with_next(resp, request, next_after, params.limit)
+    records, next_after = await offload(listing.network_page, network, params.after, params.limit,
+                                        fmt, precision)
+    return listing.with_next(json_response(records), request, next_after, params.limit)
+
+
+async def _top_roads(build, request):
+    try:
+        query = build(request.GET)
+    except queries.BadRequest as e:
+        return _bad_request(e)
+    # 排行缓存过期时重建要查库，放进线程池
+    records = await offload(query.cached)
+    if records is None:
+        records = await fetch_values(query.queryset)
+    await offload(attach_road_names, records, key=query.gid_key)
+    return json_response(records)
+
+
+@_get_only
+async def top_n_roads_by_day(request):
+    return await _top_roads(queries.top_roads_by_day, request)
+
+
+@_get_only
+async def top_n_roads_by_hour(request):
+    return await _top_roads(queries.top_roads_by_hour, request)
+
+
+@_get_only
+async def top_n_roads_by_peak_period(request):
+    return await _top_roads(queries.top_roads_by_peak_period, request)
+
+
+@_get_only
+async def top_n_roads_by_duration_category(request):
+    return await _top_roads(queries.top_roads_by_duration_category, request)
+
+
+@_get_only
+async def road_day_flow(request):
+    try:
+        req_ids, qs = queries.road_day_flow(request.GET)
+    except queries.BadRequest as e:
+        return _bad_request(e)
+    return json_response(queries.fill_road_day_flow(req_ids, await fetch_values(qs)))
+
+
+@_get_only
+async def roads_by_highway_type(request):
+    try:
+        qs = queries.roads_by_highway_type(request.GET)
+        params = listing.parse(request.GET)
+    except queries.BadRequest as e:
+        return _bad_request(e)
+    except ValueError as e:
+        return _invalid(e)
+
+    if params.stream:
+        return listing.stream_response(
+            _road_ids(fetch_chunks(qs, "road_id", params.after)), params.stream)
+    if params.requested:
+        rows = await fetch_values(listing.page_query(qs, "road_id", params.after, params.limit))
+        rows, next_after = listing.split_page(rows, "road_id", params.limit)
+        return listing.with_next(json_response([row["road_id"] for row in rows]),
+                                 request, next_after, params.limit)
+    return json_response([row["road_id"] for row in await fetch_values(qs)])
+
+
+async def _road_ids(chunks):
+    async for rows in chunks:
+        yield [row["road_id"] for row in rows]
+
+
+@_get_only
+async def pickup_clusters(request):
+    try:
+        query = queries.pickup_clusters(request.GET)
+    except queries.BadRequest as e:
+        return json_response(e.body(), status=400)
+
+    # 缓存未命中时聚类是纯 CPU 计算，整个放进线程池
+    clusters = await offload(lambda: cluster_cache.get_clusters(
+        get_pickup_store(), query.start, query.end, query.period, query.eps, query.minpts))
+    return json_response(cluster_cache.feature_collection(clusters))
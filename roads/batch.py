@@ -0,0 +1,142 @@
+"""
+批量查询：一次 POST /api/batch/ 执行多个 roads 的 GET 接口。
+
+看板一次加载要打 top-roads、top-roads-by-hour、road-day-flow 等十来个接口，
+每个都付一遍 HTTP、DRF 分发和取连接的开销。这里在服务端把子查询拆成
+普通的 HttpRequest，直接调用 roads.urls 里解析到的（同步）视图函数：
+
+- 完全相同的子查询（路径 + 参数）只执行一次，结果共用；
+- 不同的子查询在线程池里并发执行，每个线程用自己的数据库连接，用完即关；
+- 路名、排行、路网快照等都是进程内共享的快照/缓存，执行前先把路网快照
+  载入，各子查询不会各自去库里取路名；
+- 子查询的响应体已经是 JSON 字节，原样拼进结果，不反序列化再编码。
+
+只支持返回 JSON 的接口；二进制（format=bin、瓦片）和流式接口给出 400。
+"""
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpRequest, QueryDict
+from django.urls import Resolver404, resolve
+from rest_framework.response import Response
+
+from .instrumentation import wrap_context
+from .network import get_network
+from .payloads import encode_json
+
+URL_PREFIX = "/api/"
+
+
+class BatchError(ValueError):
+    """批量请求本身不合法（整体返回 400）"""
+
+
+def parse_queries(data):
+    """
+    {"queries": [{"id": "daily", "path": "top-roads/", "params": {"date": "2015-01-03", "n": 10}}, ...]}
+    path 可带查询串（top-roads/?date=...），也可带 /api/ 前缀；id 缺省为下标。
+    返回 [(id, path, query_string), ...]
+    """
+    queries = data.get("queries") if hasattr(data, "get") else None
+    if not isinstance(queries, list) or not queries:
+        raise BatchError("queries 必须是非空列表")
+    limit = getattr(settings, "ROADS_BATCH_MAX_QUERIES", 50)
+    if len(queries) > limit:
+        raise BatchError(f"queries 最多 {limit} 个")
+
+    parsed = []
+    for i, q in enumerate(queries):
+        if not isinstance(q, dict) or not isinstance(q.get("path"), str):
+            raise BatchError(f"第 {i} 个子查询缺少 path")
+        url = urlsplit(q["path"])
+        path = url.path
+        if path.startswith(URL_PREFIX):
+            path = path[len(URL_PREFIX):]
+        params = QueryDict(url.query, mutable=True)
+        for key, value in (q.get("params") or {}).items():
+            values = value if isinstance(value, list) else [value]
+            params.setlist(key, [str(v) for v in values])
+        # 参数排好序，相同的子查询得到相同的 key
+        query_string = urlencode(sorted(params.lists()), doseq=True)
+        parsed.append((q.get("id", i), path.lstrip("/"), query_string))
+    return parsed
+
+
+def _sub_request(parent, path, query_string):
+    parent = getattr(parent, "_request", parent)   # DRF Request → Django HttpRequest
+    request = HttpRequest()
+    request.method = "GET"
+    request.path = request.path_info = URL_PREFIX + path
+    request.META = {
+        **{k: v for k, v in parent.META.items()
+           if k not in ("HTTP_IF_NONE_MATCH", "HTTP_ACCEPT_ENCODING", "CONTENT_TYPE", "CONTENT_LENGTH")},
+        "REQUEST_METHOD": "GET",
+        "PATH_INFO": request.path_info,
+        "QUERY_STRING": query_string,
+        "HTTP_ACCEPT": "application/json",     # 要 JSON，不要可浏览 API 的 HTML
+    }
+    request.GET = QueryDict(query_string)
+    for attr in ("user", "session", "auth"):
+        if hasattr(parent, attr):
+            setattr(request, attr, getattr(parent, attr))
+    return request
+
+
+def _error(status, detail):
+    return status, encode_json({"detail": detail})
+
+
+def execute(parent, path, query_string):
+    """执行一个子查询，返回 (状态码, JSON 字节)"""
+    from .urls import sync_urlpatterns
+    try:
+        # 总是分发到同步视图（ROADS_ASYNC_VIEWS 时 roads.urls 里是异步视图）
+        match = resolve("/" + path, urlconf=tuple(sync_urlpatterns))
+    except Resolver404:
+        return _error(404, f"没有这个接口: {path}")
+
+    request = _sub_request(parent, path, query_string)
+    request.resolver_match = match
+    try:
+        response = match.func(request, *match.args, **match.kwargs)
+        if isinstance(response, Response):
+            response.render()
+    except Exception as e:
+        return _error(500, f"子查询出错: {type(e).__name__}")
+
+    content_type = response.get("Content-Type", "")
+    if response.streaming or not content_type.startswith("application/json"):
+        return _error(400, f"批量查询只支持 JSON 接口，{path} 返回 {content_type or '流式响应'}")
+    return response.status_code, response.content
+
+
+def run(parent, queries):
+    """并发执行，返回与 queries 一一对应的 (状态码, JSON 字节)"""
+    distinct = list(dict.fromkeys((path, qs) for _, path, qs in queries))
+    get_network()                  # 先载入路网快照，子查询共用
+
+    def call(key):
+        try:
+            return execute(parent, *key)
+        finally:
+            connection.close()      # 线程各自的连接，用完即关
+
+    workers = min(len(distinct), getattr(settings, "ROADS_BATCH_WORKERS", 8))
+    if workers <= 1:
+        results = {key: execute(parent, *key) for key in distinct}
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # 子查询的 SQL、各阶段耗时计入这次批量请求
+            results = dict(zip(distinct, pool.map(wrap_context(call), distinct)))
+    return [results[(path, qs)] for _, path, qs in queries]
+
+
+def encode_results(queries, results):
+    """{"results": [{"id": ..., "status": 200, "body": ...}, ...]}，body 直接拼入"""
+    parts = [
+        b'{"id":' + encode_json(qid) + b',"status":' + str(status).encode() + b',"body":' + body + b"}"
+        for (qid, _, _), (status, body) in zip(queries, results)
+    ]
+    return b'{"results":[' + b",".join(parts) + b"]}"
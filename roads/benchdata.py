@@ -0,0 +1,457 @@
+"""
+基准测试用的合成数据集（哈尔滨规模），供 `manage.py generate_benchmark_data` 使用。
+
+    路网      bfmap_ways：抖动网格上的路段（默认 5 万条），端点相接、带 source/target，
+              道路等级取自 road-types.json，路名从常见的街路名组合里取
+    流量      road_hourly_flow / road_day_flow：flow_roads 条路段 × days 天 × 24 小时，
+              早晚高峰的日变化曲线 × 路段权重 × 工作日系数，再加泊松噪声
+    排行      road_daily_count / road_hourly_count / road_peak_period_count /
+              road_duration_stats / road_highway_mapping
+    接客点    taxi_pickups：若干热点的高斯混合 + 均匀背景，时间按日变化曲线分布
+    轨迹      trip_road_data：在路网上随机游走，road_ids / timestamps 为 '[..]' 文本
+    OSM       ways（hstore，仅 PostgreSQL）
+
+只能写入 ROADS_BENCHMARK_DATABASE 指明的基准库（见 settings_benchmark.py 和 check_target）。
+先 migrate（flow_refresh_log 等托管表由迁移创建），再生成。
+同一组参数和 seed 生成的数据逐字节相同，基准结果才可以和基线比较。
+PostgreSQL/PostGIS 用 COPY 写入；其他后端（SQLite/SpatiaLite）退回 bulk_create。
+"""
+import io
+import json
+from dataclasses import asdict, dataclass
+from datetime import date, datetime, time, timedelta, timezone
+
+import numpy as np
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection
+
+from .models import (
+    BfmapWay,
+    Highway,
+    RoadDailyCount,
+    RoadDayFlow,
+    RoadDurationStats,
+    RoadHighwayMapping,
+    RoadHourlyCount,
+    RoadHourlyFlow,
+    RoadPeakPeriodCount,
+    TaxiPickup,
+    Way,
+)
+from .tiles import ROAD_TYPES_FILE
+
+# 哈尔滨主城区（lng/lat）
+HARBIN_BBOX = (126.45, 45.65, 126.85, 45.90)
+PERIODS = ("Morning Peak", "Normal", "Evening Peak")
+DURATION_CATEGORIES = ("short", "mid", "long")
+TRIP_TABLE = "trip_road_data"
+META_TABLE = "benchmark_dataset"
+CHUNK = 100_000
+
+_NAME_STEMS = ("中山", "红旗", "学府", "长江", "黄河", "友谊", "东大直", "西大直", "哈平", "珠江",
+               "经纬", "果戈里", "中央", "南岗", "和兴", "先锋", "安发", "通达", "新阳", "文昌",
+               "宣化", "花园", "民生", "建设", "hongqi", "xuefu", "Main", "Harbin")
+_NAME_SUFFIXES = ("路", "街", "大街", "大道", "东路", "西路", "南路", "北路", "一道街", "二道街")
+
+# 一天 24 小时的相对强度：早高峰 7-9、晚高峰 17-19
+DIURNAL = np.array([0.15, 0.10, 0.08, 0.07, 0.10, 0.25, 0.55, 1.00, 0.95, 0.70, 0.60, 0.62,
+                    0.65, 0.60, 0.58, 0.62, 0.75, 1.00, 0.92, 0.70, 0.55, 0.45, 0.35, 0.22])
+
+
+@dataclass
+class Dataset:
+    roads: int = 50_000
+    days: int = 365
+    flow_roads: int = 2_000
+    pickups: int = 3_000_000
+    trips: int = 200_000
+    ways: int = 10_000
+    start: date = date(2015, 1, 1)
+    seed: int = 0
+
+    def to_json(self):
+        return {**asdict(self), "start": self.start.isoformat()}
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(**{**data, "start": date.fromisoformat(data["start"])})
+
+
+def _period_of(hours):
+    return np.where((hours >= 7) & (hours < 9), 0, np.where((hours >= 17) & (hours < 19), 2, 1))
+
+
+# ---- 生成 -------------------------------------------------------------------
+def highways():
+    """road-types.json 里的 highway 等级：[(id, name, priority, maxspeed), ...]"""
+    with open(ROAD_TYPES_FILE, encoding="utf-8") as f:
+        tags = json.load(f)["tags"]
+    return [(v["id"], v["name"], v.get("priority"), v.get("maxspeed"))
+            for tag in tags if tag["tag"] == "highway" for v in tag["values"]]
+
+
+class RoadNetwork:
+    """抖动网格上的路段；节点 (i, j) 的编号为 i * side + j"""
+
+    def __init__(self, n_roads, rng, highway_rows):
+        side = int(np.ceil((1 + np.sqrt(1 + 2 * n_roads)) / 2))
+        while 2 * side * (side - 1) < n_roads:
+            side += 1
+        minx, miny, maxx, maxy = HARBIN_BBOX
+        ii, jj = np.divmod(np.arange(side * side), side)
+        step_x, step_y = (maxx - minx) / (side - 1), (maxy - miny) / (side - 1)
+        self.node_xy = np.column_stack((minx + jj * step_x, miny + ii * step_y))
+        self.node_xy += rng.normal(0, 0.15, self.node_xy.shape) * (step_x, step_y)
+
+        nodes = np.arange(side * side).reshape(side, side)
+        edges = np.concatenate([
+            np.column_stack((nodes[:, :-1].ravel(), nodes[:, 1:].ravel())),   # 横
+            np.column_stack((nodes[:-1, :].ravel(), nodes[1:, :].ravel())),   # 竖
+        ])
+        edges = edges[rng.permutation(len(edges))[:n_roads]]
+        self.source, self.target = edges[:, 0], edges[:, 1]
+        self.gid = np.arange(1, n_roads + 1)
+
+        # 端点之间插 0-3 个抖动的中间点
+        n_mid = rng.integers(0, 4, n_roads)
+        self.offsets = np.concatenate(([0], np.cumsum(n_mid + 2)))
+        t = np.concatenate([np.linspace(0, 1, k + 2) for k in n_mid])
+        road_of = np.repeat(np.arange(n_roads), n_mid + 2)
+        a, b = self.node_xy[self.source[road_of]], self.node_xy[self.target[road_of]]
+        jitter = rng.normal(0, 0.05, (len(t), 2)) * (step_x, step_y)
+        inner = (t > 0) & (t < 1)
+        self.coords = a + (b - a) * t[:, None] + jitter * inner[:, None]
+
+        seg = np.diff(self.coords, axis=0) * (np.cos(np.radians(45.75)) * 111_320, 110_540)
+        seg_len = np.hypot(seg[:, 0], seg[:, 1])
+        seg_len[self.offsets[1:-1] - 1] = 0                                  # 跨路段的差不算
+        self.length = np.add.reduceat(np.append(seg_len, 0), self.offsets[:-1])
+
+        hw = np.array([h[0] for h in highway_rows])
+        # 住宅/支路多，主干道少
+        weights = np.array([8.0 if h[1] in ("residential", "service", "unclassified")
+                            else 4.0 if h[1] in ("tertiary", "secondary") else 1.0
+                            for h in highway_rows])
+        self.class_id = rng.choice(hw, n_roads, p=weights / weights.sum())
+        info = {h[0]: h for h in highway_rows}
+        self.highway_name = np.array([info[c][1] for c in self.class_id], dtype=object)
+        self.priority = np.array([info[c][2] or 1.0 for c in self.class_id])
+        self.maxspeed = np.array([info[c][3] or 50 for c in self.class_id])
+        self.oneway = rng.random(n_roads) < 0.15
+
+        names = np.array([s + x for s in _NAME_STEMS for x in _NAME_SUFFIXES], dtype=object)
+        self.road_name = names[rng.integers(0, len(names), n_roads)]
+        self.road_name[rng.random(n_roads) < 0.1] = None
+
+        # 每个节点连出的路段（最多 4 条），随机游走用
+        ends = np.concatenate([self.source, self.target])
+        roads = np.concatenate([np.arange(n_roads), np.arange(n_roads)])
+        order = np.argsort(ends, kind="stable")
+        ends, roads = ends[order], roads[order]
+        self.degree = np.bincount(ends, minlength=side * side)
+        first = np.concatenate(([0], np.cumsum(self.degree)[:-1]))
+        self.incident = np.full((side * side, 4), -1)
+        self.incident[ends, np.arange(len(ends)) - first[ends]] = roads
+
+    def __len__(self):
+        return len(self.gid)
+
+    def wkt(self, i):
+        pts = self.coords[self.offsets[i]:self.offsets[i + 1]]
+        return "SRID=4326;LINESTRING({})".format(",".join(f"{x:.7f} {y:.7f}" for x, y in pts))
+
+    def random_walks(self, n_trips, rng, min_len=5, max_len=60):
+        """n_trips 条游走，返回每条的路段下标数组；有别的路可走时不掉头"""
+        lengths = rng.integers(min_len, max_len + 1, n_trips)
+        road = rng.integers(0, len(self), n_trips)
+        node = np.where(rng.random(n_trips) < 0.5, self.source[road], self.target[road])
+        steps = [road]
+        for _ in range(max_len - 1):
+            node = np.where(self.source[road] == node, self.target[road], self.source[road])
+            deg = self.degree[node]
+            k = (rng.random(n_trips) * deg).astype(int)
+            pick = self.incident[node, k]
+            # 选到来路且还有别的路可走时，换成同一路口的下一条
+            back = (pick == road) & (deg > 1)
+            road = np.where(back, self.incident[node, (k + 1) % deg], pick)
+            steps.append(road)
+        walks = np.column_stack(steps)
+        return [walks[i, :lengths[i]] for i in range(n_trips)]
+
+
+def _timestamps(rng, n, ds):
+    """按日变化曲线分布的 n 个时间点（UTC 秒），覆盖 ds.start 起 ds.days 天"""
+    start = datetime.combine(ds.start, time(), tzinfo=timezone.utc).timestamp()
+    day = rng.integers(0, ds.days, n)
+    hour = rng.choice(24, n, p=DIURNAL / DIURNAL.sum())
+    return start + day * 86400 + hour * 3600 + rng.random(n) * 3600
+
+
+def hourly_flow(ds, net, rng):
+    """逐天产出 (biz_date, gid 数组, 路段 × 24 小时的流量矩阵)；流量路段取前 flow_roads 个 gid"""
+    roads = net.gid[:ds.flow_roads]
+    weight = rng.lognormal(3.0, 0.8, len(roads)) * net.priority[:len(roads)] ** -1
+    for d in range(ds.days):
+        day = ds.start + timedelta(days=d)
+        factor = 0.7 if day.weekday() >= 5 else 1.0
+        lam = weight[:, None] * DIURNAL[None, :] * factor
+        counts = rng.poisson(lam)
+        yield day, roads, counts
+
+
+# ---- 写入 -------------------------------------------------------------------
+class UnsafeDatabase(Exception):
+    """当前 default 库不是声明过的基准库，或者是受保护的正式库"""
+
+
+def check_target():
+    """
+    确认 default 库可以清空：必须由 ROADS_BENCHMARK_DATABASE 声明为基准库，
+    且 (HOST, NAME) 不在 ROADS_PROTECTED_DATABASES 里；否则抛 UnsafeDatabase
+    """
+    if getattr(settings, "ROADS_BENCHMARK_DATABASE", None) != DEFAULT_DB_ALIAS:
+        raise UnsafeDatabase(
+            "当前设置没有声明基准库；请用 --settings=harbin_platform_backend.settings_benchmark")
+    db = settings.DATABASES[DEFAULT_DB_ALIAS]
+    target = (db.get("HOST") or "", db.get("NAME") or "")
+    protected = {(host or "", name or "")
+                 for host, name in getattr(settings, "ROADS_PROTECTED_DATABASES", [])}
+    if target in protected:
+        raise UnsafeDatabase(f"{target[0]}/{target[1]} 是受保护的正式库，不能写入基准数据")
+
+
+def _is_postgres():
+    return connection.vendor == "postgresql"
+
+
+def _table_exists(table):
+    with connection.cursor() as cursor:
+        return table in connection.introspection.table_names(cursor)
+
+
+def prepare_table(model):
+    """表不存在就按模型建（基准库里物化视图都是普通表）；存在就清空"""
+    table = model._meta.db_table
+    if not _table_exists(table):
+        with connection.schema_editor() as editor:
+            editor.create_model(model)
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"TRUNCATE {table}" if _is_postgres() else f"DELETE FROM {table}")
+
+
+def _copy_value(v):
+    if v is None:
+        return r"\N"
+    if isinstance(v, float):
+        return repr(v)
+    return str(v).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+
+
+def load_rows(model, columns, rows, table=None):
+    """按 columns 顺序写入一批行（可迭代）；返回行数"""
+    table = table or model._meta.db_table
+    rows = list(rows)
+    if not rows:
+        return 0
+    if _is_postgres():
+        buf = io.StringIO()
+        for row in rows:
+            buf.write("\t".join(_copy_value(v) for v in row))
+            buf.write("\n")
+        buf.seek(0)
+        quoted = ", ".join(connection.ops.quote_name(c) for c in columns)
+        with connection.cursor() as cursor:
+            cursor.copy_expert(f"COPY {table} ({quoted}) FROM STDIN", buf)
+    elif model is not None:
+        model.objects.bulk_create([model(**dict(zip(columns, row))) for row in rows],
+                                  batch_size=2000)
+    else:
+        marks = ", ".join(["%s"] * len(columns))
+        with connection.cursor() as cursor:
+            cursor.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({marks})", rows)
+    return len(rows)
+
+
+def _chunks(rows, size=CHUNK):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _load_all(model, columns, rows, table=None):
+    return sum(load_rows(model, columns, batch, table) for batch in _chunks(rows))
+
+
+INDEXES = [
+    ("road_hourly_flow", ("biz_date", "road_id", "hour")),
+    ("road_day_flow", ("biz_date", "road_id")),
+    ("road_daily_count", ("date", "trip_count")),
+    ("road_hourly_count", ("hour_of_day", "trip_count")),
+    ("road_peak_period_count", ("peak_period", "trip_count")),
+    ("road_duration_stats", ("duration_category", "trip_count")),
+    ("road_highway_mapping", ("highway_name",)),
+    ("road_highway_mapping", ("highway_id",)),
+]
+
+
+def create_indexes():
+    with connection.cursor() as cursor:
+        for table, columns in INDEXES:
+            name = f"bench_{table}_{'_'.join(columns)}"[:63]
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})")
+
+
+def generate(ds, progress=None):
+    """生成并写入整个数据集；返回 {表名: 行数}"""
+    check_target()
+    progress = progress or (lambda message: None)
+    rng = np.random.default_rng(ds.seed)
+    counts = {}
+
+    hw = highways()
+    prepare_table(Highway)
+    counts["highway"] = load_rows(Highway, ["id", "name", "priority", "maxspeed"], hw)
+
+    net = RoadNetwork(ds.roads, rng, hw)
+    prepare_table(BfmapWay)
+    counts["bfmap_ways"] = _load_all(BfmapWay, [
+        "gid", "osm_id", "class_id", "source", "target", "length", "reverse",
+        "maxspeed_forward", "maxspeed_backward", "priority", "geom", "road_name",
+    ], (
+        (int(net.gid[i]), 100_000_000 + int(net.gid[i]), int(net.class_id[i]),
+         int(net.source[i]), int(net.target[i]), float(net.length[i]),
+         -1.0 if net.oneway[i] else float(net.length[i]),
+         int(net.maxspeed[i]), None if net.oneway[i] else int(net.maxspeed[i]),
+         float(net.priority[i]), net.wkt(i), net.road_name[i])
+        for i in range(len(net))
+    ))
+    progress(f"bfmap_ways: {counts['bfmap_ways']:,}")
+
+    prepare_table(RoadHighwayMapping)
+    counts["road_highway_mapping"] = _load_all(
+        RoadHighwayMapping, ["road_id", "highway_name", "highway_id"],
+        ((int(g), n, int(c)) for g, n, c in zip(net.gid, net.highway_name, net.class_id)))
+
+    prepare_table(RoadHourlyFlow)
+    prepare_table(RoadDayFlow)
+    prepare_table(RoadDailyCount)
+    counts.update(road_hourly_flow=0, road_day_flow=0, road_daily_count=0)
+    hours = np.arange(24)
+    for day, roads, flow in hourly_flow(ds, net, rng):
+        counts["road_hourly_flow"] += load_rows(
+            RoadHourlyFlow, ["biz_date", "road_id", "hour", "traffic_cnt"],
+            ((day, int(r), int(h), int(c)) for r, row in zip(roads, flow)
+             for h, c in zip(hours, row) if c))
+        totals = flow.sum(axis=1)
+        counts["road_day_flow"] += load_rows(
+            RoadDayFlow, ["biz_date", "road_id", "traffic_cnt"],
+            ((day, int(r), int(c)) for r, c in zip(roads, totals)))
+        counts["road_daily_count"] += load_rows(
+            RoadDailyCount, ["road_id", "date", "trip_count", "highway_name"],
+            ((str(int(r)), day, int(c), net.highway_name[r - 1]) for r, c in zip(roads, totals)))
+    progress(f"road_hourly_flow: {counts['road_hourly_flow']:,}")
+
+    base = rng.lognormal(4.0, 1.0, len(net))
+    prepare_table(RoadHourlyCount)
+    counts["road_hourly_count"] = _load_all(
+        RoadHourlyCount, ["date", "road_id", "hour_of_day", "trip_count", "highway_name"],
+        ((ds.start, str(int(g)), h, int(b * DIURNAL[h]), n)
+         for g, b, n in zip(net.gid, base, net.highway_name) for h in range(24)))
+    prepare_table(RoadPeakPeriodCount)
+    counts["road_peak_period_count"] = _load_all(
+        RoadPeakPeriodCount, ["road_id", "peak_period", "trip_count", "highway_name"],
+        ((str(int(g)), p, int(b * f), n) for g, b, n in zip(net.gid, base, net.highway_name)
+         for p, f in zip(PERIODS, (2.0, 10.0, 2.2))))
+    prepare_table(RoadDurationStats)
+    counts["road_duration_stats"] = _load_all(
+        RoadDurationStats, ["road_id", "highway_name", "duration_category", "trip_count"],
+        ((int(g), n, c, int(b * f)) for g, b, n in zip(net.gid, base, net.highway_name)
+         for c, f in zip(DURATION_CATEGORIES, (5.0, 3.0, 1.0))))
+    progress(f"排行表: {counts['road_hourly_count'] + counts['road_peak_period_count']:,} 行")
+
+    prepare_table(TaxiPickup)
+    counts["taxi_pickups"] = 0
+    hotspots = net.node_xy[rng.integers(0, len(net.node_xy), 40)]
+    for lo in range(0, ds.pickups, CHUNK):
+        n = min(CHUNK, ds.pickups - lo)
+        ts = np.sort(_timestamps(rng, n, ds))
+        spot = rng.integers(0, len(hotspots), n)
+        xy = hotspots[spot] + rng.normal(0, 0.004, (n, 2))
+        background = rng.random(n) < 0.3
+        minx, miny, maxx, maxy = HARBIN_BBOX
+        xy[background] = rng.uniform((minx, miny), (maxx, maxy), (int(background.sum()), 2))
+        moments = [datetime.fromtimestamp(t, tz=timezone.utc) for t in ts.tolist()]
+        periods = _period_of(np.array([m.hour for m in moments]))
+        counts["taxi_pickups"] += load_rows(
+            TaxiPickup, ["pickup_time", "pickup_date", "pickup_hm", "lng", "lat", "period"],
+            ((m, m.date(), m.time().replace(microsecond=0), float(x), float(y), PERIODS[p])
+             for m, (x, y), p in zip(moments, xy.tolist(), periods)))
+    progress(f"taxi_pickups: {counts['taxi_pickups']:,}")
+
+    counts[TRIP_TABLE] = _generate_trips(ds, net, rng)
+    progress(f"{TRIP_TABLE}: {counts[TRIP_TABLE]:,}")
+
+    if _is_postgres() and ds.ways:
+        counts["ways"] = _generate_ways(ds, net, rng)
+
+    create_indexes()
+    _save_meta(ds, counts)
+    return counts
+
+
+def _generate_trips(ds, net, rng):
+    with connection.cursor() as cursor:
+        if _table_exists(TRIP_TABLE):
+            cursor.execute(f"DROP TABLE {TRIP_TABLE}")
+        cursor.execute(f"CREATE TABLE {TRIP_TABLE} (id BIGINT PRIMARY KEY, road_ids TEXT, timestamps TEXT)")
+    total = 0
+    for lo in range(0, ds.trips, CHUNK):
+        n = min(CHUNK, ds.trips - lo)
+        walks = net.random_walks(n, rng)
+        starts = _timestamps(rng, n, ds)
+        rows = []
+        for i, walk in enumerate(walks):
+            ts = starts[i] + np.cumsum(rng.integers(20, 90, len(walk)))
+            rows.append((lo + i, str(net.gid[walk].tolist()), str(ts.astype(np.int64).tolist())))
+        total += load_rows(None, ["id", "road_ids", "timestamps"], rows, table=TRIP_TABLE)
+    return total
+
+
+def _generate_ways(ds, net, rng):
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS hstore")
+    prepare_table(Way)
+    rows = []
+    for i in range(min(ds.ways, len(net))):
+        name = net.road_name[i]
+        tags = f'"highway"=>"{net.highway_name[i]}"' + (f', "name"=>"{name}"' if name else "")
+        nodes = "{" + f"{net.source[i]},{net.target[i]}" + "}"
+        rows.append((100_000_000 + int(net.gid[i]), tags, nodes))
+    return _load_all(Way, ["id", "tags", "nodes"], rows)
+
+
+def _save_meta(ds, counts):
+    """数据集参数和行数记在库里，run_benchmark 据此选参数、写进结果"""
+    with connection.cursor() as cursor:
+        if _table_exists(META_TABLE):
+            cursor.execute(f"DELETE FROM {META_TABLE}")
+        else:
+            cursor.execute(f"CREATE TABLE {META_TABLE} (data TEXT)")
+        cursor.execute(f"INSERT INTO {META_TABLE} (data) VALUES (%s)",
+                       [json.dumps({"dataset": ds.to_json(), "rows": counts})])
+
+
+def load_meta():
+    """generate() 记下的 {"dataset": ..., "rows": ...}；没生成过为 None"""
+    if not _table_exists(META_TABLE):
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT data FROM {META_TABLE}")
+        row = cursor.fetchone()
+    return json.loads(row[0]) if row else None
@@ -0,0 +1,295 @@
+"""
+逐接口基准测试，供 `manage.py run_benchmark` 使用。
+
+每个场景用 django.test.Client 走完整的中间件 / URL 解析 / 渲染链路，
+先请求 warmup 次（第一次的耗时记为 first_ms，即冷缓存），再请求 repeat 次，记录：
+
+    p50_ms / p95_ms / p99_ms / mean_ms   延迟分位数
+    queries                              每次请求的 SQL 条数（含子线程的连接）
+    bytes                                响应体字节数（流式响应读完为止）
+    status                               状态码
+    rss_peak_mb / rss_growth_mb          进程峰值 RSS 及本场景内的增长
+
+场景应覆盖 roads/urls.py 的每个 URL，新增接口不补场景时 run_benchmark 警告
+（--strict 时报错）。计时前 prepare() 先把转移索引建好，否则这两个接口量到的是 503。
+有场景返回 4xx/5xx 时 run_benchmark 警告，这样的结果不能当基线。
+
+仓库里不提交基线：延迟、SQL 条数都取决于数据库，SQLite 上的结果对 PostGIS 没有参考价值。
+基线在 PostGIS 基准库上生成（见 settings_benchmark.py）：
+
+    python manage.py migrate --settings=harbin_platform_backend.settings_benchmark
+    python manage.py generate_benchmark_data --settings=harbin_platform_backend.settings_benchmark
+    python manage.py run_benchmark --output benchmarks/baseline.json \
+        --settings=harbin_platform_backend.settings_benchmark
+
+之后同一台机器上 run_benchmark --baseline benchmarks/baseline.json 比较。
+结果写成键有序、缩进固定的 JSON；与基线比较时 p95 超出容差、SQL 条数变多、
+状态码变化都算回归。机器差异大的只有延迟，基线应在同一台机器上生成。
+"""
+import json
+import math
+import platform
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+import django
+import numpy as np
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.test import Client
+
+from . import benchdata, transitions
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource，RSS 记为 None
+    resource = None
+
+
+@dataclass
+class Scenario:
+    name: str
+    url: str                        # 覆盖的 roads/urls.py 路由（pattern 原文）
+    path: str
+    params: dict = field(default_factory=dict)
+    method: str = "GET"
+    body: dict = None
+    headers: dict = field(default_factory=dict)
+
+
+def _tile_of(lng, lat, z):
+    n = 2 ** z
+    y = (1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n
+    return int((lng + 180) / 360 * n), int(y)
+
+
+def scenarios(ds):
+    """按数据集参数生成场景；路段、日期都取数据集里一定存在的值"""
+    day = ds.start.isoformat()
+    week_end = (ds.start + timedelta(days=6)).isoformat()
+    flow_ids = ",".join(str(g) for g in range(1, min(ds.flow_roads, 50) + 1))
+    minx, miny, maxx, maxy = benchdata.HARBIN_BBOX
+    cx, cy = (minx + maxx) / 2, (miny + maxy) / 2
+    bbox = f"{cx - 0.02},{cy - 0.02},{cx + 0.02},{cy + 0.02}"
+    tx, ty = _tile_of(cx, cy, 14)
+    residential = next(h[0] for h in benchdata.highways() if h[1] == "residential")
+    peak = {"start": f"{day}T07:00", "end": f"{day}T09:00"}
+    return [
+        Scenario("ways", "ways/", "/api/ways/"),
+        Scenario("ways_stream", "ways/", "/api/ways/", {"stream": "ndjson"}),
+        Scenario("road_flow", "road-flow/", "/api/road-flow/", {"road_id": 1, "date": day}),
+        Scenario("road_flow_matrix", "road-flow/", "/api/road-flow/",
+                 {"road_ids": flow_ids, "start": day, "end": week_end, "layout": "columnar"}),
+        Scenario("road_day_flow", "road-day-flow/", "/api/road-day-flow/",
+                 {"road_ids": flow_ids, "date": day}),
+        Scenario("network_flow_json", "network-flow/", "/api/network-flow/", {"date": day, "hour": 8}),
+        Scenario("network_flow_bin", "network-flow/", "/api/network-flow/",
+                 {"date": day, "hour": 8, "format": "bin"}),
+        Scenario("network_flow_gids", "network-flow/gids/", "/api/network-flow/gids/"),
+        Scenario("flow_refresh_log", "flows/refresh/", "/api/flows/refresh/"),
+        Scenario("bfmap_ways", "bfmap_ways/", "/api/bfmap_ways/"),
+        Scenario("bfmap_ways_gzip", "bfmap_ways/", "/api/bfmap_ways/",
+                 headers={"HTTP_ACCEPT_ENCODING": "gzip"}),
+        Scenario("bfmap_ways_page", "bfmap_ways/", "/api/bfmap_ways/", {"limit": 1000}),
+        Scenario("bfmap_ways_polyline", "bfmap_ways/", "/api/bfmap_ways/", {"format": "polyline"}),
+        Scenario("bfmap_ways_bin", "bfmap_ways/", "/api/bfmap_ways/", {"format": "bin"}),
+        Scenario("bfmap_ways_stream", "bfmap_ways/", "/api/bfmap_ways/", {"stream": "ndjson"}),
+        Scenario("bfmap_filter_class", "bfmap_ways/filter/", "/api/bfmap_ways/filter/",
+                 {"class_id": residential}),
+        Scenario("bfmap_filter_bbox", "bfmap_ways/filter/", "/api/bfmap_ways/filter/", {"bbox": bbox}),
+        Scenario("bfmap_filter_bbox_bin", "bfmap_ways/filter/", "/api/bfmap_ways/filter/",
+                 {"bbox": bbox, "format": "bin"}),
+        Scenario("bfmap_filter_near", "bfmap_ways/filter/", "/api/bfmap_ways/filter/",
+                 {"near": f"{cx},{cy}", "k": 20}),
+        Scenario("road_name_search", "road-names/search/", "/api/road-names/search/", {"q": "中山"}),
+        Scenario("tile_z14", "tiles/<int:z>/<int:x>/<int:y>.mvt", f"/api/tiles/14/{tx}/{ty}.mvt"),
+        Scenario("top_roads", "top-roads/", "/api/top-roads/", {"date": day, "n": 20}),
+        Scenario("top_roads_uncached", "top-roads/", "/api/top-roads/", {"date": day, "n": 1000}),
+        Scenario("top_roads_by_hour", "top-roads-by-hour/", "/api/top-roads-by-hour/",
+                 {"hour": 8, "n": 20}),
+        Scenario("top_roads_by_peak", "top-roads-by-peak/", "/api/top-roads-by-peak/",
+                 {"peak_period": "Morning Peak", "n": 20}),
+        Scenario("roads_by_highway_type", "roads-by-highway-type/", "/api/roads-by-highway-type/",
+                 {"highway_name": "residential"}),
+        Scenario("roads_by_highway_type_page", "roads-by-highway-type/", "/api/roads-by-highway-type/",
+                 {"highway_name": "residential", "limit": 1000}),
+        Scenario("top_roads_by_duration", "top-roads-by-duration/", "/api/top-roads-by-duration/",
+                 {"duration_category": "short", "n": 20}),
+        Scenario("pickup_clusters", "pickup-clusters/", "/api/pickup-clusters/",
+                 {**peak, "eps": 200, "minpts": 20}),
+        Scenario("pickup_clusters_batch", "pickup-clusters/batch/", "/api/pickup-clusters/batch/",
+                 method="POST", body={"start": f"{day}T00:00", "end": f"{day}T12:00",
+                                      "step_minutes": 60, "eps": 200, "minpts": 20}),
+        Scenario("pickup_heatmap_hex", "pickup-heatmap/", "/api/pickup-heatmap/",
+                 {**peak, "shape": "hex", "size": 500}),
+        Scenario("pickup_heatmap_bin", "pickup-heatmap/", "/api/pickup-heatmap/",
+                 {"shape": "square", "size": 200, "format": "bin"}),
+        Scenario("road_transitions", "road-transitions/", "/api/road-transitions/",
+                 {"road_id": 1, "direction": "next", "k": 10}),
+        Scenario("road_transition_trips", "road-transitions/trips/", "/api/road-transitions/trips/",
+                 {"road_ids": "1,2", "mode": "any", "limit": 1000}),
+        Scenario("metrics", "metrics/", "/api/metrics/"),
+        Scenario("batch_dashboard", "batch/", "/api/batch/", method="POST", body={"queries": [
+            {"id": "daily", "path": "top-roads/", "params": {"date": day, "n": 10}},
+            {"id": "hourly", "path": "top-roads-by-hour/", "params": {"hour": 8, "n": 10}},
+            {"id": "peak", "path": "top-roads-by-peak/", "params": {"peak_period": "Evening Peak", "n": 10}},
+            {"id": "flow", "path": "road-day-flow/", "params": {"road_ids": flow_ids, "date": day}},
+            {"id": "types", "path": "roads-by-highway-type/", "params": {"highway_name": "primary"}},
+        ]}),
+    ]
+
+
+def uncovered(scenario_list):
+    """roads/urls.py 里没有场景的路由"""
+    from .urls import sync_urlpatterns
+    covered = {s.url for s in scenario_list}
+    return [str(p.pattern) for p in sync_urlpatterns if str(p.pattern) not in covered]
+
+
+class QueryCounter:
+    """统计所有连接（包括批量接口、刷新等子线程新建的连接）执行的 SQL 条数"""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def _attach(self, conn):
+        if self not in conn.execute_wrappers:
+            conn.execute_wrappers.append(self)
+
+    def _on_created(self, sender, connection, **kwargs):
+        self._attach(connection)
+
+    def __enter__(self):
+        for conn in connections.all():
+            self._attach(conn)
+        connection_created.connect(self._on_created)
+        return self
+
+    def __exit__(self, *exc):
+        connection_created.disconnect(self._on_created)
+        for conn in connections.all():
+            if self in conn.execute_wrappers:
+                conn.execute_wrappers.remove(self)
+
+
+def prepare():
+    """计时前在本进程里建好路段转移索引（请求时它在后台构建，建好前返回 503）"""
+    transitions.load_now()
+
+
+def failed(results):
+    """返回 4xx/5xx 的场景名"""
+    return sorted(name for name, r in results.items() if r["status"] >= 400)
+
+
+def _rss_mb():
+    if resource is None:
+        return None
+    # Linux 上 ru_maxrss 单位是 KB，macOS 是字节
+    scale = 1 if platform.system() == "Darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20
+
+
+def _request(client, scenario):
+    if scenario.method == "POST":
+        response = client.post(scenario.path, scenario.body, content_type="application/json",
+                               **scenario.headers)
+    else:
+        response = client.get(scenario.path, scenario.params, **scenario.headers)
+    if not response.streaming:
+        return response.status_code, len(response.content)
+    try:
+        body = b"".join(response.streaming_content)
+    except Exception:
+        # 流式响应的状态码在出错前就发出去了，客户端收到的是截断的响应体，记为 500
+        return 500, 0
+    return response.status_code, len(body)
+
+
+def run_scenario(client, scenario, repeat=20, warmup=1):
+    rss_before = _rss_mb()
+    timings, queries = [], []
+    first_ms = None
+    for i in range(warmup + repeat):
+        with QueryCounter() as counter:
+            started = time.perf_counter()
+            status, size = _request(client, scenario)
+            elapsed = (time.perf_counter() - started) * 1000
+        if i == 0:
+            first_ms = elapsed
+        if i >= warmup:
+            timings.append(elapsed)
+            queries.append(counter.count)
+    rss_after = _rss_mb()
+    p50, p95, p99 = np.percentile(timings, [50, 95, 99]).tolist()
+    return {
+        "url": scenario.url,
+        "status": status,
+        "bytes": size,
+        "queries": max(queries),
+        "first_ms": round(first_ms, 2),
+        "p50_ms": round(p50, 2),
+        "p95_ms": round(p95, 2),
+        "p99_ms": round(p99, 2),
+        "mean_ms": round(float(np.mean(timings)), 2),
+        "repeat": repeat,
+        "rss_peak_mb": None if rss_after is None else round(rss_after, 1),
+        "rss_growth_mb": None if rss_after is None else round(rss_after - rss_before, 1),
+    }
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "numpy": np.__version__,
+        "database": connection.vendor,
+        "machine": platform.machine(),
+        "system": platform.system(),
+    }
+
+
+def compare(results, baseline, tolerance=0.2, min_ms=1.0):
+    """
+    与基线比较，返回回归列表 [(场景, 指标, 基线值, 当前值)]。
+    p95 超出 (1 + tolerance) 倍且绝对差超过 min_ms 毫秒、SQL 变多、状态码变化、
+    响应体大小变化超过 tolerance 都算回归；基线里没有的场景不比较。
+    """
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if current["status"] != base["status"]:
+            regressions.append((name, "status", base["status"], current["status"]))
+        if current["queries"] > base["queries"]:
+            regressions.append((name, "queries", base["queries"], current["queries"]))
+        if (current["p95_ms"] > base["p95_ms"] * (1 + tolerance)
+                and current["p95_ms"] - base["p95_ms"] > min_ms):
+            regressions.append((name, "p95_ms", base["p95_ms"], current["p95_ms"]))
+        if abs(current["bytes"] - base["bytes"]) > base["bytes"] * tolerance:
+            regressions.append((name, "bytes", base["bytes"], current["bytes"]))
+    return regressions
+
+
+def dump(report, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def client():
+    return Client(raise_request_exception=False)
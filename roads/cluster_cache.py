@@ -0,0 +1,185 @@
+"""
+pickup_clusters 的结果缓存。
+
+同一个 (start, end, period, eps, minpts) 的结果只算一次。两级缓存：
+
+    1. 进程内 LRU（ROADS_CLUSTER_CACHE_SIZE 条）
+    2. Django cache（别名 ROADS_CLUSTER_CACHE_ALIAS），配置成文件/Redis 等
+       共享后端时，各 worker 以及 `manage.py warm_pickup_clusters` 预热的
+       结果可以互相复用
+
+key 由规范化后的参数（时间转成 UTC 秒）加上接客点存储的签名组成，
+taxi_pickups 有新数据后旧结果自然失效。
+
+cluster_windows() 一次处理多个时间窗：未命中的分发到 parallel.ClusterPool
+多进程计算，按完成顺序返回。
+"""
+import hashlib
+import json
+import threading
+from concurrent.futures import as_completed
+from datetime import datetime, time as dt_time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .cache import LRUCache
+from .clustering import sliding_engine, summarize
+from .instrumentation import phase
+from .parallel import ClusterPool
+from .pickups import to_epoch
+
+# 与 pickup_clusters 接口的默认参数一致
+DEFAULT_EPS = 200
+DEFAULT_MINPTS = 100
+
+# 标准高峰时段（本地时间，按 settings.TIME_ZONE 解释），预热命令按日期展开
+DEFAULT_STANDARD_WINDOWS = {
+    "Morning Peak": ("07:00", "09:00"),
+    "Evening Peak": ("17:00", "19:00"),
+}
+
+_local = LRUCache(getattr(settings, "ROADS_CLUSTER_CACHE_SIZE", 512))
+
+
+def shared_cache():
+    alias = getattr(settings, "ROADS_CLUSTER_CACHE_ALIAS", None)
+    return caches[alias] if alias else None
+
+
+def cache_key(store, start, end, period, eps, minpts):
+    normalized = [store.signature, to_epoch(start), to_epoch(end), period or None,
+                  int(eps), int(minpts)]
+    digest = hashlib.sha1(json.dumps(normalized, default=str).encode("utf-8")).hexdigest()
+    return f"roads:pickup-clusters:{digest}"
+
+
+def compute_clusters(store, start, end, period, eps, minpts):
+    """直接计算（不查缓存）；同一 (period, eps, minpts) 复用滑窗引擎"""
+    with phase("window"):
+        ids, lat, lng = store.window(start, end, period)
+    if not len(ids):
+        return []
+    # ids 是列存储里的行号，存储重载后含义会变，所以引擎 key 里带上存储版本
+    engine = sliding_engine(eps, minpts, (store.version, period))
+    with phase("dbscan"):
+        labels = engine.fit(ids, lat, lng)
+    with phase("summarize"):
+        return summarize(labels, lat, lng)
+
+
+def _cached(key):
+    clusters = _local.get(key)
+    if clusters is None:
+        shared = shared_cache()
+        if shared is not None:
+            clusters = shared.get(key)
+            if clusters is not None:
+                _local.set(key, clusters)
+    return clusters
+
+
+def _remember(key, clusters):
+    shared = shared_cache()
+    if shared is not None:
+        shared.set(key, clusters, timeout=None)
+    _local.set(key, clusters)
+
+
+def get_clusters(store, start, end, period, eps, minpts):
+    key = cache_key(store, start, end, period, eps, minpts)
+    clusters = _cached(key)
+    if clusters is None:
+        clusters = compute_clusters(store, start, end, period, eps, minpts)
+        _remember(key, clusters)
+    return clusters
+
+
+def cluster_windows(store, windows, eps, minpts, pool):
+    """
+    windows: [(start, end, period), ...]；按完成顺序产出 (下标, clusters)。
+    命中缓存的立即产出，其余分发到 pool（parallel.ClusterPool）并行计算。
+    """
+    pending = {}
+    for i, (start, end, period) in enumerate(windows):
+        key = cache_key(store, start, end, period, eps, minpts)
+        clusters = _cached(key)
+        if clusters is None and period and store.period_code(period) is None:
+            clusters = []
+        if clusters is not None:
+            yield i, clusters
+            continue
+        code = store.period_code(period) if period else None
+        future = pool.submit(to_epoch(start), to_epoch(end), code, eps, minpts)
+        pending[future] = (i, key)
+
+    for future in as_completed(pending):
+        i, key = pending[future]
+        clusters = future.result()
+        _remember(key, clusters)
+        yield i, clusters
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def acquire_pool(store):
+    """
+    Web 进程共用的聚类进程池，用完调用 pool.release()。接客点存储换版本后换新池，
+    旧池等仍在使用它的请求都 release() 之后才关闭
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.version != store.version:
+            if _pool is not None:
+                _pool.retire()
+            _pool = ClusterPool(store, getattr(settings, "ROADS_CLUSTER_WORKERS", None))
+        return _pool.acquire()
+
+
+def feature_collection(clusters):
+    """簇列表 → pickup_clusters 接口的 GeoJSON FeatureCollection"""
+    return {
+        "type": "FeatureCollection",
+        "features": [{
+            "type": "Feature",
+            "geometry": {
+                "type": "Point",
+                "coordinates": [c["centroid"][1], c["centroid"][0]]  # lng,lat
+            },
+            "properties": {
+                "cluster_id": c["id"],
+                "size":       c["size"]
+            }
+        } for c in clusters],
+    }
+
+
+def standard_windows(day):
+    """某天的标准高峰窗口：[(start, end, period), ...]"""
+    windows = getattr(settings, "ROADS_STANDARD_PEAK_WINDOWS", DEFAULT_STANDARD_WINDOWS)
+    return [
+        (datetime.combine(day, dt_time.fromisoformat(start)),
+         datetime.combine(day, dt_time.fromisoformat(end)),
+         period)
+        for period, (start, end) in windows.items()
+    ]
+
+
+def warm(store, eps=DEFAULT_EPS, minpts=DEFAULT_MINPTS, days=None):
+    """
+    预先计算每个日期的标准高峰窗口（带与不带 period 两种请求），
+    返回实际新算的窗口数。
+    """
+    shared = shared_cache()
+    computed = 0
+    for day in days or store.dates():
+        for start, end, period in standard_windows(day):
+            for p in (period, None):
+                key = cache_key(store, start, end, p, eps, minpts)
+                if key in _local or (shared is not None and key in shared):
+                    continue
+                get_clusters(store, start, end, p, eps, minpts)
+                computed += 1
+    return computed
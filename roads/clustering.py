@@ -0,0 +1,275 @@
+"""
+接客点聚类引擎：平面网格 DBSCAN。
+
+1. 经纬度先投影到以哈尔滨为原点的局部平面（geo.to_local，单位米），
+   之后全部是欧氏距离。
+2. 按边长 eps/√2 分网格：同一格内任意两点距离都 ≤ eps，所以点数
+   ≥ min_samples 的格子里的点全是核心点，不用再算距离；只有稀疏格子
+   的点才用 KD 树数邻居。
+3. 同一格里的核心点必然连通，簇的划分退化成核心格之间的连通性：
+   只检查 5×5 邻域内的格子对，并查集合并。
+4. 边界点归到 eps 内最近的核心点所在的簇。
+
+在同一平面坐标上，核心点、噪声点和簇的划分与标准 DBSCAN（如 sklearn 的
+欧氏距离实现）一致；同时挨着两个簇的边界点，sklearn 按扩展顺序归属，这里按
+最近核心点归属，这类点的簇号可能不同。与原来按 haversine 距离聚类相比，
+局部平面投影在市区范围内的距离误差远小于 1 米，只有距离恰好在 eps 附近的
+点对可能判定不同。
+
+SlidingWindowDBSCAN 在此基础上复用上一个时间窗的邻居计数：窗口平移时
+只对进入和离开窗口的点做邻域查询。
+"""
+import itertools
+import math
+import threading
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from .geo import to_local
+
+NOISE = -1
+
+# 5×5 邻域里的一半（另一半由对称性覆盖），近的在前，更容易提前合并
+_HALF_NEIGHBOURHOOD = sorted(
+    ((dx, dy) for dy in range(0, 3) for dx in range(-2, 3) if dy > 0 or dx > 0),
+    key=lambda d: d[0] ** 2 + d[1] ** 2,
+)
+
+
+def _find(parent, i):
+    root = i
+    while parent[root] != root:
+        root = parent[root]
+    while parent[i] != root:
+        parent[i], i = root, parent[i]
+    return root
+
+
+def check_params(eps, min_samples):
+    """eps（米）须为正数、min_samples 须为正整数，否则抛 ValueError"""
+    if not eps > 0:
+        raise ValueError("eps 必须为正数")
+    if min_samples < 1:
+        raise ValueError("minpts 必须为正整数")
+
+
+class _Grid:
+    """把点按 eps/√2 的格子分组"""
+
+    def __init__(self, xy, eps):
+        if not eps > 0:
+            raise ValueError("eps 必须为正数")
+        side = eps / math.sqrt(2)
+        cells = np.floor((xy - xy.min(axis=0)) / side).astype(np.int64) + 2
+        self.ncols = int(cells[:, 0].max()) + 3          # 左右各留 2 列，邻格偏移不会跨行
+        keys = cells[:, 1] * self.ncols + cells[:, 0]
+        self.keys, self.cell_of, self.counts = np.unique(
+            keys, return_inverse=True, return_counts=True)
+
+    def neighbour(self, cells, dx, dy):
+        """cells 的 (dx, dy) 邻格编号，不存在的为 -1"""
+        target = self.keys[cells] + dy * self.ncols + dx
+        pos = np.searchsorted(self.keys, target)
+        pos[pos >= len(self.keys)] = 0
+        return np.where(self.keys[pos] == target, pos, -1)
+
+
+def core_mask(xy, eps, min_samples, grid=None, tree=None):
+    """邻域（含自身）点数 ≥ min_samples 的点；返回 (mask, 邻居计数下界)"""
+    grid = grid or _Grid(xy, eps)
+    counts = grid.counts[grid.cell_of]
+    core = counts >= min_samples
+    sparse = np.flatnonzero(~core)
+    if len(sparse):
+        tree = tree or cKDTree(xy)
+        counts = counts.copy()
+        counts[sparse] = tree.query_ball_point(xy[sparse], r=eps, return_length=True)
+        core[sparse] = counts[sparse] >= min_samples
+    return core, counts
+
+
+def label_clusters(xy, core, eps, grid=None):
+    """给定核心点，按格子连通性分簇；返回 labels（-1 为噪声），簇号按首个点出现顺序编号"""
+    n = len(xy)
+    labels = np.full(n, NOISE, dtype=np.int64)
+    core_idx = np.flatnonzero(core)
+    if not len(core_idx):
+        return labels
+
+    grid = grid or _Grid(xy, eps)
+    core_cell = grid.cell_of[core_idx]
+    # 每个核心格里的核心点（按格子排序后的区间）
+    order = np.argsort(core_cell, kind="stable")
+    sorted_pts = core_idx[order]
+    cells, starts = np.unique(core_cell[order], return_index=True)
+    ends = np.append(starts[1:], len(sorted_pts))
+    slot = np.full(len(grid.keys), -1, dtype=np.int64)
+    slot[cells] = np.arange(len(cells))
+
+    parent = list(range(len(cells)))
+    trees = {}
+
+    def points(c):
+        return xy[sorted_pts[starts[c]:ends[c]]]
+
+    def tree(c):
+        t = trees.get(c)
+        if t is None:
+            t = trees[c] = cKDTree(points(c))
+        return t
+
+    for dx, dy in _HALF_NEIGHBOURHOOD:
+        nb = grid.neighbour(cells, dx, dy)
+        has = nb >= 0
+        nb_slot = np.where(has, slot[np.maximum(nb, 0)], -1)
+        for a, b in zip(np.flatnonzero(nb_slot >= 0).tolist(),
+                        nb_slot[nb_slot >= 0].tolist()):
+            ra, rb = _find(parent, a), _find(parent, b)
+            if ra == rb:
+                continue
+            # 让小格子去查大格子的 KD 树
+            small, big = (a, b) if ends[a] - starts[a] <= ends[b] - starts[b] else (b, a)
+            dist, _ = tree(big).query(points(small), k=1, distance_upper_bound=eps)
+            if np.isfinite(dist).any():
+                parent[ra] = rb
+
+    roots = np.array([_find(parent, c) for c in range(len(cells))], dtype=np.int64)
+    labels[sorted_pts] = np.repeat(roots, ends - starts)
+
+    # 边界点：eps 内最近的核心点
+    border = np.flatnonzero(~core)
+    if len(border):
+        dist, nearest = cKDTree(xy[core_idx]).query(xy[border], k=1, distance_upper_bound=eps)
+        hit = np.isfinite(dist)
+        labels[border[hit]] = labels[core_idx[nearest[hit]]]
+
+    # 簇号重排成 0..k-1，按簇中第一个点的下标排序
+    clustered = labels != NOISE
+    uniq, first = np.unique(labels[clustered], return_index=True)
+    rank = np.empty(len(uniq), dtype=np.int64)
+    rank[np.argsort(first)] = np.arange(len(uniq))
+    labels[clustered] = rank[np.searchsorted(uniq, labels[clustered])]
+    return labels
+
+
+def grid_dbscan(xy, eps, min_samples):
+    """平面坐标（米）上的 DBSCAN，返回 labels"""
+    check_params(eps, min_samples)
+    xy = np.asarray(xy, dtype=np.float64)
+    if not len(xy):
+        return np.empty(0, dtype=np.int64)
+    grid = _Grid(xy, eps)
+    core, _ = core_mask(xy, eps, min_samples, grid=grid)
+    return label_clusters(xy, core, eps, grid=grid)
+
+
+def summarize(labels, lat, lng):
+    """labels → [{'id', 'size', 'centroid': [lat, lng]}, ...]（按簇号升序）"""
+    clustered = labels != NOISE
+    if not clustered.any():
+        return []
+    lab = labels[clustered]
+    k = int(lab.max()) + 1
+    size = np.bincount(lab, minlength=k)
+    lat_sum = np.bincount(lab, weights=np.asarray(lat)[clustered], minlength=k)
+    lng_sum = np.bincount(lab, weights=np.asarray(lng)[clustered], minlength=k)
+    return [
+        {"id": cid, "size": int(size[cid]),
+         "centroid": [float(lat_sum[cid] / size[cid]), float(lng_sum[cid] / size[cid])]}
+        for cid in range(k) if size[cid]
+    ]
+
+
+class SlidingWindowDBSCAN:
+    """
+    在相互重叠的时间窗之间复用邻居计数。
+
+    每次 fit() 传入当前窗口的点 id（唯一整数，如行号）和坐标。稠密格子
+    里的点直接是核心点，不需要计数；稀疏格子里的点要精确的邻居数，
+    其中上一窗口已经算过的，只用进入/离开窗口的点去增减，其余才做
+    eps 邻域查询。进出点数太多时整窗重算。
+    """
+
+    # 进出点数超过窗口大小的这个比例就不如直接重算
+    MAX_DELTA_RATIO = 0.5
+
+    def __init__(self, eps, min_samples):
+        check_params(eps, min_samples)
+        self.eps = eps
+        self.min_samples = min_samples
+        self._ids = None
+        self._xy = None
+        self._counts = None
+        self._lock = threading.Lock()
+
+    def fit(self, ids, lat, lng):
+        """返回与输入顺序一致的 labels"""
+        ids = np.asarray(ids, dtype=np.int64)
+        order = np.argsort(ids, kind="stable")
+        xy = to_local(np.asarray(lat)[order], np.asarray(lng)[order])
+        labels = np.empty(len(ids), dtype=np.int64)
+        labels[order] = self._fit_sorted(ids[order], xy)
+        return labels
+
+    def _fit_sorted(self, ids, xy):
+        if not len(ids):
+            return np.empty(0, dtype=np.int64)
+        grid = _Grid(xy, self.eps)
+        dense = grid.counts[grid.cell_of] >= self.min_samples
+        counts = np.full(len(ids), -1, dtype=np.int64)     # -1 = 不需要/尚无精确计数
+
+        with self._lock:
+            self._reuse_counts(ids, xy, dense, counts)
+            need = np.flatnonzero(~dense & (counts < 0))
+            if len(need):
+                counts[need] = cKDTree(xy).query_ball_point(
+                    xy[need], r=self.eps, return_length=True)
+            self._ids, self._xy, self._counts = ids, xy, counts
+
+        core = dense | (counts >= self.min_samples)
+        return label_clusters(xy, core, self.eps, grid=grid)
+
+    def _reuse_counts(self, ids, xy, dense, counts):
+        """把上一窗口的精确计数按进出点增量更新后写进 counts"""
+        if self._ids is None:
+            return
+        old_ids = self._ids
+        in_old = np.isin(ids, old_ids, assume_unique=True)
+        in_new = np.isin(old_ids, ids, assume_unique=True)
+        entering = np.flatnonzero(~in_old)
+        leaving = np.flatnonzero(~in_new)
+        if len(entering) + len(leaving) > self.MAX_DELTA_RATIO * len(ids):
+            return
+
+        # 留下来、仍在稀疏格子、且上次有精确计数的点
+        prev = np.full(len(ids), -1, dtype=np.int64)
+        prev[in_old] = self._counts[in_new]
+        reuse = np.flatnonzero(in_old & ~dense & (prev >= 0))
+        if not len(reuse):
+            return
+
+        updated = prev[reuse]
+        tree = cKDTree(xy[reuse])
+        for pts, sign in ((xy[entering], 1), (self._xy[leaving], -1)):
+            if len(pts):
+                hits = tree.query_ball_point(pts, r=self.eps)
+                flat = np.fromiter(itertools.chain.from_iterable(hits), dtype=np.int64)
+                updated += sign * np.bincount(flat, minlength=len(reuse))
+        counts[reuse] = updated
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+MAX_ENGINES = 32
+
+
+def sliding_engine(eps, min_samples, period=None):
+    """按 (period, eps, min_samples) 复用的滑窗引擎；超过 MAX_ENGINES 个时丢弃最早的"""
+    key = (period, eps, min_samples)
+    with _engines_lock:
+        engine = _engines.pop(key, None) or SlidingWindowDBSCAN(eps, min_samples)
+        _engines[key] = engine
+        while len(_engines) > MAX_ENGINES:
+            _engines.pop(next(iter(_engines)))
+        return engine
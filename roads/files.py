@@ -0,0 +1,14 @@
+"""
+文件小工具（不依赖 GIS 库，瓦片缓存和 SQL 剖析报告共用）。
+"""
+import os
+import tempfile
+
+
+def write_atomic(path, data):
+    """先写同目录的临时文件再 rename，读的一方不会看到写了一半的文件"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
@@ -0,0 +1,66 @@
+"""
+路段流量的稠密矩阵组装。
+
+road_hourly_flow / road_day_flow 里没有记录的 (路段, 日期, 小时) 视为 0，
+与 road_day_flow 接口的补零规则一致。
+"""
+from datetime import timedelta
+
+import numpy as np
+
+from .models import RoadDayFlow, RoadHourlyFlow
+
+HOURS_PER_DAY = 24
+
+
+def date_range(start, end):
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+def hourly_flow_matrix(road_ids, start, end):
+    """
+    一次查询取 road_ids 在 [start, end] 内的逐小时流量，
+    返回 (R, D, 24) 的 int64 矩阵，R/D 顺序与 road_ids / date_range(start, end) 一致。
+    """
+    road_ids = np.asarray(road_ids, dtype=np.int64)
+    n_days = (end - start).days + 1
+    matrix = np.zeros((len(road_ids), n_days, HOURS_PER_DAY), dtype=np.int64)
+
+    rows = list(
+        RoadHourlyFlow.objects
+        .filter(road_id__in=road_ids.tolist(), biz_date__range=(start, end))
+        .values_list("road_id", "biz_date", "hour", "traffic_cnt")
+    )
+    if not rows:
+        return matrix
+
+    rid, day, hour, cnt = zip(*rows)
+    order = np.argsort(road_ids, kind="stable")
+    r_idx = order[np.searchsorted(road_ids, np.array(rid, dtype=np.int64), sorter=order)]
+    base = start.toordinal()
+    d_idx = np.fromiter((d.toordinal() - base for d in day), dtype=np.int64, count=len(day))
+    h_idx = np.array(hour, dtype=np.int64)
+    # hour 不在 0~23 的脏数据没有对应的列，丢掉
+    valid = (h_idx >= 0) & (h_idx < HOURS_PER_DAY)
+    matrix[r_idx[valid], d_idx[valid], h_idx[valid]] = np.array(cnt, dtype=np.int64)[valid]
+    return matrix
+
+
+def network_flow_array(network, day, hour=None):
+    """
+    全路网某天（或某天某小时）的流量，按路网快照的 gid 顺序排成 int32 数组；
+    快照里没有的 road_id 丢弃，没有记录的路段为 0。
+    """
+    if hour is None:
+        qs = RoadDayFlow.objects.filter(biz_date=day)
+    else:
+        qs = RoadHourlyFlow.objects.filter(biz_date=day, hour=hour)
+    rows = list(qs.values_list("road_id", "traffic_cnt"))
+
+    flow = np.zeros(len(network), dtype=np.int32)
+    if rows:
+        rid, cnt = zip(*rows)
+        idx = network.index_of(rid)
+        found = idx >= 0
+        flow[idx[found]] = np.array(cnt, dtype=np.int32)[found]
+    return flow
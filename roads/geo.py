@@ -0,0 +1,31 @@
+"""
+经纬度与局部平面坐标的换算。
+
+哈尔滨市域只有一两百公里见方，在这个尺度上用等距圆柱投影
+（以参考纬度的 cos 缩放经度）误差远小于聚类半径，计算却只是乘法。
+"""
+import numpy as np
+
+EARTH_RADIUS_M = 6371008.8        # 地球平均半径（米）
+HARBIN_ORIGIN = (45.75, 126.63)   # (lat, lng)，哈尔滨市中心附近
+
+
+def metres_per_degree(lat0):
+    """参考纬度 lat0 处每度经度、纬度对应的米数 (kx, ky)"""
+    ky = EARTH_RADIUS_M * np.pi / 180.0
+    return ky * np.cos(np.radians(lat0)), ky
+
+
+def to_local(lat, lng, origin=HARBIN_ORIGIN):
+    """(lat, lng) 数组 → 以 origin 为原点的平面坐标 (n×2, 米，x 向东 y 向北)"""
+    kx, ky = metres_per_degree(origin[0])
+    lat = np.asarray(lat, dtype=np.float64)
+    lng = np.asarray(lng, dtype=np.float64)
+    return np.column_stack(((lng - origin[1]) * kx, (lat - origin[0]) * ky))
+
+
+def from_local(xy, origin=HARBIN_ORIGIN):
+    """to_local 的逆变换，返回 (lat, lng) 两个数组"""
+    kx, ky = metres_per_degree(origin[0])
+    xy = np.asarray(xy, dtype=np.float64)
+    return xy[:, 1] / ky + origin[0], xy[:, 0] / kx + origin[1]
@@ -0,0 +1,189 @@
+"""
+路段几何的紧凑编码，/api/bfmap_ways/ 与 /api/bfmap_ways/filter/ 的 ?format= 选项。
+
+    json      默认，coord_list 为 [[lng, lat], …]
+    polyline  JSON，但每条记录没有 coord_list 字段，几何在新字段 "polyline" 里：
+              Google 编码折线字符串（注意该格式的坐标顺序是 lat,lng）。字段名变了，
+              客户端要按请求的 format 取；不传 format 的请求不受影响。
+              ?precision= 小数位，默认 5，与常见解码库的默认值一致；precision=6 即
+              OSRM 的 polyline6
+    bin       小端二进制，n 条路、m 个点：
+                  int64  gid[n]
+                  int32  class_id[n]          （NULL 为 -1）
+                  uint32 point_count[n]
+                  int32  coords[m × 2]         lng,lat 交错，乘 10^precision 取整；
+                                               每条路首点为绝对值，其余为与前一点的差
+              n、precision 见响应头 X-Road-Count / X-Geometry-Precision，默认 precision=6
+    arrow     Apache Arrow IPC 流，几何列为 GeoArrow geoarrow.linestring
+              （list<struct<x, y>>，float64）。需要可选依赖 pyarrow
+
+编码直接在路网快照的 coords/offsets 数组上向量化完成，不经过逐点的 Python 列表。
+"""
+import json
+
+import numpy as np
+from django.http import HttpResponse
+
+from .instrumentation import phase
+from .network import NULL_ID
+
+try:
+    import pyarrow as pa
+except ImportError:  # pyarrow 是可选依赖，没有就不提供 format=arrow
+    pa = None
+
+FORMATS = ("json", "polyline", "bin", "arrow")
+BINARY = ("bin", "arrow")
+DEFAULT_PRECISION = {"polyline": 5, "bin": 6}
+MAX_PRECISION = 7                     # 10^7 × 180 仍在 int32 范围内
+
+CONTENT_TYPES = {
+    "bin": "application/octet-stream",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+
+def parse(params, stream=None):
+    """?format=&precision= → (format, precision)；参数不合法抛 ValueError"""
+    fmt = params.get("format") or "json"
+    if fmt not in FORMATS:
+        raise ValueError(f"format 必须是 {'、'.join(FORMATS)} 之一")
+    if stream and fmt in BINARY:
+        raise ValueError("stream 只支持 format=json 或 polyline")
+    if fmt == "arrow" and pa is None:
+        raise ValueError("format=arrow 需要安装 pyarrow")
+    precision = params.get("precision")
+    if precision is None or fmt not in DEFAULT_PRECISION:
+        return fmt, DEFAULT_PRECISION.get(fmt)
+    try:
+        precision = int(precision)
+    except ValueError:
+        raise ValueError("precision 必须为整数")
+    if not (0 <= precision <= MAX_PRECISION):
+        raise ValueError(f"precision 必须在 0 到 {MAX_PRECISION} 之间")
+    return fmt, precision
+
+
+def gather(network, idx):
+    """选中行的 (坐标 m×2, 每行点数)；全选时直接用快照数组"""
+    offsets = network.offsets
+    if len(idx) == len(network) and (len(idx) == 0 or (idx[0] == 0 and np.all(np.diff(idx) == 1))):
+        return network.coords, np.diff(offsets)
+    counts = offsets[idx + 1] - offsets[idx]
+    starts = np.repeat(offsets[idx] - np.cumsum(counts) + counts, counts)
+    return network.coords[starts + np.arange(counts.sum())], counts
+
+
+def delta_quantize(coords, counts, precision):
+    """乘 10^precision 取整后按行做差分，每行首点保留绝对值（int64）"""
+    q = np.rint(coords * 10.0 ** precision).astype(np.int64)
+    deltas = np.empty_like(q)
+    deltas[1:] = q[1:] - q[:-1]
+    firsts = np.cumsum(counts) - counts
+    firsts = firsts[counts > 0]
+    deltas[firsts] = q[firsts]
+    return deltas
+
+
+# ---- polyline -----------------------------------------------------------------
+def encode_polylines(coords, counts, precision=5):
+    """每行一条 Google 编码折线字符串"""
+    values = delta_quantize(coords[:, ::-1], counts, precision).ravel()
+    z = (values << 1) ^ (values >> 63)                # 负数取反，最低位为符号位
+    # 每个值按 5 位一组，低位在前，除最后一组外都置 0x20
+    nchunks = np.ones(len(z), dtype=np.int64)
+    for k in range(1, 7):
+        nchunks += z >= (1 << (5 * k))
+    total = int(nchunks.sum())
+    starts = np.cumsum(nchunks) - nchunks
+    j = np.arange(total) - np.repeat(starts, nchunks)
+    zr = np.repeat(z, nchunks)
+    more = j < np.repeat(nchunks - 1, nchunks)
+    chars = (((zr >> (5 * j)) & 31) | np.where(more, 0x20, 0)) + 63
+    text = chars.astype(np.uint8).tobytes().decode("ascii")
+
+    char_bounds = np.zeros(len(z) + 1, dtype=np.int64)
+    np.cumsum(nchunks, out=char_bounds[1:])
+    value_bounds = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts * 2, out=value_bounds[1:])
+    bounds = char_bounds[value_bounds].tolist()
+    return [text[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+# ---- bin ----------------------------------------------------------------------
+def encode_bin(network, idx, precision=6):
+    coords, counts = gather(network, idx)
+    return b"".join((
+        network.gid[idx].astype("<i8").tobytes(),
+        network.class_id[idx].astype("<i4").tobytes(),
+        counts.astype("<u4").tobytes(),
+        delta_quantize(coords, counts, precision).astype("<i4").tobytes(),
+    ))
+
+
+# ---- GeoArrow -----------------------------------------------------------------
+def _nullable_array(values):
+    return pa.array(values, mask=values == NULL_ID)
+
+
+def encode_arrow(network, idx, with_highway=False):
+    coords, counts = gather(network, idx)
+    offsets = np.zeros(len(counts) + 1, dtype=np.int32)
+    np.cumsum(counts, out=offsets[1:])
+    points = pa.StructArray.from_arrays(
+        [pa.array(np.ascontiguousarray(coords[:, 0])), pa.array(np.ascontiguousarray(coords[:, 1]))],
+        names=["x", "y"])
+    columns = {
+        "gid": pa.array(network.gid[idx]),
+        "osm_id": _nullable_array(network.osm_id[idx]),
+        "class_id": _nullable_array(network.class_id[idx]),
+        "road_name": pa.array([network.road_name[i] for i in idx.tolist()], type=pa.string()),
+    }
+    if with_highway:
+        columns["highway_type"] = pa.array(
+            [network.highway_name(c) for c in network.class_id[idx].tolist()], type=pa.string())
+    fields = [pa.field(name, arr.type) for name, arr in columns.items()]
+    geometry = pa.ListArray.from_arrays(pa.array(offsets), points)
+    fields.append(pa.field("geometry", geometry.type, metadata={
+        "ARROW:extension:name": "geoarrow.linestring",
+        "ARROW:extension:metadata": json.dumps({"crs": "OGC:CRS84"}),
+    }))
+    table = pa.Table.from_arrays([*columns.values(), geometry], schema=pa.schema(fields))
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+# ---- 入口 ---------------------------------------------------------------------
+def polylines(network, idx, precision=5):
+    return encode_polylines(*gather(network, idx), precision)
+
+
+def records(network, idx, fmt="json", precision=None, with_highway=False):
+    """json / polyline 格式的记录列表"""
+    encoded = polylines(network, idx, precision) if fmt == "polyline" else None
+    return network.records(idx, with_highway, polylines=encoded)
+
+
+def encode(network, idx, fmt, precision=None, with_highway=False):
+    """bin / arrow 响应体"""
+    if fmt == "bin":
+        return encode_bin(network, idx, precision)
+    return encode_arrow(network, idx, with_highway)
+
+
+def headers(fmt, count, precision):
+    if fmt != "bin":
+        return {}
+    return {"X-Road-Count": str(count), "X-Geometry-Precision": str(precision)}
+
+
+def response(network, idx, fmt, precision=None, with_highway=False):
+    """bin / arrow 的 HttpResponse（不缓存的筛选结果、分页）"""
+    with phase("serialize"):
+        body = encode(network, idx, fmt, precision, with_highway)
+    resp = HttpResponse(body, content_type=CONTENT_TYPES[fmt])
+    for name, value in headers(fmt, len(idx), precision).items():
+        resp[name] = value
+    return resp
@@ -0,0 +1,185 @@
+"""
+接客点热力图：方格 / 六边形分箱。
+
+点先投影到局部平面（geo.to_local），在 RESOLUTIONS 里的每个尺寸上分箱。
+每个 (形状, 尺寸) 一座「计数金字塔」：按小时分桶，桶内按 (period, 格子)
+聚合成三列
+
+    cell    int64   格子编号（两个 int32 坐标拼成）
+    period  int8    时段编码，同 PickupStore.period
+    count   int32
+
+行按桶排序，bucket_offsets 是 CSR 偏移。查询时整小时部分直接对预聚合的
+计数求和，窗口两端不满一小时的零头才回到原始点现算，结果与逐点分箱
+完全一致。金字塔随接客点存储版本懒构建。
+"""
+import math
+import threading
+
+import numpy as np
+
+from .geo import from_local, to_local
+from .pickups import to_epoch
+
+BUCKET_SECONDS = 3600
+SQUARE = "square"
+HEX = "hex"
+SHAPES = (SQUARE, HEX)
+# 格子宽度（米）：方格边长 / 六边形对边距离
+RESOLUTIONS = (100, 200, 500, 1000, 2000, 5000)
+
+_OFFSET = 1 << 30          # 坐标加偏移后都非负，拼成的 int64 不会溢出符号位
+_SQRT3 = math.sqrt(3)
+
+
+def encode_cells(i, j):
+    return ((i.astype(np.int64) + _OFFSET) << 32) | (j.astype(np.int64) + _OFFSET)
+
+
+def decode_cells(cells):
+    cells = np.asarray(cells, dtype=np.int64)
+    return (cells >> 32) - _OFFSET, (cells & 0xFFFFFFFF) - _OFFSET
+
+
+def bin_points(lat, lng, shape, size):
+    """点 → 格子编号。方格为 (列, 行)，六边形为尖顶轴向坐标 (q, r)"""
+    xy = to_local(lat, lng)
+    if shape == SQUARE:
+        ij = np.floor(xy / size)
+        return encode_cells(ij[:, 0], ij[:, 1])
+
+    radius = size / _SQRT3
+    fq = (_SQRT3 / 3 * xy[:, 0] - xy[:, 1] / 3) / radius
+    fr = (2 / 3 * xy[:, 1]) / radius
+    fs = -fq - fr
+    q, r, s = np.round(fq), np.round(fr), np.round(fs)
+    dq, dr, ds = np.abs(q - fq), np.abs(r - fr), np.abs(s - fs)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    q = np.where(fix_q, -r - s, q)
+    r = np.where(fix_r, -q - s, r)
+    return encode_cells(q, r)
+
+
+def cell_centers(cells, shape, size):
+    """格子中心的局部平面坐标 (n×2)"""
+    i, j = decode_cells(cells)
+    if shape == SQUARE:
+        return np.column_stack(((i + 0.5) * size, (j + 0.5) * size))
+    radius = size / _SQRT3
+    return np.column_stack((radius * (_SQRT3 * i + _SQRT3 / 2 * j), radius * 1.5 * j))
+
+
+def cell_polygons(cells, shape, size):
+    """格子外环的经纬度坐标：(n, k+1, 2) 数组，每点为 [lng, lat]，首尾闭合"""
+    centers = cell_centers(cells, shape, size)
+    if shape == SQUARE:
+        corners = np.array([[-1, -1], [1, -1], [1, 1], [-1, 1], [-1, -1]]) * (size / 2)
+    else:
+        angles = np.radians(np.arange(-30, 331, 60))
+        corners = np.column_stack((np.cos(angles), np.sin(angles))) * (size / _SQRT3)
+    ring = (centers[:, None, :] + corners[None, :, :]).reshape(-1, 2)
+    lat, lng = from_local(ring)
+    return np.stack((lng, lat), axis=-1).reshape(len(centers), len(corners), 2)
+
+
+class CountPyramid:
+    """某一 (形状, 尺寸) 下按小时分桶的格子计数"""
+
+    def __init__(self, store, shape, size):
+        self.shape = shape
+        self.size = size
+        self.version = store.version
+
+        bucket = store.time // BUCKET_SECONDS              # store.time 已升序，桶也升序
+        cell = bin_points(store.lat, store.lng, shape, size)
+        order = np.lexsort((cell, store.period, bucket))
+        bucket, period, cell = bucket[order], store.period[order], cell[order]
+
+        if len(cell):
+            new = np.ones(len(cell), dtype=bool)
+            new[1:] = ((bucket[1:] != bucket[:-1]) | (period[1:] != period[:-1])
+                       | (cell[1:] != cell[:-1]))
+            starts = np.flatnonzero(new)
+        else:
+            starts = np.empty(0, dtype=np.int64)
+        self.cell = cell[starts]
+        self.period = period[starts]
+        self.count = np.diff(np.append(starts, len(cell))).astype(np.int32)
+
+        row_bucket = bucket[starts]
+        self.buckets, first = np.unique(row_bucket, return_index=True)
+        self.bucket_offsets = np.append(first, len(row_bucket)).astype(np.int64)
+
+    def rows(self, first_bucket, end_bucket):
+        """[first_bucket, end_bucket) 对应的行区间"""
+        lo, hi = np.searchsorted(self.buckets, [first_bucket, end_bucket])
+        return int(self.bucket_offsets[lo]), int(self.bucket_offsets[hi])
+
+
+_pyramids = {}
+_lock = threading.Lock()
+
+
+def get_pyramid(store, shape, size):
+    key = (shape, size)
+    pyramid = _pyramids.get(key)
+    if pyramid is not None and pyramid.version == store.version:
+        return pyramid
+    with _lock:
+        pyramid = _pyramids.get(key)
+        if pyramid is None or pyramid.version != store.version:
+            pyramid = _pyramids[key] = CountPyramid(store, shape, size)
+        return pyramid
+
+
+def aggregate(store, shape, size, start=None, end=None, period=None):
+    """
+    [start, end)（缺省为全部数据）内、可选限定 period 的接客点分箱计数。
+    返回 (cells, counts)，按格子编号升序，只含有点的格子。
+    """
+    empty = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    code = None
+    if period:
+        code = store.period_code(period)
+        if code is None:
+            return empty
+    if not len(store):
+        return empty
+
+    lo = to_epoch(start) if start else int(store.time[0])
+    hi = to_epoch(end) if end else int(store.time[-1]) + 1
+    if lo >= hi:
+        return empty
+
+    pyramid = get_pyramid(store, shape, size)
+    first_bucket = -(-lo // BUCKET_SECONDS)
+    end_bucket = hi // BUCKET_SECONDS
+    cells, weights = [], []
+
+    # 整小时部分：预聚合计数
+    if first_bucket < end_bucket:
+        a, b = pyramid.rows(first_bucket, end_bucket)
+        keep = slice(a, b) if code is None else a + np.flatnonzero(pyramid.period[a:b] == code)
+        cells.append(pyramid.cell[keep])
+        weights.append(pyramid.count[keep])
+        edges = [(lo, first_bucket * BUCKET_SECONDS), (end_bucket * BUCKET_SECONDS, hi)]
+    else:
+        edges = [(lo, hi)]
+
+    # 两端的零头：原始点现算
+    for edge_lo, edge_hi in edges:
+        a, b = np.searchsorted(store.time, [edge_lo, edge_hi])
+        if a >= b:
+            continue
+        idx = np.arange(a, b) if code is None else a + np.flatnonzero(store.period[a:b] == code)
+        if len(idx):
+            cells.append(bin_points(store.lat[idx], store.lng[idx], shape, size))
+            weights.append(np.ones(len(idx), dtype=np.int32))
+
+    if not cells:
+        return empty
+    cells = np.concatenate(cells)
+    uniq, inverse = np.unique(cells, return_inverse=True)
+    counts = np.bincount(inverse, weights=np.concatenate(weights), minlength=len(uniq))
+    return uniq, counts.astype(np.int64)
@@ -0,0 +1,291 @@
+"""
+每个请求的热路径计时（ROADS_INSTRUMENTATION = True 时启用）。
+
+    with phase("wkb"): ...   给一段代码计时；没有进行中的请求（管理命令、
+                             聚类子进程）时直接执行，不记录
+    db                       每个数据库连接上的 execute_wrapper 记下 SQL 条数和耗时
+    render                   DRF Response 的渲染（JSON 序列化）
+
+同一阶段多次进入时耗时累加；阶段可以嵌套（比如 wkb 里没有 SQL，而快照载入的
+SQL 同时计入 db）。批量接口、异步视图交给线程池的工作通过 contextvars 带上
+当前请求，计入同一个请求。
+
+RequestTimingMiddleware 在请求结束时：
+    - 加响应头 Server-Timing: total;dur=12.3, db;dur=4.1;desc="3 queries", wkb;dur=...
+    - 向 logger "roads.requests" 以 DEBUG 级别写一行 JSON（method、route、status、毫秒数、
+      SQL 条数、字节数）；默认不输出，要看时把该 logger 调到 DEBUG
+    - 按路由累计直方图，/api/metrics/ 以 Prometheus 文本格式输出，默认只允许本机抓取
+
+直方图只在本进程内累计；多 worker 部署时每次抓取看到的是其中一个进程。
+"""
+import bisect
+import contextvars
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger("roads.requests")
+
+_current = contextvars.ContextVar("roads_request_timings", default=None)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def enabled():
+    return getattr(settings, "ROADS_INSTRUMENTATION", False)
+
+
+DEFAULT_METRICS_ALLOWED_IPS = ("127.0.0.1", "::1")
+
+
+def metrics_allowed(request):
+    """ROADS_METRICS_ALLOWED_IPS 里的地址才能抓取；显式设为 None 时不限来源"""
+    allowed = getattr(settings, "ROADS_METRICS_ALLOWED_IPS", DEFAULT_METRICS_ALLOWED_IPS)
+    return allowed is None or request.META.get("REMOTE_ADDR") in allowed
+
+
+class RequestTimings:
+    """一个请求里各阶段的累计耗时（秒）；线程池里的子任务也往这里记"""
+
+    __slots__ = ("phases", "queries", "db", "_lock")
+
+    def __init__(self):
+        self.phases = {}
+        self.queries = 0
+        self.db = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def add_query(self, seconds):
+        with self._lock:
+            self.queries += 1
+            self.db += seconds
+
+
+@contextmanager
+def phase(name):
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, perf_counter() - started)
+
+
+def wrap_context(func):
+    """
+    让线程池里执行的 func 计入当前请求（ThreadPoolExecutor 不会自动复制 contextvars）；
+    计时和 sqlprofile 的请求日志都靠它带进子线程
+    """
+    ctx = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        # 同一个 Context 不能在两个线程里同时进入，每次调用复制一份（共享同一个 RequestTimings）
+        return ctx.copy().run(func, *args, **kwargs)
+    return run
+
+
+# ---- SQL 计时 -----------------------------------------------------------------
+def _time_query(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.add_query(perf_counter() - started)
+
+
+def _attach(connection):
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+def _on_connection_created(sender, connection, **kwargs):
+    _attach(connection)
+
+
+def install():
+    """给已有和以后新建的数据库连接装上 SQL 计时（apps.ready 调用）"""
+    for conn in connections.all():
+        _attach(conn)
+    connection_created.connect(_on_connection_created, dispatch_uid="roads-instrumentation")
+
+
+# ---- 直方图 -------------------------------------------------------------------
+def _escape(value):
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _format_labels(pairs):
+    return ",".join(f'{k}="{_escape(v)}"' for k, v in pairs)
+
+
+def _format_number(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self._series = {}           # 标签值元组 -> [各桶计数..., +Inf 计数, 总和]
+
+    def observe(self, labels, value):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        # 桶不累积，输出时再累加
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self._series.items()):
+            pairs = list(zip(self.label_names, labels))
+            cumulative = 0
+            for le, n in zip((*self.buckets, float("inf")), series):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{{{_format_labels([*pairs, ("le", _format_number(le))])}}}'
+                             f" {cumulative}")
+            label_str = _format_labels(pairs)
+            lines.append(f"{self.name}_sum{{{label_str}}} {_format_number(series[-1])}")
+            lines.append(f"{self.name}_count{{{label_str}}} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.duration = Histogram(
+            "roads_request_duration_seconds", "请求总耗时（到视图返回为止）",
+            ("route", "method", "status"), LATENCY_BUCKETS)
+        self.phase = Histogram(
+            "roads_request_phase_seconds", "请求内各阶段耗时（db、render、wkb、dbscan 等）",
+            ("route", "phase"), LATENCY_BUCKETS)
+        self.queries = Histogram(
+            "roads_request_queries", "每个请求执行的 SQL 条数",
+            ("route",), QUERY_BUCKETS)
+        self.size = Histogram(
+            "roads_response_size_bytes", "响应体字节数（流式响应不计）",
+            ("route",), SIZE_BUCKETS)
+
+    def record(self, route, method, status, total, timings, size):
+        with self._lock:
+            self.duration.observe((route, method, str(status)), total)
+            self.phase.observe((route, "db"), timings.db)
+            for name, seconds in timings.phases.items():
+                self.phase.observe((route, name), seconds)
+            self.queries.observe((route,), timings.queries)
+            if size is not None:
+                self.size.observe((route,), size)
+
+    def render(self):
+        with self._lock:
+            lines = [line for h in (self.duration, self.phase, self.queries, self.size)
+                     for line in h.render()]
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+# ---- 中间件 -------------------------------------------------------------------
+def _route(request):
+    match = getattr(request, "resolver_match", None)
+    return match.route if match is not None else "<unmatched>"
+
+
+def server_timing(timings, total):
+    entries = [f"total;dur={total * 1000:.1f}",
+               f'db;dur={timings.db * 1000:.1f};desc="{timings.queries} queries"']
+    entries += [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.phases.items()]
+    return ", ".join(entries)
+
+
+class RequestTimingMiddleware:
+    """放在 MIDDLEWARE 最前面，计时覆盖其余中间件和视图"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        started = perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self._finish(request, response, timings, perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        started = perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self._finish(request, response, timings, perf_counter() - started)
+        return response
+
+    def process_template_response(self, request, response):
+        # Django 接下来调用 response.render()；DRF 的 JSON 序列化就在这里
+        timings = _current.get()
+        if timings is not None:
+            started = perf_counter()
+            response.add_post_render_callback(
+                lambda r: timings.add("render", perf_counter() - started))
+        return response
+
+    def _finish(self, request, response, timings, total):
+        route = _route(request)
+        size = None if response.streaming else len(response.content)
+        response["Server-Timing"] = server_timing(timings, total)
+        REGISTRY.record(route, request.method, response.status_code, total, timings, size)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(json.dumps({
+                "method": request.method,
+                "path": request.path,
+                "route": route,
+                "status": response.status_code,
+                "total_ms": round(total * 1000, 2),
+                "db_ms": round(timings.db * 1000, 2),
+                "queries": timings.queries,
+                "phases_ms": {k: round(v * 1000, 2) for k, v in timings.phases.items()},
+                "bytes": size,
+            }, ensure_ascii=False))
@@ -0,0 +1,175 @@
+"""
+列表接口（bfmap_ways/、roads-by-highway-type/、ways/）的键集分页和流式输出。
+
+分页：?limit=N[&after=K]，按键（gid / road_id / id）升序返回 K 之后的 N 条，
+      响应体格式不变；还有下一页时带响应头
+          Link: <…?after=<本页最后一个键>&limit=N>; rel="next"
+          X-Next-After: <本页最后一个键>
+      按键过滤而不是 OFFSET，翻到多深都只扫描一页。
+流式：?stream=json|ndjson[&after=K]，StreamingHttpResponse 边取边写：json 与
+      非流式的数组相同，ndjson 每行一条。数据库来源走 .iterator(chunk_size=STREAM_CHUNK)
+      （PostgreSQL 上是服务端游标），服务端内存与总行数无关，首批数据立即发出。
+bfmap_ways 的来源是进程内的路网快照（gid 升序），按行号切片，不查库。
+
+不传这些参数时各接口行为不变。
+"""
+import numpy as np
+from django.http import StreamingHttpResponse
+from rest_framework.response import Response
+
+from . import geomcodec
+from .payloads import encode_json
+
+STREAM_MODES = ("json", "ndjson")
+STREAM_CHUNK = 2000
+MAX_PAGE_SIZE = 10000
+
+CONTENT_TYPES = {"json": "application/json", "ndjson": "application/x-ndjson"}
+
+
+class ListingParams:
+    def __init__(self, after=None, limit=None, stream=None):
+        self.after = after
+        self.limit = limit
+        self.stream = stream
+
+    @property
+    def requested(self):
+        """是否用了分页或流式（否则走接口原来的逻辑）"""
+        return self.after is not None or self.limit is not None or self.stream is not None
+
+
+def parse(params, default_limit=None, max_limit=MAX_PAGE_SIZE):
+    """?after=&limit=&stream=；参数不合法抛 ValueError"""
+    after = params.get("after")
+    limit = params.get("limit")
+    stream = params.get("stream")
+    try:
+        after = int(after) if after else None
+        limit = int(limit) if limit else None
+    except ValueError:
+        raise ValueError("after 和 limit 必须为整数")
+    if limit is not None and not (0 < limit <= max_limit):
+        raise ValueError(f"limit 必须在 1 到 {max_limit} 之间")
+    if stream is not None:
+        if stream not in STREAM_MODES:
+            raise ValueError("stream 必须是 json 或 ndjson")
+        if limit is not None:
+            raise ValueError("stream 与 limit 不能同时使用")
+    elif limit is None and default_limit is not None:
+        limit = default_limit
+    return ListingParams(after, limit, stream)
+
+
+# ---- 数据库来源 ---------------------------------------------------------------
+def keyset(qs, key, after=None):
+    qs = qs.order_by(key)
+    if after is not None:
+        qs = qs.filter(**{f"{key}__gt": after})
+    return qs
+
+
+def page_query(qs, key, after, limit):
+    """多取一行，用来判断还有没有下一页；limit 为 None 时取 after 之后的全部"""
+    qs = keyset(qs, key, after)
+    return qs if limit is None else qs[:limit + 1]
+
+
+def split_page(rows, key, limit):
+    """page_query 的结果 → (本页的行, 下一页的 after 或 None)"""
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        return rows, rows[-1][key]
+    return rows, None
+
+
+def page(qs, key, after, limit):
+    """values() QuerySet 的一页"""
+    return split_page(list(page_query(qs, key, after, limit)), key, limit)
+
+
+def iter_chunks(qs, key, after=None, chunk_size=STREAM_CHUNK):
+    """按键升序、每 chunk_size 行一批地读出 values() QuerySet"""
+    batch = []
+    for row in keyset(qs, key, after).iterator(chunk_size=chunk_size):
+        batch.append(row)
+        if len(batch) >= chunk_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# ---- 路网快照来源（gid 升序），fmt / precision 见 geomcodec -----------------------
+def network_rows(network, after, limit):
+    """(本页的行号, 下一页的 after 或 None)"""
+    start = network.row_after(after)
+    stop = len(network) if limit is None else min(start + limit, len(network))
+    next_after = int(network.gid[stop - 1]) if start < stop < len(network) else None
+    return np.arange(start, stop), next_after
+
+
+def network_page(network, after, limit, fmt="json", precision=None):
+    idx, next_after = network_rows(network, after, limit)
+    return geomcodec.records(network, idx, fmt, precision), next_after
+
+
+def network_chunks(network, after, chunk_size=STREAM_CHUNK, fmt="json", precision=None):
+    for lo in range(network.row_after(after), len(network), chunk_size):
+        idx = np.arange(lo, min(lo + chunk_size, len(network)))
+        yield geomcodec.records(network, idx, fmt, precision)
+
+
+# ---- 输出 ---------------------------------------------------------------------
+def encode_chunk(items, mode, first):
+    """一批条目的字节：json 为数组片段（首批前加 '['，之后的批前加 ','），ndjson 每行一条"""
+    if mode == "ndjson":
+        return b"".join(encode_json(item) + b"\n" for item in items)
+    # 整批编码成数组再去掉两端的方括号，比逐条编码少很多次调用
+    return (b"[" if first else b",") + encode_json(items)[1:-1]
+
+
+def encode_stream(chunks, mode):
+    first = True
+    for items in chunks:
+        if not items:
+            continue
+        yield encode_chunk(items, mode, first)
+        first = False
+    if mode == "json":
+        yield b"]" if not first else b"[]"
+
+
+async def aencode_stream(chunks, mode):
+    first = True
+    async for items in chunks:
+        if not items:
+            continue
+        yield encode_chunk(items, mode, first)
+        first = False
+    if mode == "json":
+        yield b"]" if not first else b"[]"
+
+
+def stream_response(chunks, mode):
+    """chunks 为条目列表的（异步）可迭代对象"""
+    body = aencode_stream(chunks, mode) if hasattr(chunks, "__aiter__") else encode_stream(chunks, mode)
+    return StreamingHttpResponse(body, content_type=CONTENT_TYPES[mode])
+
+
+def next_link(request, next_after, limit):
+    query = request.GET.copy()
+    query["after"] = str(next_after)
+    query["limit"] = str(limit)
+    return request.build_absolute_uri(f"{request.path}?{query.urlencode()}")
+
+
+def with_next(response, request, next_after, limit):
+    if next_after is not None:
+        response["Link"] = f'<{next_link(request, next_after, limit)}>; rel="next"'
+        response["X-Next-After"] = str(next_after)
+    return response
+
+
+def page_response(request, items, next_after, limit):
+    return with_next(Response(items), request, next_after, limit)
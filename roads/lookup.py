@@ -0,0 +1,59 @@
+"""
+gid → road_name / highway 的共享查询，供各排行接口使用。
+
+数据直接取自进程内路网快照（network.get_network），不再为了几个路名去
+BfmapWay 里捞整行（含几何）。road_daily_count 等视图的 road_id 是 TEXT，
+查询时用 ROAD_GID 在数据库侧转成 BIGINT，Python 这边不做逐行字符串转换；
+不是整数的 road_id 转成 NULL，照样返回，路名为 UNNAMED_ROAD。
+快照的刷新见 network.invalidate()。
+"""
+import numpy as np
+from django.db.models import BigIntegerField, Case, Value, When
+from django.db.models.functions import Cast
+
+from .network import NULL_ID, get_network
+
+UNNAMED_ROAD = "未命名路段"
+
+# 在 values() 前 annotate(road_gid=ROAD_GID)，拿到整数 gid。先用正则挑出纯数字的
+# road_id 再转，否则一行脏数据就让整条查询在 PostgreSQL 上报错；18 位以内不会溢出 BIGINT
+ROAD_GID = Case(
+    When(road_id__regex=r"^-?[0-9]{1,18}$",
+         then=Cast("road_id", output_field=BigIntegerField())),
+    default=Value(None),
+    output_field=BigIntegerField(),
+)
+
+
+def _rows(network, gids):
+    gids = np.fromiter((NULL_ID if g is None else g for g in gids), dtype=np.int64)
+    return network.index_of(gids).tolist()
+
+
+def road_names(gids, network=None):
+    """gid 序列 → 路名列表；路网里没有的 gid 给 UNNAMED_ROAD"""
+    network = network or get_network()
+    return [UNNAMED_ROAD if i < 0 else network.road_name[i]
+            for i in _rows(network, gids)]
+
+
+def highway_names(gids, network=None):
+    """gid 序列 → 道路等级名（Highway.name），查不到为 None"""
+    network = network or get_network()
+    class_ids = network.class_id
+    return [None if i < 0 or class_ids[i] == NULL_ID
+            else network.highway_name(int(class_ids[i]))
+            for i in _rows(network, gids)]
+
+
+def attach_road_names(records, key="road_id"):
+    """
+    给 values() 出来的记录补 road_name 字段。
+    key 列须为整数 gid；key 不是 road_id 时视为 ROAD_GID 辅助列，补完后删掉。
+    """
+    names = road_names((r[key] for r in records))
+    for r, name in zip(records, names):
+        r["road_name"] = name
+        if key != "road_id":
+            del r[key]
+    return records
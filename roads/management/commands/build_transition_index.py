@@ -0,0 +1,41 @@
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from roads.transitions import LOAD_CHUNK, META_FILE, TransitionIndex
+
+
+class Command(BaseCommand):
+    help = (
+        "从 trip_road_data 构建路段转移矩阵和路段→轨迹倒排索引，写成 .npy 供各进程 mmap 共享；"
+        "目录里已有索引时只读入水位之后的新轨迹"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", help="输出目录，默认 settings.ROADS_TRANSITION_DIR")
+        parser.add_argument("--chunk-size", type=int, default=LOAD_CHUNK)
+        parser.add_argument("--rebuild", action="store_true", help="忽略已有索引，全部重建")
+
+    def handle(self, *args, **options):
+        output = options["output"] or getattr(settings, "ROADS_TRANSITION_DIR", None)
+        if not output:
+            raise CommandError("请用 --output 指定目录，或配置 ROADS_TRANSITION_DIR")
+
+        started = time.perf_counter()
+        index = TransitionIndex.empty()
+        if not options["rebuild"] and (Path(output) / META_FILE).exists():
+            index = TransitionIndex.open(output, mmap=False)
+            self.stdout.write(f"已有索引：{len(index.trips):,} 条轨迹，水位 {index.watermark}")
+        updated = index.extend_from_db(chunk_size=options["chunk_size"])
+        if updated is index and not options["rebuild"] and index.watermark is not None:
+            self.stdout.write("没有新轨迹")
+            return
+        loaded = time.perf_counter()
+        updated.save(output)
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(updated.trips) - len(index.trips):,} 条新轨迹，共 {len(updated.trips):,} 条、"
+            f"{len(updated.roads):,} 条路段、{updated.succ.nnz:,} 种转移 → {output}"
+            f"（读库 {loaded - started:.1f}s，写盘 {time.perf_counter() - loaded:.1f}s）"
+        ))
@@ -0,0 +1,73 @@
+import json
+import time
+from datetime import date, datetime, time as dt_time, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from roads import cluster_cache
+from roads.parallel import ClusterPool
+from roads.pickups import get_pickup_store
+
+
+class Command(BaseCommand):
+    help = "按日期把一天切成等长时间窗，多进程并行做接客点聚类，结果写入缓存并输出 NDJSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--date", action="append", dest="dates", metavar="YYYY-MM-DD",
+                            help="要聚类的日期，可重复；默认 taxi_pickups 覆盖的全部日期")
+        parser.add_argument("--step-minutes", type=int, default=60)
+        parser.add_argument("--period", help="只聚类该时段的接客点")
+        parser.add_argument("--eps", type=int, default=cluster_cache.DEFAULT_EPS)
+        parser.add_argument("--minpts", type=int, default=cluster_cache.DEFAULT_MINPTS)
+        parser.add_argument("--workers", type=int,
+                            default=getattr(settings, "ROADS_CLUSTER_WORKERS", None))
+        parser.add_argument("--output", help="NDJSON 输出文件，默认标准输出；- 为不输出")
+
+    def handle(self, *args, **options):
+        if options["step_minutes"] <= 0:
+            raise CommandError("--step-minutes 必须为正数")
+        try:
+            days = [date.fromisoformat(d) for d in options["dates"] or []]
+        except ValueError as exc:
+            raise CommandError(f"日期格式错误：{exc}")
+
+        store = get_pickup_store()
+        step = timedelta(minutes=options["step_minutes"])
+        windows = []
+        for day in days or store.dates():
+            start = datetime.combine(day, dt_time())
+            day_end = start + timedelta(days=1)
+            while start < day_end:
+                windows.append((start, min(start + step, day_end), options["period"]))
+                start += step
+
+        output = options["output"]
+        if output == "-":
+            out = None
+        elif output:
+            out = open(output, "w", encoding="utf-8")
+        else:
+            out = self.stdout
+        started = time.perf_counter()
+        try:
+            with ClusterPool(store, options["workers"]) as pool:
+                results = cluster_cache.cluster_windows(
+                    store, windows, options["eps"], options["minpts"], pool)
+                for done, (i, clusters) in enumerate(results, 1):
+                    if out is not None:
+                        start, end, period = windows[i]
+                        out.write(json.dumps({
+                            "index": i, "start": start.isoformat(), "end": end.isoformat(),
+                            "period": period, **cluster_cache.feature_collection(clusters),
+                        }, ensure_ascii=False) + "\n")
+                    if done % 100 == 0:
+                        self.stderr.write(f"{done}/{len(windows)}")
+        finally:
+            if out is not None and out is not self.stdout:
+                out.close()
+
+        self.stderr.write(self.style.SUCCESS(
+            f"{len(windows)} 个时间窗，{pool.workers} 个进程，"
+            f"{time.perf_counter() - started:.1f}s"
+        ))
@@ -0,0 +1,52 @@
+import time
+from dataclasses import fields
+from datetime import date
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from roads import benchdata
+
+
+class Command(BaseCommand):
+    help = (
+        "生成哈尔滨规模的合成数据集（路网、流量、排行、接客点、轨迹），供 run_benchmark 使用；"
+        "会清空并覆盖这些表，只能在 settings_benchmark 声明的基准库上运行"
+    )
+
+    def add_arguments(self, parser):
+        defaults = benchdata.Dataset()
+        for f in fields(benchdata.Dataset):
+            if f.name == "start":
+                continue
+            parser.add_argument(f"--{f.name.replace('_', '-')}", type=int,
+                                default=getattr(defaults, f.name))
+        parser.add_argument("--start", type=date.fromisoformat, default=defaults.start,
+                            metavar="YYYY-MM-DD")
+        parser.add_argument("--noinput", "--no-input", action="store_false", dest="interactive",
+                            help="不询问确认")
+
+    def handle(self, *args, **options):
+        ds = benchdata.Dataset(**{f.name: options[f.name] for f in fields(benchdata.Dataset)})
+        # --noinput 只跳过确认，不跳过这项检查
+        try:
+            benchdata.check_target()
+        except benchdata.UnsafeDatabase as e:
+            raise CommandError(str(e))
+        if options["interactive"]:
+            db = settings.DATABASES[DEFAULT_DB_ALIAS]
+            answer = input(
+                f"将清空 {db.get('HOST') or 'localhost'}/{db['NAME']} 的 bfmap_ways、road_*、"
+                "taxi_pickups、trip_road_data 等表并写入合成数据。\n"
+                "输入 'yes' 继续：")
+            if answer != "yes":
+                raise CommandError("已取消")
+
+        started = time.perf_counter()
+        counts = benchdata.generate(ds, progress=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(
+            f"共 {sum(counts.values()):,} 行，{time.perf_counter() - started:.1f}s；"
+            f"参数 {ds.to_json()}"
+        ))
+        self.stdout.write("内存里的路网快照、排行缓存、接客点仓库、转移索引需要重建（或重启进程）")
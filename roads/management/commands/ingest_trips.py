@@ -0,0 +1,190 @@
+import csv
+import glob
+import io
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from roads.trips import CHUNK_ROWS, convert_file
+
+TABLE = "trip_road_data"
+STATE_FILE = "ingest_state.json"
+COPY_BUFFER = 1 << 20
+
+
+class _NumberedCSV(io.TextIOBase):
+    """把中间 CSV 的每条记录前面加上 id 列，供 copy_expert 按块读取"""
+
+    def __init__(self, f, first_id):
+        self._rows = enumerate(csv.reader(f), first_id)
+        self._buf = io.StringIO()
+        self._writer = csv.writer(self._buf, lineterminator="\n")
+        self._pending = ""
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        size = COPY_BUFFER if size is None or size < 0 else size
+        while len(self._pending) < size:
+            for row_id, row in self._rows:
+                self._writer.writerow([row_id, *row])
+                if self._buf.tell() >= size:
+                    break
+            chunk = self._buf.getvalue()
+            if not chunk:
+                break
+            self._pending += chunk
+            self._buf.seek(0)
+            self._buf.truncate()
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+
+def _rate(count, seconds):
+    return f"{count / seconds:,.0f}" if seconds > 0 else "-"
+
+
+class Command(BaseCommand):
+    help = (
+        "把轨迹 CSV（trips 列）解析后用 COPY 导入 trip_road_data，替代 process_traj.ipynb。"
+        "多个文件并行解析、按顺序入库；中断后重新执行会跳过已入库的文件"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", help="轨迹 CSV 文件或通配符，如 trips/trips01*_data.csv")
+        parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) - 1))
+        parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+        parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "harbin_ingest_trips"),
+                            help="中间文件和断点状态所在目录")
+        parser.add_argument("--replace", action="store_true",
+                            help="清空 trip_road_data 后重新导入（同 notebook 的 if_exists='replace'）")
+        parser.add_argument("--keep-staging", action="store_true", help="入库后保留中间 CSV")
+
+    def handle(self, *args, **options):
+        paths = []
+        for pattern in options["paths"]:
+            matched = sorted(glob.glob(pattern)) or [pattern]
+            paths.extend(os.path.abspath(p) for p in matched)
+        paths = list(dict.fromkeys(paths))
+        missing = [p for p in paths if not os.path.isfile(p)]
+        if missing:
+            raise CommandError(f"文件不存在：{', '.join(missing)}")
+
+        work_dir = Path(options["work_dir"])
+        work_dir.mkdir(parents=True, exist_ok=True)
+        state_path = work_dir / STATE_FILE
+        state = self._load_state(state_path, options["replace"])
+        if state["next_id"] is None:
+            with connection.cursor() as cursor:
+                state["next_id"] = 0
+                if TABLE in connection.introspection.table_names(cursor):
+                    cursor.execute(f"SELECT COALESCE(MAX(id) + 1, 0) FROM {TABLE}")
+                    state["next_id"] = cursor.fetchone()[0]
+        # 起始 id 先落盘：之后任何时候中断，重跑都从同一个 id 开始，可按区间清理残留
+        self._save_state(state_path, state)
+
+        started = time.perf_counter()
+        todo = [p for p in paths if not self._is_loaded(state, p)]
+        for p in paths:
+            if p not in todo:
+                self.stdout.write(f"跳过（已入库）：{p}")
+        if not todo:
+            return
+
+        with ProcessPoolExecutor(max_workers=min(options["workers"], len(todo))) as pool:
+            # 并行解析；入库必须按文件顺序，id 才是确定的，中断后重跑结果一致
+            futures = [
+                pool.submit(convert_file, p, str(work_dir / f"{i:04d}-{Path(p).stem}.staging.csv"),
+                            options["chunk_rows"])
+                for i, p in enumerate(todo)
+            ]
+            totals = {"rows_in": 0, "rows": 0, "bytes": 0, "parse": 0.0, "load": 0.0}
+            for future in futures:
+                stats = future.result()
+                load_seconds = self._load(stats, state)
+                self._save_state(state_path, state)
+                if not options["keep_staging"]:
+                    os.remove(stats["staging"])
+
+                totals["rows_in"] += stats["rows_in"]
+                totals["rows"] += stats["rows"]
+                totals["bytes"] += stats["bytes"]
+                totals["parse"] += stats["seconds"]
+                totals["load"] += load_seconds
+                self.stdout.write(
+                    f"{Path(stats['path']).name}: 解析 {stats['rows_in']:,} → {stats['rows']:,} 行 "
+                    f"({_rate(stats['rows_in'], stats['seconds'])} 行/s, "
+                    f"{stats['bytes'] / 2 ** 20 / max(stats['seconds'], 1e-9):.1f} MB/s)，"
+                    f"COPY {_rate(stats['rows'], load_seconds)} 行/s"
+                )
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(todo)} 个文件，{totals['rows']:,} 行入库，总耗时 {elapsed:.1f}s"
+            f"（整体 {_rate(totals['rows_in'], elapsed)} 行/s；"
+            f"解析累计 {totals['parse']:.1f}s，COPY 累计 {totals['load']:.1f}s）"
+        ))
+
+    # ---- 断点状态 ----------------------------------------------------------
+    def _load_state(self, path, replace):
+        if replace:
+            with connection.cursor() as cursor:
+                if TABLE in connection.introspection.table_names(cursor):
+                    cursor.execute(f"TRUNCATE {TABLE}")
+            return {"next_id": 0, "files": {}}
+        if path.exists():
+            return json.loads(path.read_text(encoding="utf-8"))
+        return {"next_id": None, "files": {}}
+
+    def _save_state(self, path, state):
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _fingerprint(path):
+        st = os.stat(path)
+        return {"size": st.st_size, "mtime": st.st_mtime_ns}
+
+    def _is_loaded(self, state, path):
+        done = state["files"].get(path)
+        return done is not None and all(done.get(k) == v for k, v in self._fingerprint(path).items())
+
+    # ---- 入库 --------------------------------------------------------------
+    def _ensure_table(self, cursor, columns):
+        if TABLE in connection.introspection.table_names(cursor):
+            return
+        # 与 to_sql 建出的表同名同列；类型未知的原始列一律 TEXT
+        defs = ", ".join(f"{connection.ops.quote_name(c)} TEXT" for c in columns)
+        cursor.execute(f"CREATE TABLE {TABLE} ({defs}, id BIGINT)")
+
+    def _load(self, stats, state):
+        """一个文件一个事务：先删掉本文件要用的 id 区间（上次中断的残留）和它以前导入的行，再 COPY"""
+        started = time.perf_counter()
+        quote = connection.ops.quote_name
+        columns = ", ".join(quote(c) for c in ["id", *stats["columns"]])
+        with transaction.atomic(), connection.cursor() as cursor:
+            self._ensure_table(cursor, stats["columns"])
+            first_id = state["next_id"]
+            ranges = [(first_id, first_id + stats["rows"])]
+            previous = state["files"].get(stats["path"])
+            if previous is not None:            # 文件内容变了：旧数据一并删掉
+                ranges.append((previous["first_id"], previous["first_id"] + previous["rows"]))
+            for lo, hi in ranges:
+                cursor.execute(f"DELETE FROM {TABLE} WHERE id >= %s AND id < %s", [lo, hi])
+            with open(stats["staging"], newline="", encoding="utf-8") as f:
+                cursor.copy_expert(f"COPY {TABLE} ({columns}) FROM STDIN WITH (FORMAT csv)",
+                                   _NumberedCSV(f, first_id), size=COPY_BUFFER)
+
+        state["next_id"] = first_id + stats["rows"]
+        state["files"][stats["path"]] = {
+            **self._fingerprint(stats["path"]), "first_id": first_id, "rows": stats["rows"],
+        }
+        return time.perf_counter() - started
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from roads import refresh
+
+
+class Command(BaseCommand):
+    help = (
+        "增量刷新流量物化视图：索引新导入的轨迹，只重算受影响 biz_date 的逐日汇总表，"
+        "再按 ROADS_REFRESH_VIEWS 并行刷新视图"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--date", action="append", dest="dates", metavar="YYYY-MM-DD",
+                            help="额外强制重算的日期，可重复")
+        parser.add_argument("--view", action="append", dest="views", metavar="NAME",
+                            help="只刷新这些视图（同一阶段并行），可重复；默认 ROADS_REFRESH_VIEWS")
+        parser.add_argument("--no-views", action="store_true", help="只重算逐日汇总表，不刷新物化视图")
+
+    def handle(self, *args, **options):
+        try:
+            dates = refresh.parse_dates(options["dates"])
+        except ValueError as exc:
+            raise CommandError(f"日期格式错误：{exc}")
+        views = [] if options["no_views"] else ([options["views"]] if options["views"] else None)
+
+        try:
+            log = refresh.run(trigger="command", dates=dates, views=views,
+                              progress=self.stdout.write)
+        except refresh.RefreshBusy as exc:
+            raise CommandError(str(exc))
+        seconds = (log.finished_at - log.started_at).total_seconds()
+        self.stdout.write(self.style.SUCCESS(
+            f"刷新 #{log.pk} 完成：{len(log.dates)} 天，{len(log.views)} 个视图，{seconds:.1f}s"
+        ))
@@ -0,0 +1,106 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from roads import benchdata, benchmark
+
+DEFAULT_OUTPUT = "benchmarks/latest.json"
+BASELINE = "benchmarks/baseline.json"       # 在 PostGIS 基准库上生成，不提交（见 roads/benchmark.py）
+
+
+class Command(BaseCommand):
+    help = (
+        "逐个请求 roads/urls.py 的接口，记录 p50/p95/p99、SQL 条数、响应大小和峰值 RSS，"
+        "写成 JSON；--baseline 与之前的结果比较"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=20, help="每个场景计时的请求次数")
+        parser.add_argument("--warmup", type=int, default=1, help="计时前的预热请求次数")
+        parser.add_argument("--only", action="append", metavar="NAME",
+                            help="只跑这些场景，可重复")
+        parser.add_argument("--list", action="store_true", help="列出场景后退出")
+        parser.add_argument("--output", default=DEFAULT_OUTPUT, help=f"结果文件，默认 {DEFAULT_OUTPUT}")
+        parser.add_argument("--baseline", help=f"与这个结果文件比较，如 {BASELINE}")
+        parser.add_argument("--tolerance", type=float, default=0.2,
+                            help="p95 和响应大小允许的相对增幅，默认 0.2")
+        parser.add_argument("--fail-on-regression", action="store_true",
+                            help="有回归时以非零状态退出")
+        parser.add_argument("--strict", action="store_true",
+                            help="有接口没有基准场景时报错退出（默认只警告）")
+
+    def handle(self, *args, **options):
+        try:
+            benchdata.check_target()
+        except benchdata.UnsafeDatabase as e:
+            raise CommandError(str(e))
+        meta = benchdata.load_meta()
+        if meta is None:
+            raise CommandError("库里没有基准数据集，先运行 generate_benchmark_data")
+        ds = benchdata.Dataset.from_json(meta["dataset"])
+
+        scenario_list = benchmark.scenarios(ds)
+        missing = benchmark.uncovered(scenario_list)
+        if missing:
+            message = f"这些接口没有基准场景，请在 roads/benchmark.py 里补上：{missing}"
+            if options["strict"]:
+                raise CommandError(message)
+            self.stderr.write(f"警告：{message}")
+        if options["list"]:
+            for s in scenario_list:
+                self.stdout.write(f"{s.name:28} {s.method:4} {s.url}")
+            return
+        if options["only"]:
+            unknown = set(options["only"]) - {s.name for s in scenario_list}
+            if unknown:
+                raise CommandError(f"未知场景：{sorted(unknown)}")
+            scenario_list = [s for s in scenario_list if s.name in options["only"]]
+        if options["repeat"] <= 0 or options["warmup"] < 0:
+            raise CommandError("--repeat 必须为正数，--warmup 不能为负")
+
+        try:
+            benchmark.prepare()
+        except Exception as e:
+            self.stderr.write(f"警告：路段转移索引没有建好，转移接口会返回 503：{e!r}")
+        client = benchmark.client()
+        results = {}
+        for s in scenario_list:
+            r = results[s.name] = benchmark.run_scenario(
+                client, s, repeat=options["repeat"], warmup=options["warmup"])
+            self.stdout.write(
+                f"{s.name:28} {r['status']}  p50 {r['p50_ms']:>9.2f}ms  p95 {r['p95_ms']:>9.2f}ms  "
+                f"p99 {r['p99_ms']:>9.2f}ms  {r['queries']:>3} SQL  {r['bytes']:>11,} B")
+
+        output = Path(options["output"])
+        output.parent.mkdir(parents=True, exist_ok=True)
+        benchmark.dump({
+            "environment": benchmark.environment(),
+            "dataset": meta,
+            "repeat": options["repeat"],
+            "warmup": options["warmup"],
+            "results": results,
+        }, output)
+        self.stdout.write(f"结果写入 {output}")
+        errors = benchmark.failed(results)
+        if errors:
+            self.stderr.write(f"警告：这些场景返回 4xx/5xx，结果不能作为基线：{errors}")
+
+        if not options["baseline"]:
+            return
+        try:
+            baseline = benchmark.load(options["baseline"])
+        except FileNotFoundError:
+            raise CommandError(f"没有基线文件 {options['baseline']}；先在 PostGIS 基准库上用 "
+                               "run_benchmark --output 生成（见 roads/benchmark.py）")
+        if baseline.get("dataset", {}).get("dataset") != meta["dataset"]:
+            self.stderr.write("警告：基线用的数据集参数不同，比较结果仅供参考")
+        before = baseline.get("environment", {}).get("database")
+        if before != benchmark.environment()["database"]:
+            self.stderr.write(f"警告：基线是在 {before} 上生成的，比较结果仅供参考")
+        regressions = benchmark.compare(results, baseline["results"], tolerance=options["tolerance"])
+        for name, metric, before, after in regressions:
+            self.stdout.write(self.style.ERROR(f"回归 {name}.{metric}: {before} → {after}"))
+        if not regressions:
+            self.stdout.write(self.style.SUCCESS("与基线相比没有回归"))
+        elif options["fail_on_regression"]:
+            raise CommandError(f"{len(regressions)} 项回归")
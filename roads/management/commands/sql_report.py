@@ -0,0 +1,49 @@
+import shutil
+
+from django.core.management.base import BaseCommand, CommandError
+
+from roads import sqlprofile
+
+
+class Command(BaseCommand):
+    help = (
+        "汇总 ROADS_SQL_PROFILE 写下的按接口 SQL 报告：每个接口的请求数、SQL 条数、"
+        "有标记的语句（slow/repeated/oversized/unbounded/wide）和 EXPLAIN 里的顺序扫描"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dir", help="报告目录，默认 settings.ROADS_SQL_PROFILE_DIR")
+        parser.add_argument("--route", help="只看路由里包含这个字符串的接口")
+        parser.add_argument("--top", type=int, default=5, help="每个接口列出耗时最多的几条语句")
+        parser.add_argument("--all", action="store_true", help="也列出没有标记的语句")
+        parser.add_argument("--clear", action="store_true", help="删除已有报告后退出")
+
+    def handle(self, *args, **options):
+        directory = options["dir"] or sqlprofile.profile_dir()
+        if options["clear"]:
+            shutil.rmtree(directory, ignore_errors=True)
+            self.stdout.write(f"已清空 {directory}")
+            return
+        reports = sqlprofile.load_reports(directory)
+        if options["route"]:
+            reports = [r for r in reports if options["route"] in r["route"]]
+        if not reports:
+            raise CommandError(f"{directory} 里没有报告（ROADS_SQL_PROFILE 是否打开？）")
+
+        reports.sort(key=lambda r: -r["db_ms"])
+        for r in reports:
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"{r['route']}  {r['requests']} 次请求，平均 {r['queries'] / r['requests']:.1f} 条 SQL"
+                f"（最多 {r['max_queries_per_request']}），SQL 共 {r['db_ms']:.1f}ms"))
+            statements = [s for s in r["statements"] if options["all"] or s["flags"]]
+            for s in statements[:options["top"]]:
+                flags = ",".join(s["flags"]) or "-"
+                self.stdout.write(
+                    f"  [{flags}] ×{s['calls']}（单次请求最多 {s['max_per_request']}），"
+                    f"共 {s['total_ms']:.1f}ms，最慢 {s['max_ms']:.1f}ms，最多 {s['max_rows']} 行"
+                    f"  {s['source'] or ''}")
+                self.stdout.write(f"      {s['fingerprint'][:300]}")
+                for scan in s["seq_scans"]:
+                    self.stdout.write(self.style.WARNING(
+                        f"      Seq Scan {scan['relation']}  Filter: {scan['filter']}"
+                        f"（{scan['rows']} 行，过滤掉 {scan['rows_removed']} 行）"))
@@ -0,0 +1,34 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from roads import cluster_cache
+from roads.pickups import get_pickup_store
+
+
+class Command(BaseCommand):
+    help = "按日期预算标准高峰窗口（ROADS_STANDARD_PEAK_WINDOWS）的接客点聚类，写入共享结果缓存"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--eps", type=int, default=cluster_cache.DEFAULT_EPS)
+        parser.add_argument("--minpts", type=int, default=cluster_cache.DEFAULT_MINPTS)
+        parser.add_argument("--date", action="append", dest="dates", metavar="YYYY-MM-DD",
+                            help="只预热指定日期，可重复；默认 taxi_pickups 覆盖的全部日期")
+
+    def handle(self, *args, **options):
+        try:
+            days = [date.fromisoformat(d) for d in options["dates"] or []]
+        except ValueError as exc:
+            raise CommandError(f"日期格式错误：{exc}")
+        if cluster_cache.shared_cache() is None:
+            self.stderr.write(self.style.WARNING(
+                "未配置 ROADS_CLUSTER_CACHE_ALIAS，结果只留在本进程内，Web 进程无法复用"))
+
+        started = time.perf_counter()
+        store = get_pickup_store()
+        computed = cluster_cache.warm(store, options["eps"], options["minpts"], days or None)
+        self.stdout.write(self.style.SUCCESS(
+            f"新算 {computed} 个窗口（eps={options['eps']} minpts={options['minpts']}，"
+            f"{time.perf_counter() - started:.1f}s）"
+        ))
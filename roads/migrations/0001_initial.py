@@ -0,0 +1,110 @@
+from django.db import migrations, models, transaction
+from django.db.utils import DatabaseError
+
+# 流量物化视图的唯一索引，REFRESH MATERIALIZED VIEW CONCURRENTLY 需要它。
+# 视图本身（定义在库里）不动；键上有重复行的视图建不了索引，跳过，照常整体刷新
+VIEW_KEYS = {
+    "road_hourly_flow": "biz_date, road_id, hour",
+    "road_day_flow": "biz_date, road_id",
+    "road_daily_count": "date, road_id",
+    "road_hourly_count": "date, road_id, hour_of_day",
+    "road_peak_period_count": "road_id, peak_period",
+    "road_duration_stats": "road_id, duration_category",
+}
+
+
+def _matviews(cursor):
+    cursor.execute("SELECT matviewname FROM pg_matviews WHERE schemaname = current_schema()")
+    return {row[0] for row in cursor.fetchall()} & set(VIEW_KEYS)
+
+
+def add_view_keys(apps, schema_editor):
+    """只在 PostgreSQL 上执行；没有这些物化视图的库（基准库、测试库）什么也不做"""
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for name in sorted(_matviews(cursor)):
+            try:
+                with transaction.atomic(using=schema_editor.connection.alias):
+                    cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {name}_key "
+                                   f"ON {name} ({VIEW_KEYS[name]})")
+            except DatabaseError:
+                pass
+
+
+def drop_view_keys(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for name in sorted(_matviews(cursor)):
+            cursor.execute(f"DROP INDEX IF EXISTS {name}_key")
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FlowRefreshLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigger', models.CharField(max_length=20)),
+                ('status', models.CharField(default='running', max_length=20)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(null=True)),
+                ('from_trip_id', models.BigIntegerField(null=True)),
+                ('to_trip_id', models.BigIntegerField(null=True)),
+                ('dates', models.JSONField(default=list)),
+                ('views', models.JSONField(default=list)),
+                ('detail', models.TextField(blank=True)),
+            ],
+            options={
+                'db_table': 'flow_refresh_log',
+                'ordering': ('-started_at',),
+            },
+        ),
+        migrations.CreateModel(
+            name='TripDayIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trip_id', models.BigIntegerField()),
+                ('biz_date', models.DateField(db_index=True)),
+            ],
+            options={
+                'db_table': 'trip_day_index',
+                'unique_together': {('trip_id', 'biz_date')},
+            },
+        ),
+        migrations.CreateModel(
+            name='RoadHourTripCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('biz_date', models.DateField()),
+                ('road_id', models.BigIntegerField()),
+                ('hour', models.PositiveSmallIntegerField()),
+                ('trip_cnt', models.IntegerField()),
+            ],
+            options={
+                'db_table': 'road_hour_trip_counts',
+                'unique_together': {('biz_date', 'road_id', 'hour')},
+            },
+        ),
+        migrations.CreateModel(
+            name='RoadDayTripCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('biz_date', models.DateField()),
+                ('road_id', models.BigIntegerField()),
+                ('trip_cnt', models.IntegerField()),
+            ],
+            options={
+                'db_table': 'road_day_trip_counts',
+                'unique_together': {('biz_date', 'road_id')},
+            },
+        ),
+        migrations.RunPython(add_view_keys, drop_view_keys),
+    ]
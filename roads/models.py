@@ -127,4 +127,61 @@ class TaxiPickup(models.Model):
 
     class Meta:
         db_table = 'taxi_pickups'
-        managed = False
\ No newline at end of file
+        managed = False
+
+# ---- 增量刷新（roads/refresh.py）用到的表，由 Django 管理 ----------------------
+# 上面 road_hourly_flow 到 road_duration_stats 仍是物化视图，定义在库里；
+# 下面两张逐日汇总表按受影响的 biz_date 增量维护，供视图改写到其上
+
+class RoadHourTripCount(models.Model):
+    """按 biz_date 维护的逐小时路段通行轨迹数"""
+    biz_date = models.DateField()
+    road_id  = models.BigIntegerField()
+    hour     = models.PositiveSmallIntegerField()   # 0-23
+    trip_cnt = models.IntegerField()
+
+    class Meta:
+        db_table = 'road_hour_trip_counts'
+        unique_together = (('biz_date', 'road_id', 'hour'),)
+
+
+class RoadDayTripCount(models.Model):
+    """按 biz_date 维护的逐日路段通行轨迹数（一条轨迹一天只算一次，不能由逐小时相加）"""
+    biz_date = models.DateField()
+    road_id  = models.BigIntegerField()
+    trip_cnt = models.IntegerField()
+
+    class Meta:
+        db_table = 'road_day_trip_counts'
+        unique_together = (('biz_date', 'road_id'),)
+
+
+class TripDayIndex(models.Model):
+    """trip_road_data 里每条轨迹经过的 biz_date，按日期重算时只取这些轨迹"""
+    trip_id  = models.BigIntegerField()
+    biz_date = models.DateField(db_index=True)
+
+    class Meta:
+        db_table = 'trip_day_index'
+        unique_together = (('trip_id', 'biz_date'),)
+
+
+class FlowRefreshLog(models.Model):
+    """每次增量刷新的记录：处理了哪些轨迹、重算了哪些日期、刷新了哪些视图"""
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCESS = 'success'
+    STATUS_FAILED  = 'failed'
+
+    trigger     = models.CharField(max_length=20)            # command / api
+    status      = models.CharField(max_length=20, default=STATUS_RUNNING)
+    started_at  = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True)
+    from_trip_id = models.BigIntegerField(null=True)         # 本次处理的 trip_road_data.id 区间 (from, to]
+    to_trip_id   = models.BigIntegerField(null=True)
+    dates       = models.JSONField(default=list)             # 重算的 biz_date
+    views       = models.JSONField(default=list)             # [{"name", "seconds", "concurrently"}]
+    detail      = models.TextField(blank=True)
+
+    class Meta:
+        db_table = 'flow_refresh_log'
+        ordering = ('-started_at',)
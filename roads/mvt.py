@@ -0,0 +1,116 @@
+"""
+最小化的 Mapbox Vector Tile (v2.1) 编码器，只覆盖路网用到的 LineString 图层。
+
+直接手写 protobuf，避免为一个图层引入 mapbox-vector-tile/protobuf 依赖。
+规范见 https://github.com/mapbox/vector-tile-spec/tree/master/2.1
+"""
+import struct
+
+import numpy as np
+
+EXTENT = 4096
+
+_LINESTRING = 2
+_CMD_MOVE_TO = 1
+_CMD_LINE_TO = 2
+
+
+def _varint(n):
+    out = bytearray()
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def _key(field, wire_type):
+    return _varint((field << 3) | wire_type)
+
+
+def _bytes_field(field, payload):
+    return _key(field, 2) + _varint(len(payload)) + payload
+
+
+def _packed(field, values):
+    return _bytes_field(field, b"".join(_varint(v) for v in values))
+
+
+def _zigzag(a):
+    a = a.astype(np.int64)
+    return (a << 1) ^ (a >> 63)
+
+
+def _value(v):
+    if isinstance(v, bool):
+        return _key(7, 0) + _varint(int(v))
+    if isinstance(v, int):
+        if v >= 0:
+            return _key(5, 0) + _varint(v)
+        return _key(6, 0) + _varint(int(_zigzag(np.array([v]))[0]))
+    if isinstance(v, float):
+        return _key(3, 1) + struct.pack("<d", v)
+    return _bytes_field(1, str(v).encode("utf-8"))
+
+
+def line_commands(parts):
+    """parts: 整数瓦片坐标的 (k×2) 数组列表 → geometry 命令序列（游标跨 part 连续）"""
+    commands = []
+    cursor = np.zeros(2, dtype=np.int64)
+    for xy in parts:
+        deltas = np.diff(xy, axis=0, prepend=cursor[None, :])
+        cursor = xy[-1]
+        zz = _zigzag(deltas).ravel().tolist()
+        commands.append((1 << 3) | _CMD_MOVE_TO)
+        commands.extend(zz[:2])
+        commands.append(((len(xy) - 1) << 3) | _CMD_LINE_TO)
+        commands.extend(zz[2:])
+    return commands
+
+
+class Layer:
+    def __init__(self, name, extent=EXTENT):
+        self.name = name
+        self.extent = extent
+        self._keys = {}
+        self._values = {}
+        self._features = []
+
+    def _index(self, table, item):
+        idx = table.get(item)
+        if idx is None:
+            idx = table[item] = len(table)
+        return idx
+
+    def add_line(self, fid, parts, properties):
+        """parts 为空时忽略；properties 中的 None 值不编码"""
+        if not parts:
+            return
+        tags = []
+        for k, v in properties.items():
+            if v is None:
+                continue
+            tags.append(self._index(self._keys, k))
+            tags.append(self._index(self._values, (type(v).__name__, v)))
+        feature = (
+            _key(1, 0) + _varint(fid)
+            + _packed(2, tags)
+            + _key(3, 0) + _varint(_LINESTRING)
+            + _packed(4, line_commands(parts))
+        )
+        self._features.append(feature)
+
+    def __len__(self):
+        return len(self._features)
+
+    def encode(self):
+        out = [_key(15, 0) + _varint(2), _bytes_field(1, self.name.encode("utf-8"))]
+        out.extend(_bytes_field(2, f) for f in self._features)
+        out.extend(_bytes_field(3, k.encode("utf-8")) for k in self._keys)
+        out.extend(_bytes_field(4, _value(v)) for _, v in self._values)
+        out.append(_key(5, 0) + _varint(self.extent))
+        return b"".join(out)
+
+
+def encode_tile(layers):
+    return b"".join(_bytes_field(3, layer.encode()) for layer in layers if len(layer))
@@ -0,0 +1,307 @@
+"""
+路网快照：把 bfmap_ways 整表一次性载入进程内存，按列存放。
+
+    gid / osm_id / class_id  -> NumPy int64 数组（按 gid 升序，NULL 记为 NULL_ID）
+    road_name                -> Python list
+    几何                      -> offsets(int64, n+1) + coords(float64, m×2)
+                                第 i 条路的坐标为 coords[offsets[i]:offsets[i+1]]
+
+快照在第一次使用时构建；之后每隔 ROADS_NETWORK_CHECK_INTERVAL 秒核对一次
+bfmap_ways 和 highway 的内容签名（见 _signature），变了才重建。通过 ORM 改动
+BfmapWay / Highway 时由 signals 直接标脏。
+"""
+import hashlib
+import itertools
+import threading
+import time
+
+import numpy as np
+import shapely
+from django.conf import settings
+from django.contrib.gis.db.models.functions import AsWKB
+from django.db import connection
+
+from .geo import metres_per_degree
+from .instrumentation import phase
+from .models import BfmapWay, Highway
+from .search import RoadNameIndex
+
+NULL_ID = -1
+
+_versions = itertools.count(1)
+
+
+def _int_column(values):
+    return np.array([NULL_ID if v is None else v for v in values], dtype=np.int64)
+
+
+def _nullable(v):
+    return None if v == NULL_ID else v
+
+
+class RoadNetwork:
+    def __init__(self, gid, osm_id, class_id, road_name, offsets, coords,
+                 highways, signature, geoms=None):
+        self.gid = gid
+        self.osm_id = osm_id
+        self.class_id = class_id
+        self.road_name = road_name
+        self.offsets = offsets
+        self.coords = coords
+        self.highways = highways          # {class_id: {"name":…, "priority":…}}
+        self.signature = signature
+        self.version = next(_versions)    # 进程内递增，派生缓存用它做 key
+        self.built_at = time.time()
+        self._name_index = None
+        self._fingerprint = None
+        self._geoms = geoms
+        self._tree = None
+        self._tree_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.gid)
+
+    # ---- 定位 ------------------------------------------------------------
+    def index_of(self, gids):
+        """gid 数组 → 行号数组，不存在的 gid 返回 -1"""
+        gids = np.asarray(gids, dtype=np.int64)
+        idx = np.searchsorted(self.gid, gids)
+        idx[idx >= len(self.gid)] = 0
+        found = self.gid[idx] == gids if len(self.gid) else np.zeros(len(gids), bool)
+        return np.where(found, idx, -1)
+
+    def row_after(self, gid=None):
+        """gid 大于给定值的第一行（gid 升序，键集分页用）；None 为第 0 行"""
+        return 0 if gid is None else int(np.searchsorted(self.gid, gid, side="right"))
+
+    def coords_of(self, i):
+        return self.coords[self.offsets[i]:self.offsets[i + 1]]
+
+    def highway_name(self, class_id):
+        h = self.highways.get(class_id)
+        return h["name"] if h else None
+
+    @property
+    def fingerprint(self):
+        """内容摘要，跨进程稳定，可用于磁盘缓存目录名"""
+        if self._fingerprint is None:
+            h = hashlib.blake2b(digest_size=16)
+            for arr in (self.gid, self.osm_id, self.class_id, self.offsets, self.coords):
+                h.update(np.ascontiguousarray(arr).tobytes())
+            h.update("\x00".join(n or "" for n in self.road_name).encode("utf-8"))
+            h.update(repr(sorted(self.highways.items())).encode("utf-8"))
+            self._fingerprint = h.hexdigest()
+        return self._fingerprint
+
+    # ---- 空间索引 ----------------------------------------------------------
+    @property
+    def geoms(self):
+        """shapely LineString 数组（无几何的行为 None），与行号一一对应"""
+        if self._geoms is None:
+            geoms = np.full(len(self.gid), None, dtype=object)
+            lengths = np.diff(self.offsets)
+            has = lengths >= 2
+            if has.any():
+                owner = np.repeat(np.arange(len(self.gid)), lengths)
+                keep = has[owner]
+                geoms[has] = shapely.linestrings(
+                    self.coords[keep], indices=np.cumsum(has)[owner[keep]] - 1)
+            self._geoms = geoms
+        return self._geoms
+
+    @property
+    def tree(self):
+        """按行号建的 STRtree；首次空间查询时构建，每个快照只建一次"""
+        if self._tree is None:
+            with self._tree_lock:
+                if self._tree is None:
+                    self._tree = shapely.STRtree(self.geoms)
+        return self._tree
+
+    def query_bbox(self, minx, miny, maxx, maxy):
+        """与经纬度矩形相交的行号（升序）"""
+        hits = self.tree.query(shapely.box(minx, miny, maxx, maxy), predicate="intersects")
+        return np.sort(hits)
+
+    def nearest(self, lng, lat, k=1, candidates=None):
+        """
+        距 (lng, lat) 最近的 k 条路，返回 (行号数组, 距离数组/米)。
+        candidates 为可选的行号白名单（其它条件筛过的结果）。
+        """
+        allowed = None
+        if candidates is not None:
+            allowed = np.zeros(len(self.gid), dtype=bool)
+            allowed[candidates] = True
+            k = min(k, int(allowed.sum()))
+        if k <= 0 or not len(self.gid):
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        kx, ky = metres_per_degree(lat)
+        radius = 200.0                                     # 米，不够就翻倍
+        while True:
+            dx, dy = radius / kx, radius / ky
+            hits = self.tree.query(shapely.box(lng - dx, lat - dy, lng + dx, lat + dy))
+            if allowed is not None:
+                hits = hits[allowed[hits]]
+            if len(hits) >= k or radius > 2e5:
+                local = shapely.transform(
+                    self.geoms[hits], lambda c: (c - (lng, lat)) * (kx, ky))
+                dist = shapely.distance(local, shapely.Point(0.0, 0.0))
+                order = np.argsort(dist, kind="stable")[:k]
+                # 框内的第 k 近若超出半径，框外可能还有更近的，扩大再查
+                if radius > 2e5 or (len(order) == k and dist[order[-1]] <= radius):
+                    return hits[order], dist[order]
+            radius *= 2
+
+    # ---- 筛选 ------------------------------------------------------------
+    def select(self, gid=None, osm_id=None, class_id=None, road_name=None):
+        """原 filter_bfmap_ways 的 ORM 条件，返回行号数组；road_name 的匹配见 search.py"""
+        mask = np.ones(len(self.gid), dtype=bool)
+        if gid is not None:
+            mask &= self.gid == gid
+        if osm_id is not None:
+            mask &= self.osm_id == osm_id
+        if class_id is not None:
+            mask &= self.class_id == class_id
+        idx = np.flatnonzero(mask)
+        if road_name:
+            idx = np.intersect1d(idx, self.name_index.rows_matching(road_name),
+                                 assume_unique=True)
+        return idx
+
+    @property
+    def name_index(self):
+        if self._name_index is None:
+            self._name_index = RoadNameIndex(self.road_name)
+        return self._name_index
+
+    # ---- 输出 ------------------------------------------------------------
+    def records(self, idx=None, with_highway=False, polylines=None):
+        """
+        行号 → 接口原有的 dict 格式（coord_list 为 [[lng, lat], …]）；
+        给出 polylines（与 idx 对应的编码折线，见 geomcodec）时以 "polyline" 代替 coord_list
+        """
+        if idx is None:
+            idx = np.arange(len(self.gid))
+        coords, offsets = self.coords, self.offsets
+        gids = self.gid[idx].tolist()
+        osm_ids = self.osm_id[idx].tolist()
+        class_ids = self.class_id[idx].tolist()
+        results = []
+        for k, i in enumerate(idx.tolist()):
+            class_id = _nullable(class_ids[k])
+            row = {
+                "gid": gids[k],
+                "osm_id": _nullable(osm_ids[k]),
+                "class_id": class_id,
+                "road_name": self.road_name[i],
+            }
+            if with_highway:
+                row["highway_type"] = self.highway_name(class_id)
+            if polylines is None:
+                row["coord_list"] = coords[offsets[i]:offsets[i + 1]].tolist()
+            else:
+                row["polyline"] = polylines[k]
+            results.append(row)
+        return results
+
+
+# 每行的 xmin（写入该行版本的事务号）在 INSERT 和每次 UPDATE 时都会变，
+# 按主键串起来取 md5：增删改都会反映到签名上，且不用读几何列
+_SIGNATURE_SQL = """
+    SELECT (SELECT md5(string_agg(gid::text || ':' || xmin::text, ',' ORDER BY gid))
+            FROM {ways}),
+           (SELECT md5(string_agg(id::text || ':' || xmin::text, ',' ORDER BY id))
+            FROM {highways})
+"""
+
+
+def _signature():
+    """bfmap_ways 与 highway 的内容签名；PostgreSQL 以外（测试库）直接对整表内容做摘要"""
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute(_SIGNATURE_SQL.format(ways=BfmapWay._meta.db_table,
+                                                 highways=Highway._meta.db_table))
+            return cursor.fetchone()
+    h = hashlib.blake2b(digest_size=16)
+    for model in (BfmapWay, Highway):
+        for row in model.objects.order_by("pk").values_list():
+            h.update(repr(row).encode("utf-8"))
+    return h.hexdigest()
+
+
+def load_network():
+    """从数据库构建快照：一次查询，WKB 整列交给 shapely 向量化解析"""
+    signature = _signature()
+    rows = list(
+        BfmapWay.objects.order_by("gid")
+        .annotate(wkb=AsWKB("geom"))
+        .values_list("gid", "osm_id", "class_id", "road_name", "wkb")
+    )
+    n = len(rows)
+    gid = np.fromiter((r[0] for r in rows), dtype=np.int64, count=n)
+    osm_id = _int_column(r[1] for r in rows)
+    class_id = _int_column(r[2] for r in rows)
+    road_name = [r[3] for r in rows]
+
+    with phase("wkb"):
+        wkbs = np.array([bytes(r[4]) if r[4] is not None else None for r in rows],
+                        dtype=object)
+        geoms = shapely.from_wkb(wkbs)
+        coords, owner = shapely.get_coordinates(geoms, return_index=True)
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(owner, minlength=n), out=offsets[1:])
+
+    highways = {
+        h.id: {"name": h.name, "priority": h.priority, "maxspeed": h.maxspeed}
+        for h in Highway.objects.all()
+    }
+    return RoadNetwork(gid, osm_id, class_id, road_name, offsets,
+                       np.ascontiguousarray(coords, dtype=np.float64),
+                       highways, signature, geoms=geoms)
+
+
+_network = None
+_checked_at = 0.0
+_dirty = False
+_lock = threading.Lock()
+
+
+def get_network():
+    """取当前快照；首次调用时构建，过期时核对签名后按需重建"""
+    global _network, _checked_at, _dirty
+    interval = getattr(settings, "ROADS_NETWORK_CHECK_INTERVAL", 300)
+    net = _network
+    if net is not None and not _dirty and time.monotonic() - _checked_at < interval:
+        return net
+
+    with _lock:
+        if _network is None or _dirty:
+            _network = load_network()
+            _dirty = False
+        elif time.monotonic() - _checked_at >= interval:
+            if _signature() != _network.signature:
+                _network = load_network()
+        _checked_at = time.monotonic()
+        return _network
+
+
+def invalidate():
+    """标脏，下一次 get_network() 时重建"""
+    global _dirty
+    _dirty = True
+
+
+def on_network_changed(sender, **kwargs):
+    invalidate()
+
+
+def preload():
+    """后台线程预热快照，避免第一个请求承担构建开销"""
+    def _run():
+        try:
+            get_network()
+        finally:
+            connection.close()
+
+    threading.Thread(target=_run, name="road-network-preload", daemon=True).start()
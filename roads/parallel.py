@@ -0,0 +1,141 @@
+"""
+多进程按时间窗批量聚类。
+
+工作进程只拿到接客点的四列数组，不碰 Django。Web 进程是多线程的，fork 出来的
+子进程会继承其他线程持有的锁，所以工作进程用 forkserver（没有时用 spawn）启动：
+
+    有 .npy 存储目录时各进程自己 mmap 打开（共享页缓存）。传的是 store.directory，
+    即不可变的版本目录而不是 ROADS_PICKUP_STORE_DIR 链接：ProcessPoolExecutor
+    按需启动工作进程，存储换版本之后才启动的进程读到的仍是池所属的那一版；
+    否则父进程把四列拷进 multiprocessing.shared_memory，各进程按名字映射，只拷一次
+
+每个任务只传 (窗口起止秒, 时段编码, eps, minpts)，返回簇列表。
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from pathlib import Path
+
+import numpy as np
+
+from .utils import dbscan_geo
+
+COLUMNS = ("time", "lat", "lng", "period")
+
+_points = None
+_blocks = None
+
+
+class SharedColumns:
+    """父进程一侧：把几列数组拷进共享内存；specs 传给工作进程的 _init_worker"""
+
+    def __init__(self, arrays):
+        self._blocks = []
+        self.specs = []
+        for arr in arrays:
+            arr = np.ascontiguousarray(arr)
+            block = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+            np.ndarray(arr.shape, arr.dtype, buffer=block.buf)[...] = arr
+            self._blocks.append(block)
+            self.specs.append((block.name, arr.shape, arr.dtype.str))
+
+    def close(self):
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+
+def _init_worker(specs=None, directory=None):
+    global _points, _blocks
+    if directory is not None:
+        _points = tuple(np.load(Path(directory) / f"{name}.npy", mmap_mode="r")
+                        for name in COLUMNS)
+        return
+    _blocks = [shared_memory.SharedMemory(name=name) for name, _, _ in specs]
+    _points = tuple(np.ndarray(shape, dtype, buffer=block.buf)
+                    for block, (_, shape, dtype) in zip(_blocks, specs))
+
+
+def _cluster_slice(lo, hi, code, eps, minpts):
+    """[lo, hi)（UTC 秒）内、code 时段（None 为不限）的点做 dbscan_geo"""
+    time, lat, lng, period = _points
+    a, b = np.searchsorted(time, [lo, hi])
+    if code is None:
+        lat, lng = lat[a:b], lng[a:b]
+    else:
+        idx = a + np.flatnonzero(period[a:b] == code)
+        lat, lng = lat[idx], lng[idx]
+    return dbscan_geo(np.column_stack((lat, lng)), eps_m=eps, min_samples=minpts)
+
+
+def default_workers():
+    return max(1, (os.cpu_count() or 1) - 1)
+
+
+def _context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+class ClusterPool:
+    """
+    绑定到某个 PickupStore 的进程池。
+
+    Web 进程里多个请求共用一个池：每个请求 acquire() / release()，存储换版本后
+    retire()；退役的池等最后一个请求 release() 之后才关闭，进行中的任务不会被取消。
+    """
+
+    def __init__(self, store, workers=None):
+        self.version = store.version
+        self.workers = workers or default_workers()
+        directory = getattr(store, "directory", None)
+        self._shared = None
+        if directory:
+            initargs = (None, str(directory))
+        else:
+            self._shared = SharedColumns(getattr(store, name) for name in COLUMNS)
+            initargs = (self._shared.specs, None)
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=_context(),
+            initializer=_init_worker, initargs=initargs,
+        )
+        self._lock = threading.Lock()
+        self._leases = 0
+        self._retired = False
+
+    def submit(self, lo, hi, code, eps, minpts):
+        return self._executor.submit(_cluster_slice, lo, hi, code, eps, minpts)
+
+    def acquire(self):
+        with self._lock:
+            self._leases += 1
+        return self
+
+    def release(self):
+        with self._lock:
+            self._leases -= 1
+            idle = self._retired and self._leases == 0
+        if idle:
+            self.shutdown()
+
+    def retire(self):
+        """不再接新请求；没有请求在用时立即关闭，否则等最后一个 release()"""
+        with self._lock:
+            self._retired = True
+            idle = self._leases == 0
+        if idle:
+            self.shutdown()
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+        if self._shared is not None:
+            self._shared.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
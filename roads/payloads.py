@@ -0,0 +1,168 @@
+"""
+预序列化的路网响应体。
+
+/api/bfmap_ways/ 全量结果和每个 class_id 子集（每种 ?format=，见 geomcodec）
+只按当前路网快照编码一次，同时保留 gzip / brotli 压缩版本和强 ETag；
+客户端带 If-None-Match 命中时直接返回 304。快照重建后（network.version 变化）缓存整体作废。
+"""
+import gzip
+import hashlib
+import json
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+from django.http import HttpResponse, HttpResponseNotModified
+
+from . import geomcodec
+from .instrumentation import phase
+
+try:
+    import brotli
+except ImportError:  # brotli 是可选依赖，没有就只提供 gzip
+    brotli = None
+
+ENCODINGS = ("br", "gzip")
+
+
+def encode_json(data):
+    """与 DRF JSONRenderer 默认配置一致：紧凑、不转义中文、不允许 NaN"""
+    return json.dumps(data, ensure_ascii=False, allow_nan=False,
+                      separators=(",", ":")).encode("utf-8")
+
+
+class PreparedPayload:
+    def __init__(self, body, content_type="application/json", headers=None):
+        self.content_type = content_type
+        self.headers = headers or {}
+        digest = hashlib.sha256(body).hexdigest()
+        with phase("compress"):
+            self.bodies = {"identity": body, "gzip": gzip.compress(body, compresslevel=6)}
+            if brotli is not None:
+                self.bodies["br"] = brotli.compress(body, quality=9)
+        # 每种编码是不同的表示，各自一个强 ETag
+        self.etags = {
+            enc: f'"{digest}"' if enc == "identity" else f'"{digest}-{enc}"'
+            for enc in self.bodies
+        }
+
+    @property
+    def etag(self):
+        return self.etags["identity"]
+
+    def __len__(self):
+        return len(self.bodies["identity"])
+
+
+def _accepted_encodings(header):
+    accepted = set()
+    for part in header.split(","):
+        token, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(token.strip().lower())
+    return accepted
+
+
+def payload_response(request, payload):
+    """按 If-None-Match / Accept-Encoding 返回 304 或合适编码的预编码响应"""
+    if_none_match = request.META.get("HTTP_IF_NONE_MATCH", "")
+    if if_none_match:
+        tags = {t.strip() for t in if_none_match.split(",")}
+        if "*" in tags or tags & set(payload.etags.values()):
+            resp = HttpResponseNotModified()
+            resp["ETag"] = payload.etag
+            resp["Vary"] = "Accept-Encoding"
+            return resp
+
+    accepted = _accepted_encodings(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+    encoding = next((e for e in ENCODINGS if e in accepted and e in payload.bodies),
+                    "identity")
+
+    resp = HttpResponse(payload.bodies[encoding], content_type=payload.content_type)
+    if encoding != "identity":
+        resp["Content-Encoding"] = encoding
+    resp["Content-Length"] = str(len(payload.bodies[encoding]))
+    resp["ETag"] = payload.etags[encoding]
+    resp["Vary"] = "Accept-Encoding"
+    resp["Cache-Control"] = "no-cache"   # 允许缓存，但每次用 ETag 复核
+    for name, value in payload.headers.items():
+        resp[name] = value
+    return resp
+
+
+class PayloadCache:
+    """
+    按 (network.version, key) 缓存 PreparedPayload，快照换代时整体清空。
+    build 返回可 JSON 序列化的数据，或直接返回 PreparedPayload（二进制格式）
+
+    命中时不加锁；未命中时同一个 key 只有一个线程在锁外构建（编码、压缩），
+    其他请求同一 key 的线程等它的 Future，不同 key 互不阻塞。
+    """
+
+    def __init__(self):
+        self._state = (None, {})          # (version, {key: payload})，整体替换
+        self._building = {}               # (version, key) -> Future
+        self._lock = threading.Lock()
+
+    def get(self, version, key, build):
+        current, items = self._state
+        if current == version:
+            payload = items.get(key)
+            if payload is not None:
+                return payload
+
+        with self._lock:
+            if self._state[0] != version:
+                self._state = (version, {})
+            payload = self._state[1].get(key)
+            if payload is not None:
+                return payload
+            future = self._building.get((version, key))
+            owner = future is None
+            if owner:
+                future = self._building[(version, key)] = Future()
+
+        if not owner:
+            return future.result()
+        try:
+            with phase("serialize"):
+                payload = build()
+                if not isinstance(payload, PreparedPayload):
+                    payload = PreparedPayload(encode_json(payload))
+        except BaseException as exc:
+            with self._lock:
+                del self._building[(version, key)]
+            future.set_exception(exc)
+            raise
+        with self._lock:
+            del self._building[(version, key)]
+            if self._state[0] == version:
+                self._state[1][key] = payload
+        future.set_result(payload)
+        return payload
+
+
+_way_payloads = PayloadCache()
+
+
+def bfmap_ways_payload(network, class_id=None, fmt="json", precision=None):
+    """全量（class_id=None）或单个 class_id 子集的预编码结果；fmt、precision 见 geomcodec"""
+    def build():
+        if class_id is None:
+            idx, with_highway = np.arange(len(network)), False
+        else:
+            idx, with_highway = network.select(class_id=class_id), True
+        if fmt in geomcodec.BINARY:
+            body = geomcodec.encode(network, idx, fmt, precision, with_highway)
+            return PreparedPayload(body, geomcodec.CONTENT_TYPES[fmt],
+                                   geomcodec.headers(fmt, len(idx), precision))
+        return geomcodec.records(network, idx, fmt, precision, with_highway)
+
+    key = (class_id, fmt, precision)
+    return _way_payloads.get(network.version, key, build)
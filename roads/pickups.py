@@ -0,0 +1,245 @@
+"""
+taxi_pickups 的列式内存存储。
+
+按 pickup_time 升序排好的四列 NumPy 数组：
+
+    time    int64   UTC 秒
+    lat     float64
+    lng     float64
+    period  int8    时段编码，对应 periods 列表里的下标（NULL 为 -1）
+
+时间窗过滤是两次二分查找，period 过滤是一次布尔掩码；不带 period 时
+返回的是原数组的切片，不复制。
+
+配置了 ROADS_PICKUP_STORE_DIR 时，由 `manage.py build_pickup_store` 把
+数组写成 .npy 文件，各 worker 进程用 mmap 打开，共享同一份页缓存；
+目录里的 meta.json 更新后自动重新打开。没配置时首次使用从数据库载入
+到本进程内存。
+
+ROADS_PICKUP_STORE_DIR 是指向当前版本目录（<DIR>.<纳秒时间戳>）的符号链接。
+版本目录发布后不再改动，换版本只是原子地改指链接；store.directory 记的是
+版本目录本身，按它打开的进程（比如聚类进程池里后来才启动的工作进程）
+看到的一定是同一份数据。
+"""
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from .models import TaxiPickup
+
+COLUMNS = ("time", "lat", "lng", "period")
+META_FILE = "meta.json"
+KEEP_VERSIONS = 3           # 保留的版本目录数（含当前），旧进程池可能还在读上一版
+NULL_PERIOD = -1
+LOAD_CHUNK = 200_000
+
+_versions = itertools.count(1)
+
+
+def to_epoch(dt):
+    """datetime → UTC 秒；不带时区的按 settings.TIME_ZONE 解释（与 ORM 一致）"""
+    if timezone.is_naive(dt):
+        dt = timezone.make_aware(dt)
+    return int(dt.timestamp())
+
+
+class PickupStore:
+    def __init__(self, time, lat, lng, period, periods, signature=None):
+        self.time = time
+        self.lat = lat
+        self.lng = lng
+        self.period = period
+        self.periods = list(periods)
+        self.signature = signature
+        self.version = next(_versions)
+        self.directory = None       # open() 打开的 .npy 目录
+
+    def __len__(self):
+        return len(self.time)
+
+    def period_code(self, label):
+        """时段名 → 编码；库里没有的时段返回 None"""
+        try:
+            return self.periods.index(label)
+        except ValueError:
+            return None
+
+    def bounds(self, start, end):
+        """[start, end) 对应的行号区间 (lo, hi)"""
+        lo, hi = np.searchsorted(self.time, [to_epoch(start), to_epoch(end)], side="left")
+        return int(lo), int(hi)
+
+    def window(self, start, end, period=None):
+        """
+        [start, end) 内（可选限定 period）的点：返回 (行号, lat, lng)。
+        不限 period 时 lat/lng 是原数组的切片视图。
+        """
+        lo, hi = self.bounds(start, end)
+        if not period:
+            return np.arange(lo, hi), self.lat[lo:hi], self.lng[lo:hi]
+        code = self.period_code(period)
+        if code is None:
+            empty = np.empty(0)
+            return np.empty(0, dtype=np.int64), empty, empty
+        idx = lo + np.flatnonzero(self.period[lo:hi] == code)
+        return idx, self.lat[idx], self.lng[idx]
+
+    def dates(self):
+        """
+        数据覆盖的本地日期（升序）。与 to_epoch 一样按当前时区（settings.TIME_ZONE）
+        划分，cluster_cache.standard_windows 按这些日期拼出的不带时区的窗口才对得上。
+        """
+        if not len(self.time):
+            return []
+        tz = timezone.get_current_timezone()
+        # 本地日期随时间单调不减，一个 UTC 日最多跨两个本地日：看每个 UTC 日的首尾两点就够了
+        utc_days = self.time // 86400
+        firsts = np.flatnonzero(np.diff(utc_days, prepend=utc_days[0] - 1))
+        lasts = np.append(firsts[1:], len(self.time)) - 1
+        stamps = np.unique(np.concatenate([self.time[firsts], self.time[lasts]]))
+        return sorted({datetime.fromtimestamp(int(t), tz=tz).date() for t in stamps.tolist()})
+
+    # ---- 持久化 ----------------------------------------------------------
+    def save(self, directory):
+        """
+        写成新的版本目录 <directory>.<版本>/{time,lat,lng,period}.npy + meta.json，
+        再把符号链接 <directory> 原子地指过去，返回版本目录
+        """
+        directory = Path(directory)
+        directory.parent.mkdir(parents=True, exist_ok=True)
+        tmp = Path(tempfile.mkdtemp(dir=directory.parent, prefix=f".{directory.name}-"))
+        for name in COLUMNS:
+            np.save(tmp / f"{name}.npy", getattr(self, name))
+        meta = {"periods": self.periods, "rows": len(self), "built_at": time.time(),
+                "signature": self.signature}
+        (tmp / META_FILE).write_text(json.dumps(meta, ensure_ascii=False, default=str),
+                                     encoding="utf-8")
+        version_dir = directory.with_name(f"{directory.name}.{time.time_ns()}")
+        tmp.rename(version_dir)
+
+        link = directory.with_name(f".{directory.name}-link-{os.getpid()}")
+        link.unlink(missing_ok=True)
+        link.symlink_to(version_dir.name)       # 相对路径，整个父目录搬走也不失效
+        if directory.is_dir() and not directory.is_symlink():
+            # 旧布局：directory 本身就是数据目录。换成链接前会有一瞬间没有存储，
+            # 期间 get_pickup_store 临时从数据库载入
+            old = directory.with_name(f".{directory.name}-old-{os.getpid()}")
+            directory.rename(old)
+            shutil.rmtree(old, ignore_errors=True)
+        os.replace(link, directory)
+        _prune_versions(directory)
+        return version_dir
+
+    @classmethod
+    def open(cls, directory, mmap=True):
+        # 解析到版本目录再读，读的过程中链接被改指也不影响
+        directory = Path(directory).resolve()
+        meta = json.loads((directory / META_FILE).read_text(encoding="utf-8"))
+        mode = "r" if mmap else None
+        arrays = {name: np.load(directory / f"{name}.npy", mmap_mode=mode) for name in COLUMNS}
+        store = cls(periods=meta["periods"], signature=meta.get("signature"), **arrays)
+        store.directory = directory
+        return store
+
+    @classmethod
+    def from_db(cls, chunk_size=LOAD_CHUNK):
+        """按 pickup_time 顺序分块读 taxi_pickups，逐块转成数组，避免一次性的元组大列表"""
+        signature = _signature()
+        rows = (
+            TaxiPickup.objects.order_by("pickup_time", "pk")
+            .values_list("pickup_time", "lat", "lng", "period")
+            .iterator(chunk_size=chunk_size)
+        )
+        periods = {}
+        chunks = {name: [] for name in COLUMNS}
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+            t, lat, lng, period = zip(*chunk)
+            chunks["time"].append(np.fromiter((int(x.timestamp()) for x in t),
+                                              dtype=np.int64, count=len(t)))
+            chunks["lat"].append(np.array(lat, dtype=np.float64))
+            chunks["lng"].append(np.array(lng, dtype=np.float64))
+            chunks["period"].append(np.fromiter(
+                (NULL_PERIOD if p is None else periods.setdefault(p, len(periods))
+                 for p in period), dtype=np.int8, count=len(period)))
+
+        dtypes = {"time": np.int64, "lat": np.float64, "lng": np.float64, "period": np.int8}
+        arrays = {
+            name: np.concatenate(chunks[name]) if chunks[name] else np.empty(0, dtype=dtypes[name])
+            for name in COLUMNS
+        }
+        return cls(periods=list(periods), signature=signature, **arrays)
+
+
+def _prune_versions(directory):
+    """删掉最近 KEEP_VERSIONS 个之外的版本目录"""
+    versions = sorted(
+        (int(p.name.rsplit(".", 1)[1]), p)
+        for p in directory.parent.glob(f"{directory.name}.*")
+        if p.is_dir() and p.name.rsplit(".", 1)[1].isdigit()
+    )
+    current = directory.resolve()
+    for _, path in versions[:-KEEP_VERSIONS]:
+        if path != current:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def _signature():
+    agg = TaxiPickup.objects.aggregate(n=Count("pk"), last=Max("pickup_time"))
+    return [agg["n"], agg["last"].isoformat() if agg["last"] else None]
+
+
+_store = None
+_store_stamp = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def _store_dir():
+    directory = getattr(settings, "ROADS_PICKUP_STORE_DIR", None)
+    return Path(directory) if directory else None
+
+
+def get_pickup_store():
+    """
+    当前进程的 PickupStore：
+    配了 ROADS_PICKUP_STORE_DIR 且目录存在 → mmap 打开，meta.json 变了就重开；
+    否则从数据库载入，每隔 ROADS_PICKUP_STORE_CHECK_INTERVAL 秒核对一次行数/最新时间。
+    """
+    global _store, _store_stamp, _checked_at
+    directory = _store_dir()
+    if directory is not None and (directory / META_FILE).exists():
+        stamp = (directory / META_FILE).stat().st_mtime_ns
+        if _store is not None and _store_stamp == stamp:
+            return _store
+        with _lock:
+            if _store is None or _store_stamp != stamp:
+                _store = PickupStore.open(directory)
+                _store_stamp = stamp
+            return _store
+
+    interval = getattr(settings, "ROADS_PICKUP_STORE_CHECK_INTERVAL", 300)
+    store = _store
+    if store is not None and _store_stamp is None and time.monotonic() - _checked_at < interval:
+        return store
+    with _lock:
+        if _store is None or _store_stamp is not None:
+            _store = PickupStore.from_db()
+            _store_stamp = None
+        elif time.monotonic() - _checked_at >= interval and _signature() != _store.signature:
+            _store = PickupStore.from_db()
+        _checked_at = time.monotonic()
+        return _store
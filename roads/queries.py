@@ -0,0 +1,207 @@
+"""
+排行、路段流量等只读接口共用的参数校验和查询构造。
+
+同步视图（views.py）和异步视图（async_views.py）只在"怎么执行"上不同：
+同步视图直接迭代 QuerySet，异步视图交给 aio.fetch_values 走异步连接池。
+这里只构造 QuerySet（不访问数据库）；参数错误抛 BadRequest，detail 原样
+作为 400 响应返回（字段名为 key，默认 "detail"）。
+"""
+from datetime import datetime
+
+from . import clustering, rankings
+from .lookup import ROAD_GID
+from .models import (
+    RoadDailyCount,
+    RoadDayFlow,
+    RoadDurationStats,
+    RoadHighwayMapping,
+    RoadHourlyCount,
+    RoadPeakPeriodCount,
+)
+
+DURATION_CATEGORIES = ("short", "mid", "long")
+
+
+class BadRequest(Exception):
+    def __init__(self, detail, key="detail"):
+        super().__init__(detail)
+        self.detail = detail
+        self.key = key
+
+    def body(self):
+        return {self.key: self.detail}
+
+
+def _positive_n(value):
+    try:
+        top_n = int(value)
+        if top_n <= 0:
+            raise ValueError("n 必须是正整数")
+    except ValueError as e:
+        raise BadRequest(f"无效的n参数: {e}")
+    return top_n
+
+
+class TopRoadsQuery:
+    """
+    一次排行请求：先查 ranking 的 top-K 缓存，未命中（n 超过 K）再执行 queryset。
+    gid_key 为补路名用的整数 gid 列（见 lookup.attach_road_names）。
+    """
+
+    def __init__(self, ranking, key, highway_name, n, queryset, gid_key="road_gid"):
+        self.ranking = ranking
+        self.key = key
+        self.highway_name = highway_name
+        self.n = n
+        self.queryset = queryset
+        self.gid_key = gid_key
+
+    def cached(self):
+        return self.ranking.top(self.key, self.highway_name, self.n)
+
+
+def _ranked(qs, highway_name, fields, top_n, with_gid=True):
+    if highway_name:
+        qs = qs.filter(highway_name=highway_name)
+    if with_gid:
+        qs = qs.annotate(road_gid=ROAD_GID)
+    return qs.order_by("-trip_count").values(*fields)[:top_n]
+
+
+def top_roads_by_day(params):
+    target_date = params.get("date")  # yyyy-mm-dd
+    top_n_str = params.get("n")
+    highway_name = params.get("highway_name")
+    if not (target_date and top_n_str):
+        raise BadRequest("date 和 n 都是必须的参数")
+    top_n = _positive_n(top_n_str)
+    qs = _ranked(RoadDailyCount.objects.filter(date=target_date), highway_name,
+                 ("road_id", "trip_count", "date", "road_gid"), top_n)
+    return TopRoadsQuery(rankings.DAILY, target_date, highway_name, top_n, qs)
+
+
+def top_roads_by_hour(params):
+    hour_str = params.get("hour")
+    top_n_str = params.get("n")
+    highway_name = params.get("highway_name")
+    if not (hour_str and top_n_str):
+        raise BadRequest("hour 和 n 都是必须的参数")
+    try:
+        hour = int(hour_str)
+        top_n = int(top_n_str)
+        if not (0 <= hour <= 23):
+            raise ValueError("hour 必须在 0 到 23 之间")
+        if top_n <= 0:
+            raise ValueError("n 必须是正整数")
+    except ValueError as e:
+        raise BadRequest(f"无效的参数: {e}")
+    qs = _ranked(RoadHourlyCount.objects.filter(hour_of_day=hour), highway_name,
+                 ("road_id", "trip_count", "hour_of_day", "road_gid"), top_n)
+    return TopRoadsQuery(rankings.HOURLY, hour, highway_name, top_n, qs)
+
+
+def top_roads_by_peak_period(params):
+    peak_period = params.get("peak_period")
+    top_n_str = params.get("n")
+    highway_name = params.get("highway_name")
+    if not (peak_period and top_n_str):
+        raise BadRequest("peak_period 和 n 是必须的参数")
+    top_n = _positive_n(top_n_str)
+    qs = _ranked(RoadPeakPeriodCount.objects.filter(peak_period=peak_period), highway_name,
+                 ("road_id", "trip_count", "peak_period", "road_gid"), top_n)
+    return TopRoadsQuery(rankings.PEAK_PERIOD, peak_period, highway_name, top_n, qs)
+
+
+def top_roads_by_duration_category(params):
+    highway_name = params.get("highway_name")
+    duration_category = params.get("duration_category")
+    top_n_str = params.get("n")
+    if not (duration_category and top_n_str):
+        raise BadRequest("duration_category 和 n 是必须的参数")
+    if duration_category not in DURATION_CATEGORIES:
+        raise BadRequest("duration_category 必须是 'short', 'mid', 或 'long' 之一")
+    top_n = _positive_n(top_n_str)
+    # road_duration_stats.road_id 本身就是 BIGINT
+    qs = _ranked(RoadDurationStats.objects.filter(duration_category=duration_category),
+                 highway_name, ("road_id", "trip_count", "duration_category", "highway_name"),
+                 top_n, with_gid=False)
+    return TopRoadsQuery(rankings.DURATION, duration_category, highway_name, top_n, qs,
+                         gid_key="road_id")
+
+
+def road_day_flow(params):
+    """返回 (请求的 road_ids, values('road_id', 'traffic_cnt') 的 QuerySet)"""
+    road_ids_param = params.get("road_ids")
+    date_param = params.get("date")
+    if not (road_ids_param and date_param):
+        raise BadRequest("road_ids 和 date 都要传")
+    try:
+        req_ids = [int(s) for s in road_ids_param.split(",") if s.strip()]
+    except ValueError:
+        raise BadRequest("road_ids 必须是整数列表")
+    qs = (RoadDayFlow.objects
+          .filter(biz_date=date_param, road_id__in=req_ids)
+          .values("road_id", "traffic_cnt"))
+    return req_ids, qs
+
+
+def fill_road_day_flow(req_ids, rows):
+    """按请求顺序返回，没有记录的路段补 0"""
+    result_map = {rid: 0 for rid in req_ids}
+    for row in rows:
+        result_map[row["road_id"]] = row["traffic_cnt"]
+    return [{"road_id": rid, "traffic_cnt": result_map[rid]} for rid in req_ids]
+
+
+def roads_by_highway_type(params):
+    """返回 values('road_id') 的 QuerySet"""
+    highway_name = params.get("highway_name")
+    highway_id = params.get("highway_id")
+    if not (highway_name or highway_id):
+        raise BadRequest("highway_name 或 highway_id 必须传一个")
+    qs = RoadHighwayMapping.objects.all()
+    if highway_name:
+        qs = qs.filter(highway_name=highway_name)
+    if highway_id:
+        try:
+            highway_id = int(highway_id)
+        except ValueError:
+            raise BadRequest("highway_id 必须为整数")
+        qs = qs.filter(highway_id=highway_id)
+    return qs.values("road_id")
+
+
+def cluster_params(params):
+    """eps（米）、minpts → (eps, minpts)；单窗口和批量聚类共用"""
+    try:
+        eps = int(params.get("eps", 200))
+        minpts = int(params.get("minpts", 100))
+        clustering.check_params(eps, minpts)
+    except (TypeError, ValueError) as e:
+        raise BadRequest(f"无效的参数: {e}")
+    return eps, minpts
+
+
+class PickupClustersQuery:
+    def __init__(self, start, end, period, eps, minpts):
+        self.start = start
+        self.end = end
+        self.period = period
+        self.eps = eps
+        self.minpts = minpts
+
+
+def pickup_clusters(params):
+    """?start=&end=&period=&eps=&minpts= → PickupClustersQuery"""
+    start = params.get("start")   # ISO-8601 字符串
+    end = params.get("end")
+    if not (start and end):
+        # 这个接口原来用 "error" 字段，保持不变
+        raise BadRequest("必须提供 start 和 end 参数", key="error")
+    eps, minpts = cluster_params(params)
+    try:
+        start_dt = datetime.fromisoformat(start)
+        end_dt = datetime.fromisoformat(end)
+    except ValueError as e:
+        raise BadRequest(f"无效的参数: {e}")
+    return PickupClustersQuery(start_dt, end_dt, params.get("period"), eps, minpts)
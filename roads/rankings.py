@@ -0,0 +1,141 @@
+"""
+排行接口的 top-K 预计算缓存。
+
+四个排行视图（road_daily_count / road_hourly_count / road_peak_period_count /
+road_duration_stats）的分组维度基数都很小：几个日期、24 小时、3 个高峰时段、
+3 个时长分类，再乘上三十来种 highway。每个数据集用两条窗口函数查询
+（按 key、按 key+highway_name 分区取前 K 名）一次算好所有组合，之后任何
+n ≤ K 的请求都直接从内存切片。
+
+物化视图刷新后（refresh.flows_refreshed 信号，包括其他进程的刷新）或
+ROADS_RANKING_TTL 秒过期后，下次请求时重建。
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from . import refresh
+from .lookup import ROAD_GID
+from .models import RoadDailyCount, RoadDurationStats, RoadHourlyCount, RoadPeakPeriodCount
+
+DEFAULT_TOP_K = 100
+DEFAULT_TTL = 3600
+# 不按 highway 过滤的那组排行的分组键；不能用 None，highway_name 为 NULL 的行
+# 按 key+highway_name 分区后分组键也是 (key, None)
+ALL_HIGHWAYS = object()
+
+
+class RankingCache:
+    """
+    model      : 排行所在的物化视图
+    key_field  : 分组字段（date / hour_of_day / …）
+    fields     : 接口返回的字段，顺序与原 values() 一致
+    gid_field  : 整数 gid 所在字段；TEXT road_id 的视图用 ROAD_GID 转出 road_gid
+    """
+
+    def __init__(self, model, key_field, fields, gid_field="road_gid"):
+        self.model = model
+        self.key_field = key_field
+        self.fields = fields
+        self.gid_field = gid_field
+        self._tops = None
+        self._built_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def top_k(self):
+        return getattr(settings, "ROADS_RANKING_TOP_K", DEFAULT_TOP_K)
+
+    def _query(self, partition_by, top_k):
+        qs = self.model.objects.all()
+        if self.gid_field == "road_gid":
+            qs = qs.annotate(road_gid=ROAD_GID)
+        columns = list(dict.fromkeys([*self.fields, self.gid_field, "highway_name"]))
+        return (
+            qs.annotate(ranking=Window(
+                RowNumber(),
+                partition_by=[F(f) for f in partition_by],
+                order_by=F("trip_count").desc(),
+            ))
+            .filter(ranking__lte=top_k)
+            .order_by(*partition_by, "ranking")
+            .values(*columns)
+        )
+
+    def _build(self):
+        top_k = self.top_k
+        keep = list(dict.fromkeys([*self.fields, self.gid_field]))
+        tops = {}
+        for by_highway in (False, True):
+            partition_by = [self.key_field, "highway_name"] if by_highway else [self.key_field]
+            for row in self._query(partition_by, top_k):
+                group = (row[self.key_field], row["highway_name"] if by_highway else ALL_HIGHWAYS)
+                tops.setdefault(group, []).append({f: row[f] for f in keep})
+        return tops
+
+    def _current(self):
+        refresh.generation()        # 发现其他进程刷新过视图时会触发 invalidate()
+        ttl = getattr(settings, "ROADS_RANKING_TTL", DEFAULT_TTL)
+        tops = self._tops
+        if tops is not None and time.monotonic() - self._built_at < ttl:
+            return tops
+        with self._lock:
+            if self._tops is None or time.monotonic() - self._built_at >= ttl:
+                self._tops = self._build()
+                self._built_at = time.monotonic()
+            return self._tops
+
+    def top(self, key, highway_name, n):
+        """
+        前 n 名记录（新的 dict 副本，含 gid_field 列）；
+        n 超过 K 或 key 无法解析时返回 None，调用方回退到直接查库。
+        """
+        if n > self.top_k:
+            return None
+        try:
+            key = self.model._meta.get_field(self.key_field).to_python(key)
+        except ValidationError:
+            return None
+        rows = self._current().get((key, highway_name or ALL_HIGHWAYS), [])
+        return [dict(r) for r in rows[:n]]
+
+    def invalidate(self):
+        with self._lock:
+            self._tops = None
+
+    def refresh(self):
+        tops = self._build()
+        with self._lock:
+            self._tops = tops
+            self._built_at = time.monotonic()
+
+
+DAILY = RankingCache(RoadDailyCount, "date", ("road_id", "trip_count", "date"))
+HOURLY = RankingCache(RoadHourlyCount, "hour_of_day", ("road_id", "trip_count", "hour_of_day"))
+PEAK_PERIOD = RankingCache(RoadPeakPeriodCount, "peak_period",
+                           ("road_id", "trip_count", "peak_period"))
+DURATION = RankingCache(RoadDurationStats, "duration_category",
+                        ("road_id", "trip_count", "duration_category", "highway_name"),
+                        gid_field="road_id")
+
+ALL_RANKINGS = (DAILY, HOURLY, PEAK_PERIOD, DURATION)
+
+
+def invalidate():
+    """物化视图刷新后调用：清空全部排行缓存"""
+    for ranking in ALL_RANKINGS:
+        ranking.invalidate()
+
+
+def on_flows_refreshed(sender, **kwargs):
+    invalidate()
+
+
+def warm():
+    """立即重建全部排行缓存"""
+    for ranking in ALL_RANKINGS:
+        ranking.refresh()
@@ -0,0 +1,316 @@
+"""
+流量物化视图的增量刷新。
+
+road_hourly_flow / road_day_flow / road_daily_count / road_hourly_count /
+road_peak_period_count / road_duration_stats 是物化视图，定义在库里（不在仓库里），
+原来每导入一批轨迹就整体 REFRESH 一遍，刷新期间读者被阻塞，历史越长越慢。
+这里把工作拆成三步，只有第 2 步和数据量有关，而且只碰受影响的日期：
+
+1. 索引新轨迹：trip_road_data 中 id 大于上次水位的轨迹，按首末时间戳
+   算出经过的 biz_date，写入 trip_day_index。受影响的日期就是这些日期。
+2. 逐日汇总：对每个受影响的 biz_date，在一个事务里只用经过该日的轨迹
+   （trip_day_index）重新聚合，upsert 进两张逐日汇总表 road_hour_trip_counts /
+   road_day_trip_counts，并删掉该日已不存在的行。计数是经过该路段的不同轨迹数，
+   日期和小时按 ROADS_FLOW_TIME_ZONE 的本地时间划分。
+3. 刷新视图：ROADS_REFRESH_VIEWS 里的物化视图按阶段刷新，同一阶段内
+   多线程并行；有唯一索引的（迁移 0001 尽量补上）用 REFRESH ... CONCURRENTLY，
+   刷新期间不阻塞读。库里不是物化视图的名字（基准库里是普通表）跳过。
+
+视图改写成在逐日汇总表之上聚合之后，第 3 步只是小表上的聚合；改写要在库里做，
+改之前请先核对汇总表与视图的口径一致。
+
+每次运行记一条 FlowRefreshLog。成功后本进程发 flows_refreshed 信号（清
+排行和流量缓存）；其他进程通过 generation() 轮询日志发现刷新并同样清缓存。
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .models import FlowRefreshLog
+
+logger = logging.getLogger("roads.refresh")
+
+SOURCE_TABLE = "trip_road_data"
+DEFAULT_VIEWS = [[
+    "road_hourly_flow", "road_day_flow", "road_daily_count",
+    "road_hourly_count", "road_peak_period_count", "road_duration_stats",
+]]
+INDEX_CHUNK = 200_000
+ADVISORY_LOCK_KEY = 0x726F616473      # 'roads'
+
+# 刷新成功后发送；kwargs: dates（重算过的 biz_date 列表）
+flows_refreshed = Signal()
+
+
+class RefreshBusy(Exception):
+    """已有刷新在运行（本进程或其他进程）"""
+
+
+def _time_zone():
+    return getattr(settings, "ROADS_FLOW_TIME_ZONE", settings.TIME_ZONE)
+
+
+# timestamps / road_ids 列是 '[1, 2, 3]' 形式的文本
+_TS = "string_to_array(btrim(t.timestamps, '[] '), ',')"
+_ROADS = "string_to_array(btrim(t.road_ids, '[] '), ',')"
+
+_INDEX_SQL = f"""
+    INSERT INTO trip_day_index (trip_id, biz_date)
+    SELECT t.id, d::date
+    FROM {SOURCE_TABLE} AS t
+    CROSS JOIN LATERAL (SELECT {_TS} AS ts) AS a
+    CROSS JOIN LATERAL generate_series(
+        (to_timestamp(a.ts[1]::float8) AT TIME ZONE %(tz)s)::date,
+        (to_timestamp(a.ts[array_length(a.ts, 1)]::float8) AT TIME ZONE %(tz)s)::date,
+        interval '1 day'
+    ) AS d
+    WHERE t.id > %(lo)s AND t.id <= %(hi)s AND array_length(a.ts, 1) > 0
+    ON CONFLICT (trip_id, biz_date) DO NOTHING
+"""
+
+# 经过该日的轨迹在该日内的点（本地时间），事务结束即删
+_DAY_POINTS_SQL = f"""
+    CREATE TEMP TABLE day_points ON COMMIT DROP AS
+    SELECT t.id AS trip_id,
+           p.road_id::bigint AS road_id,
+           EXTRACT(HOUR FROM to_timestamp(p.ts::float8) AT TIME ZONE %(tz)s)::smallint AS hour
+    FROM trip_day_index AS i
+    JOIN {SOURCE_TABLE} AS t ON t.id = i.trip_id
+    CROSS JOIN LATERAL unnest({_ROADS}, {_TS}) AS p(road_id, ts)
+    WHERE i.biz_date = %(day)s
+      AND p.road_id IS NOT NULL AND p.ts IS NOT NULL
+      AND (to_timestamp(p.ts::float8) AT TIME ZONE %(tz)s)::date = %(day)s
+"""
+
+# 逐日汇总表：(表, 分组列, 唯一键)；upsert 之后删掉该日这次没有出现的行
+SUMMARY_TABLES = [
+    ("road_hour_trip_counts", "road_id, hour", "biz_date, road_id, hour"),
+    ("road_day_trip_counts", "road_id", "biz_date, road_id"),
+]
+
+
+def _summary_sql(table, columns, key):
+    matched = " AND ".join(f"f.{c} = s.{c}" for c in columns.split(", "))
+    return [
+        f"""INSERT INTO {table} (biz_date, {columns}, trip_cnt)
+            SELECT %(day)s, {columns}, COUNT(DISTINCT trip_id)
+            FROM day_points GROUP BY {columns}
+            ON CONFLICT ({key}) DO UPDATE SET trip_cnt = EXCLUDED.trip_cnt
+            WHERE {table}.trip_cnt IS DISTINCT FROM EXCLUDED.trip_cnt""",
+        f"""DELETE FROM {table} AS s
+            WHERE s.biz_date = %(day)s
+              AND NOT EXISTS (SELECT 1 FROM day_points AS f WHERE {matched})""",
+    ]
+
+
+def watermark():
+    """已索引到的最大 trip id（上次成功刷新的 to_trip_id），没有记录为 None"""
+    log = (FlowRefreshLog.objects.filter(status=FlowRefreshLog.STATUS_SUCCESS,
+                                         to_trip_id__isnull=False)
+           .order_by("-to_trip_id").first())
+    return log.to_trip_id if log else None
+
+
+def index_new_trips(after_id):
+    """把 id > after_id 的轨迹写入 trip_day_index；返回 (新水位, 受影响的日期)"""
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT MAX(id) FROM {SOURCE_TABLE}")
+        max_id = cursor.fetchone()[0]
+    if max_id is None or (after_id is not None and max_id <= after_id):
+        return after_id, []
+
+    lo = -1 if after_id is None else after_id
+    tz = _time_zone()
+    with connection.cursor() as cursor:
+        while lo < max_id:
+            hi = min(lo + INDEX_CHUNK, max_id)
+            with transaction.atomic():
+                cursor.execute(_INDEX_SQL, {"tz": tz, "lo": lo, "hi": hi})
+            lo = hi
+        cursor.execute(
+            "SELECT DISTINCT biz_date FROM trip_day_index "
+            "WHERE trip_id > %s AND trip_id <= %s ORDER BY biz_date",
+            [-1 if after_id is None else after_id, max_id],
+        )
+        dates = [row[0] for row in cursor.fetchall()]
+    return max_id, dates
+
+
+def rebuild_day(day):
+    """在一个事务里重算一天的逐日汇总表；返回展开的轨迹点数"""
+    params = {"day": day, "tz": _time_zone()}
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(_DAY_POINTS_SQL, params)
+        points = cursor.rowcount
+        for table, columns, key in SUMMARY_TABLES:
+            for sql in _summary_sql(table, columns, key):
+                cursor.execute(sql, params)
+    return points
+
+
+def _view_info(cursor, name):
+    """(是否物化视图, 是否有唯一索引)"""
+    cursor.execute(
+        "SELECT EXISTS (SELECT 1 FROM pg_matviews "
+        "               WHERE schemaname = current_schema() AND matviewname = %s), "
+        "       EXISTS (SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indrelid "
+        "               WHERE c.relname = %s AND i.indisunique)",
+        [name, name],
+    )
+    return cursor.fetchone()
+
+
+def _refresh_view(name):
+    started = time.perf_counter()
+    try:
+        with connection.cursor() as cursor:
+            is_view, concurrently = _view_info(cursor, name)
+            if not is_view:
+                return {"name": name, "skipped": True}
+            cursor.execute("REFRESH MATERIALIZED VIEW {}{}".format(
+                "CONCURRENTLY " if concurrently else "", connection.ops.quote_name(name)))
+    finally:
+        connection.close()          # 线程各自的连接，用完即关
+    return {"name": name, "concurrently": concurrently,
+            "seconds": round(time.perf_counter() - started, 3)}
+
+
+def refresh_views(stages=None, workers=None):
+    """按阶段刷新物化视图，阶段内并行；返回每个视图的耗时"""
+    stages = stages if stages is not None else getattr(settings, "ROADS_REFRESH_VIEWS",
+                                                       DEFAULT_VIEWS)
+    results = []
+    for stage in stages:
+        if not stage:
+            continue
+        with ThreadPoolExecutor(max_workers=workers or len(stage)) as pool:
+            results.extend(pool.map(_refresh_view, stage))
+    return results
+
+
+def _try_lock():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", [ADVISORY_LOCK_KEY])
+        return cursor.fetchone()[0]
+
+
+def _unlock():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_unlock(%s)", [ADVISORY_LOCK_KEY])
+
+
+def run(trigger="command", dates=None, views=None, progress=None):
+    """
+    一次完整的增量刷新。
+    dates : 额外强制重算的日期（如修正过历史数据）；新轨迹涉及的日期总会重算
+    views : 物化视图阶段列表，默认 settings.ROADS_REFRESH_VIEWS；[] 表示不刷新视图
+    返回 FlowRefreshLog。
+    """
+    progress = progress or (lambda message: None)
+    if not _try_lock():
+        raise RefreshBusy("已有刷新在运行")
+
+    todo = []
+    try:
+        log = FlowRefreshLog.objects.create(trigger=trigger)
+    except Exception:
+        _unlock()
+        raise
+    try:
+        log.from_trip_id = watermark()
+        log.to_trip_id, affected = index_new_trips(log.from_trip_id)
+        todo = sorted(set(affected) | set(dates or []))
+        progress(f"新轨迹 ({log.from_trip_id}, {log.to_trip_id}]，重算 {len(todo)} 天")
+        for day in todo:
+            started = time.perf_counter()
+            points = rebuild_day(day)
+            progress(f"{day}: {points} 个轨迹点，{time.perf_counter() - started:.1f}s")
+        log.dates = [d.isoformat() for d in todo]
+        log.views = refresh_views(views)
+        for v in log.views:
+            if v.get("skipped"):
+                progress(f"{v['name']}: 不是物化视图，跳过")
+            else:
+                progress(f"{v['name']}: {v['seconds']}s"
+                         + ("（CONCURRENTLY）" if v["concurrently"] else ""))
+        log.status = FlowRefreshLog.STATUS_SUCCESS
+    except Exception as exc:
+        log.status = FlowRefreshLog.STATUS_FAILED
+        log.detail = repr(exc)
+        raise
+    finally:
+        log.finished_at = timezone.now()
+        log.save()
+        _unlock()
+
+    _notify(log.pk, todo)
+    return log
+
+
+# ---- 后台运行（API 触发） -------------------------------------------------------
+_running = threading.Lock()
+
+
+def start_background(dates=None, views=None):
+    """在后台线程里 run()；本进程已有刷新在跑时抛 RefreshBusy"""
+    if not _running.acquire(blocking=False):
+        raise RefreshBusy("已有刷新在运行")
+
+    def target():
+        try:
+            run(trigger="api", dates=dates, views=views)
+        except RefreshBusy as exc:
+            logger.warning("后台刷新未启动：%s", exc)
+        except Exception:
+            logger.exception("后台刷新失败")
+        finally:
+            connection.close()
+            _running.release()
+
+    threading.Thread(target=target, name="roads-flow-refresh", daemon=True).start()
+
+
+# ---- 跨进程的缓存失效 -----------------------------------------------------------
+_generation = None
+_checked_at = 0.0
+_generation_lock = threading.Lock()
+
+
+def _notify(generation_id, dates):
+    global _generation
+    with _generation_lock:
+        _generation = generation_id
+    flows_refreshed.send(sender=FlowRefreshLog, dates=dates)
+
+
+def generation():
+    """
+    最近一次成功刷新的日志 id，可作缓存 key 的一部分。
+    每隔 ROADS_REFRESH_CHECK_INTERVAL 秒查一次库；发现其他进程刷新过，
+    就在本进程发 flows_refreshed。
+    """
+    global _generation, _checked_at
+    interval = getattr(settings, "ROADS_REFRESH_CHECK_INTERVAL", 60)
+    if time.monotonic() - _checked_at < interval:
+        return _generation
+    with _generation_lock:
+        if time.monotonic() - _checked_at < interval:
+            return _generation
+        latest = (FlowRefreshLog.objects.filter(status=FlowRefreshLog.STATUS_SUCCESS)
+                  .order_by("-pk").values_list("pk", flat=True).first())
+        changed = _generation is not None and latest != _generation
+        _generation, _checked_at = latest, time.monotonic()
+    if changed:
+        flows_refreshed.send(sender=FlowRefreshLog, dates=None)
+    return latest
+
+
+def parse_dates(values):
+    return [date.fromisoformat(v) for v in values or []]
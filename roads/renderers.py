@@ -0,0 +1,42 @@
+"""
+自定义 DRF renderer。
+
+DRF 会把 ?format=xxx 当作渲染器选择（URL_FORMAT_OVERRIDE），没有对应
+renderer 的 format 会直接 404。二进制接口在视图里自己返回预编码的
+HttpResponse，这里的 renderer 只负责让 ?format=bin / arrow / polyline
+通过内容协商；出错（4xx/5xx）时错误信息照常按 application/json 返回。
+"""
+import json
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.settings import api_settings
+
+
+class OctetStreamRenderer(BaseRenderer):
+    media_type = "application/octet-stream"
+    format = "bin"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            return bytes(data)
+        response = (renderer_context or {}).get("response")
+        if response is not None and response.status_code >= 400:
+            # Response.rendered_content 在调用 render 前已按本 renderer 设好 Content-Type
+            response["Content-Type"] = "application/json"
+        return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+
+class ArrowStreamRenderer(OctetStreamRenderer):
+    media_type = "application/vnd.apache.arrow.stream"
+    format = "arrow"
+
+
+class PolylineJSONRenderer(JSONRenderer):
+    """?format=polyline 的响应仍是 JSON，只是几何换成了编码折线"""
+    format = "polyline"
+
+
+def with_formats(*renderers):
+    """默认 renderer 之外再追加若干 format，用于 @renderer_classes"""
+    return [*api_settings.DEFAULT_RENDERER_CLASSES, *renderers]
@@ -0,0 +1,94 @@
+"""
+路名搜索索引。
+
+对路网快照里的 distinct road_name 建 n-gram 倒排：每个字（unigram）和相邻
+两字（bigram）→ 名称编号。中文路名按字切分天然合适，英文/拼音同样适用。
+查询先对 bigram 倒排表求交得到候选，再做一次子串校验，不用扫全表。
+
+名称和查询都先经 normalize（NFKC、casefold、去掉首尾空白）再比较，所以与
+icontains 并不完全相同，而是它的超集：ASCII 和普通中文路名上两者结果一样；
+全角/半角等兼容字符（「ＡＢＣ」与「abc」）、「ß」与「ss」这类大小写折叠在这里
+算匹配，icontains 不算。查询首尾的空白会被忽略，只有空白的查询不匹配任何路名。
+"""
+import unicodedata
+
+import numpy as np
+
+
+def normalize(text):
+    """全角转半角、大小写折叠，保证「中山路」「ＡＢＣ」与「abc」能互相匹配"""
+    return unicodedata.normalize("NFKC", text or "").casefold().strip()
+
+
+def _grams(text):
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    return grams
+
+
+class RoadNameIndex:
+    def __init__(self, road_names):
+        """road_names: 按快照行号排列的路名列表（可含 None）"""
+        rows_by_name = {}
+        for row, name in enumerate(road_names):
+            if name:
+                rows_by_name.setdefault(name, []).append(row)
+
+        self.names = list(rows_by_name)
+        self.folded = [normalize(n) for n in self.names]
+        self.rows = [np.array(rows_by_name[n], dtype=np.int64) for n in self.names]
+
+        postings = {}
+        for name_id, folded in enumerate(self.folded):
+            for gram in _grams(folded):
+                postings.setdefault(gram, []).append(name_id)
+        self._postings = {g: np.array(ids, dtype=np.int64) for g, ids in postings.items()}
+
+    def __len__(self):
+        return len(self.names)
+
+    def _candidates(self, query):
+        if len(query) == 1:
+            return self._postings.get(query, np.empty(0, dtype=np.int64))
+        lists = []
+        for gram in {query[i:i + 2] for i in range(len(query) - 1)}:
+            ids = self._postings.get(gram)
+            if ids is None:
+                return np.empty(0, dtype=np.int64)
+            lists.append(ids)
+        lists.sort(key=len)
+        result = lists[0]
+        for ids in lists[1:]:
+            result = np.intersect1d(result, ids, assume_unique=True)
+            if not len(result):
+                break
+        return result
+
+    def match(self, query):
+        """包含 query 的名称编号（未排序）"""
+        query = normalize(query)
+        if not query:
+            return []
+        folded = self.folded
+        return [i for i in self._candidates(query).tolist() if query in folded[i]]
+
+    def rows_matching(self, query):
+        """包含 query 的全部快照行号（升序），替代 road_name__icontains（差别见模块说明）"""
+        ids = self.match(query)
+        if not ids:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate([self.rows[i] for i in ids]))
+
+    def search(self, query, limit=10):
+        """
+        自动补全：返回排好序的名称编号，最多 limit 个。
+        排序为 完全匹配 > 前缀匹配 > 子串（越靠前越好）> 名称越短越好 > 路段越多越好
+        """
+        q = normalize(query)
+        ranked = []
+        for i in self.match(query):
+            name = self.folded[i]
+            pos = name.find(q)
+            ranked.append(((name != q, pos != 0, pos, len(name), -len(self.rows[i]), name), i))
+        ranked.sort()
+        return [i for _, i in ranked[:limit]]
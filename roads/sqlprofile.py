@@ -0,0 +1,463 @@
+"""
+SQL 剖析（调试用，ROADS_SQL_PROFILE = True 时启用）。
+
+SQLProfileMiddleware 记下每个请求执行的全部 SQL（含批量接口、异步视图线程池里的），
+按语句指纹（参数、IN 列表长度、字面量归一）汇总，并标出：
+
+    slow        单次耗时 ≥ ROADS_SQL_SLOW_MS
+    repeated    同一请求里同一指纹执行 ≥ ROADS_SQL_REPEAT_THRESHOLD 次（N+1）
+    oversized   返回行数 ≥ ROADS_SQL_MAX_ROWS
+    unbounded   从 ROADS_SQL_LARGE_TABLES 里的大表 SELECT，既没有 WHERE 也没有 LIMIT
+    wide        SELECT 列表直接取了 ROADS_SQL_WIDE_COLUMNS 里的大字段（如 bfmap_ways.geom），
+                用函数包起来的（ST_AsBinary 等）不算
+
+PostgreSQL 上耗时 ≥ ROADS_SQL_EXPLAIN_MS 的 SELECT，每个指纹在每个进程里抓一次
+EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)（会把语句再执行一遍），计划里带过滤条件的
+Seq Scan 汇总到报告的 seq_scans，看哪张物化视图缺哪个索引。
+
+每个路由的累计结果写到 ROADS_SQL_PROFILE_DIR/<路由>.<pid>.json：同一路由距上次写入
+不到 ROADS_SQL_FLUSH_SECONDS 秒的请求只累计不落盘，进程退出时再全部写一遍。
+`manage.py sql_report` 合并各进程的文件输出汇总；有标记的语句同时写 logger "roads.sql"。
+"""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from .files import write_atomic
+
+logger = logging.getLogger("roads.sql")
+
+DEFAULT_LARGE_TABLES = (
+    "bfmap_ways", "taxi_pickups", "trip_road_data", "road_hourly_flow", "road_day_flow",
+    "road_daily_count", "road_hourly_count", "road_hour_trip_counts", "road_day_trip_counts",
+    "trip_day_index", "ways",
+)
+DEFAULT_WIDE_COLUMNS = {"bfmap_ways": ("geom",)}
+MAX_STATEMENTS = 200        # 每个路由最多保留的指纹数
+MAX_SQL_CHARS = 4000
+
+_ROADS_DIR = str(Path(__file__).resolve().parent) + os.sep
+# 记录器、计时包装自身的栈帧不算来源
+_SKIP_FILES = {_ROADS_DIR + "sqlprofile.py", _ROADS_DIR + "instrumentation.py"}
+
+_log_var = contextvars.ContextVar("roads_sql_log", default=None)
+_explained = set()              # 本进程已抓过 EXPLAIN 的指纹
+_explained_lock = threading.Lock()
+
+
+def enabled():
+    return getattr(settings, "ROADS_SQL_PROFILE", False)
+
+
+def _setting(name, default):
+    return getattr(settings, f"ROADS_SQL_{name}", default)
+
+
+# ---- 语句归一 -----------------------------------------------------------------
+_IN_LIST = re.compile(r"\bIN \((?:%s(?:, )?)+\)", re.IGNORECASE)
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w\"$])\d+(?:\.\d+)?\b")
+_SPACE = re.compile(r"\s+")
+
+
+def fingerprint(sql):
+    """去掉参数差异后的语句：IN (%s, %s, …) → IN (…)，字面量 → ?"""
+    sql = _IN_LIST.sub("IN (...)", sql)
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    return _SPACE.sub(" ", sql).strip()
+
+
+def _select_list(sql):
+    m = re.match(r"\s*SELECT\s+(.*?)\s+FROM\s", sql, re.IGNORECASE | re.DOTALL)
+    return m.group(1) if m else ""
+
+
+def flags_for(sql, rows):
+    """单条语句本身的标记（slow / repeated 在汇总时判断）"""
+    flags = set()
+    upper = sql.lstrip().upper()
+    if not upper.startswith(("SELECT", "WITH")):
+        return flags
+    if rows is not None and rows >= _setting("MAX_ROWS", 10000):
+        flags.add("oversized")
+    large = _setting("LARGE_TABLES", DEFAULT_LARGE_TABLES)
+    if " LIMIT " not in upper and " WHERE " not in upper and any(f'FROM "{t}"' in sql or f"FROM {t} " in sql + " "
+                                      for t in large):
+        select = _select_list(sql).upper()
+        if not any(agg in select for agg in ("COUNT(", "MAX(", "MIN(", "SUM(", "AVG(")):
+            flags.add("unbounded")
+    select = _select_list(sql)
+    for table, columns in _setting("WIDE_COLUMNS", DEFAULT_WIDE_COLUMNS).items():
+        for column in columns:
+            # 直接出现在 SELECT 列表里（前面不是左括号，即没被函数包住）
+            if re.search(rf'(?<!\()"{table}"\."{column}"', select):
+                flags.add("wide")
+    return flags
+
+
+def _source():
+    """调用栈里最内层的 roads 代码位置"""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(_ROADS_DIR) and filename not in _SKIP_FILES:
+            rel = filename[len(_ROADS_DIR):]
+            return f"roads/{rel}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return None
+
+
+# ---- EXPLAIN ------------------------------------------------------------------
+def explain(connection, sql, params):
+    """EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)；在独立的底层游标上执行，不影响原结果集"""
+    raw = connection.connection.cursor()
+    in_transaction = not connection.get_autocommit()
+    try:
+        if in_transaction:
+            raw.execute("SAVEPOINT roads_sqlprofile")
+        try:
+            raw.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql, params)
+            plan = raw.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+        except Exception as e:
+            if in_transaction:
+                raw.execute("ROLLBACK TO SAVEPOINT roads_sqlprofile")
+            return {"error": f"{type(e).__name__}: {e}"}
+        if in_transaction:
+            raw.execute("RELEASE SAVEPOINT roads_sqlprofile")
+        return plan
+    finally:
+        raw.close()
+
+
+def seq_scans(plan):
+    """计划树里带 Filter 的 Seq Scan：[{relation, filter, rows, rows_removed}]"""
+    found = []
+
+    def walk(node):
+        if node.get("Node Type") == "Seq Scan" and node.get("Filter"):
+            found.append({
+                "relation": node.get("Relation Name"),
+                "filter": node["Filter"],
+                "rows": node.get("Actual Rows"),
+                "rows_removed": node.get("Rows Removed by Filter"),
+            })
+        for child in node.get("Plans", ()):
+            walk(child)
+
+    for entry in plan if isinstance(plan, list) else ():
+        walk(entry.get("Plan", {}))
+    return found
+
+
+# ---- 记录 ---------------------------------------------------------------------
+class Statement:
+    __slots__ = ("fingerprint", "sql", "params", "ms", "rows", "source", "plan")
+
+    def __init__(self, fingerprint, sql, params, ms, rows, source, plan):
+        self.fingerprint = fingerprint
+        self.sql = sql
+        self.params = params
+        self.ms = ms
+        self.rows = rows
+        self.source = source
+        self.plan = plan
+
+
+class RequestLog:
+    """一个请求里执行的语句；批量接口的子查询在别的线程里也往这里记"""
+
+    def __init__(self):
+        self.statements = []
+        self._lock = threading.Lock()
+
+    def add(self, statement):
+        with self._lock:
+            self.statements.append(statement)
+
+
+def _should_explain(connection, fp, sql, ms, many):
+    if (many or connection.vendor != "postgresql" or ms < _setting("EXPLAIN_MS", 100)
+            or not sql.lstrip().upper().startswith(("SELECT", "WITH"))):
+        return False
+    with _explained_lock:
+        if fp in _explained:
+            return False
+        _explained.add(fp)
+        return True
+
+
+def _record(execute, sql, params, many, context):
+    log = _log_var.get()
+    if log is None:
+        return execute(sql, params, many, context)
+    started = perf_counter()
+    failed = True
+    try:
+        result = execute(sql, params, many, context)
+        failed = False
+        return result
+    finally:
+        ms = (perf_counter() - started) * 1000
+        rows = None if failed else getattr(context["cursor"], "rowcount", -1)
+        fp = fingerprint(sql)
+        connection = context["connection"]
+        # 趁连接和事务还在，紧接着在同一线程里抓计划
+        plan = (explain(connection, sql, params)
+                if not failed and _should_explain(connection, fp, sql, ms, many) else None)
+        log.add(Statement(fp, sql, None if many else params, ms,
+                          rows if rows is not None and rows >= 0 else None, _source(), plan))
+
+
+def _attach(connection):
+    if _record not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record)
+
+
+def _on_connection_created(sender, connection, **kwargs):
+    _attach(connection)
+
+
+def install():
+    """给已有和以后新建的数据库连接装上记录器（apps.ready 调用）"""
+    for conn in connections.all():
+        _attach(conn)
+    connection_created.connect(_on_connection_created, dispatch_uid="roads-sqlprofile")
+    atexit.register(flush_reports)
+
+
+# ---- 汇总 ---------------------------------------------------------------------
+class RouteReport:
+    """一个路由的累计结果；statements 按指纹合并"""
+
+    def __init__(self, route):
+        self.route = route
+        self.requests = 0
+        self.queries = 0
+        self.db_ms = 0.0
+        self.max_queries = 0
+        self.statements = {}
+        self.lock = threading.Lock()
+        self.written_at = None      # 上次落盘的 monotonic 时间
+        self.dirty = False
+
+    def add_request(self, log):
+        """并入一个请求的语句，返回本请求里有标记的 {指纹: 汇总}"""
+        slow_ms = _setting("SLOW_MS", 100)
+        repeat = _setting("REPEAT_THRESHOLD", 5)
+        per_request = {}
+        for st in log.statements:
+            per_request[st.fingerprint] = per_request.get(st.fingerprint, 0) + 1
+
+        flagged = {}
+        with self.lock:
+            self.dirty = True
+            self.requests += 1
+            self.queries += len(log.statements)
+            self.max_queries = max(self.max_queries, len(log.statements))
+            for st in log.statements:
+                fp, sql, params, ms, rows = st.fingerprint, st.sql, st.params, st.ms, st.rows
+                self.db_ms += ms
+                s = self.statements.get(fp)
+                if s is None:
+                    if len(self.statements) >= MAX_STATEMENTS:
+                        continue
+                    s = self.statements[fp] = {
+                        "fingerprint": fp, "sql": sql[:MAX_SQL_CHARS], "params": repr(params)[:500],
+                        "source": st.source, "calls": 0, "total_ms": 0.0, "max_ms": 0.0,
+                        "max_rows": None, "max_per_request": 0, "flags": [], "explain": None,
+                        "seq_scans": [],
+                    }
+                s["calls"] += 1
+                s["total_ms"] += ms
+                if ms > s["max_ms"]:
+                    s["max_ms"] = ms
+                    s["sql"], s["params"], s["source"] = sql[:MAX_SQL_CHARS], repr(params)[:500], st.source
+                if rows is not None and (s["max_rows"] is None or rows > s["max_rows"]):
+                    s["max_rows"] = rows
+                s["max_per_request"] = max(s["max_per_request"], per_request[fp])
+                flags = flags_for(sql, rows)
+                if ms >= slow_ms:
+                    flags.add("slow")
+                if per_request[fp] >= repeat:
+                    flags.add("repeated")
+                if flags - set(s["flags"]):
+                    s["flags"] = sorted(set(s["flags"]) | flags)
+                if flags:
+                    flagged[fp] = s
+                if st.plan is not None:
+                    s["explain"] = st.plan
+                    s["seq_scans"] = seq_scans(st.plan)
+        return flagged
+
+    def to_json(self):
+        with self.lock:
+            statements = sorted(self.statements.values(), key=lambda s: -s["total_ms"])
+            return {
+                "route": self.route,
+                "pid": os.getpid(),
+                "updated_at": time.time(),
+                "requests": self.requests,
+                "queries": self.queries,
+                "db_ms": round(self.db_ms, 3),
+                "max_queries_per_request": self.max_queries,
+                "statements": [{**s, "total_ms": round(s["total_ms"], 3),
+                                "max_ms": round(s["max_ms"], 3)} for s in statements],
+            }
+
+
+_reports = {}
+_reports_lock = threading.Lock()
+
+
+def report_for(route):
+    with _reports_lock:
+        report = _reports.get(route)
+        if report is None:
+            report = _reports[route] = RouteReport(route)
+        return report
+
+
+def _slug(route):
+    return re.sub(r"[^\w.-]+", "_", route).strip("_") or "root"
+
+
+def profile_dir():
+    return Path(_setting("PROFILE_DIR", None) or Path(tempfile.gettempdir()) / "harbin_roads_sqlprofile")
+
+
+def write_report(report):
+    path = profile_dir() / f"{_slug(report.route)}.{os.getpid()}.json"
+    with report.lock:
+        report.dirty = False
+        report.written_at = time.monotonic()
+    write_atomic(path, json.dumps(report.to_json(), ensure_ascii=False, indent=1,
+                                  default=str).encode("utf-8"))
+
+
+def maybe_write_report(report):
+    """距上次落盘超过 ROADS_SQL_FLUSH_SECONDS 才写；返回是否写了"""
+    interval = _setting("FLUSH_SECONDS", 5)
+    with report.lock:
+        due = report.written_at is None or time.monotonic() - report.written_at >= interval
+    if due:
+        write_report(report)
+    return due
+
+
+def flush_reports():
+    """把还没落盘的累计结果全部写出（进程退出时调用）"""
+    with _reports_lock:
+        reports = list(_reports.values())
+    for report in reports:
+        if report.dirty:
+            write_report(report)
+
+
+def merge(reports):
+    """多个进程同一路由的报告合并成一份"""
+    merged = {"route": reports[0]["route"], "requests": 0, "queries": 0, "db_ms": 0.0,
+              "max_queries_per_request": 0, "statements": {}}
+    for r in reports:
+        merged["requests"] += r["requests"]
+        merged["queries"] += r["queries"]
+        merged["db_ms"] += r["db_ms"]
+        merged["max_queries_per_request"] = max(merged["max_queries_per_request"],
+                                                r["max_queries_per_request"])
+        for s in r["statements"]:
+            m = merged["statements"].get(s["fingerprint"])
+            if m is None:
+                merged["statements"][s["fingerprint"]] = dict(s)
+                continue
+            m["calls"] += s["calls"]
+            m["total_ms"] += s["total_ms"]
+            m["max_per_request"] = max(m["max_per_request"], s["max_per_request"])
+            m["flags"] = sorted(set(m["flags"]) | set(s["flags"]))
+            if s["max_rows"] is not None:
+                m["max_rows"] = max(m["max_rows"] or 0, s["max_rows"])
+            if s["max_ms"] > m["max_ms"]:
+                m.update(max_ms=s["max_ms"], sql=s["sql"], params=s["params"], source=s["source"])
+            if m["explain"] is None and s["explain"] is not None:
+                m.update(explain=s["explain"], seq_scans=s["seq_scans"])
+    merged["statements"] = sorted(merged["statements"].values(), key=lambda s: -s["total_ms"])
+    return merged
+
+
+def load_reports(directory=None):
+    """目录里的报告按路由合并：[{route, requests, …, statements}]"""
+    by_route = {}
+    for path in sorted(Path(directory or profile_dir()).glob("*.json")):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        by_route.setdefault(data["route"], []).append(data)
+    return [merge(reports) for _, reports in sorted(by_route.items())]
+
+
+# ---- 中间件 -------------------------------------------------------------------
+class SQLProfileMiddleware:
+    """放在 RequestTimingMiddleware 之后；只在 ROADS_SQL_PROFILE 打开时启用"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        log = RequestLog()
+        token = _log_var.set(log)
+        try:
+            response = self.get_response(request)
+        finally:
+            _log_var.reset(token)
+        self._finish(request, log)
+        return response
+
+    async def __acall__(self, request):
+        # 视图在线程池里执行时 contextvars 随 sync_to_async 带过去，语句照样记到这个 log
+        log = RequestLog()
+        token = _log_var.set(log)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _log_var.reset(token)
+        self._finish(request, log)
+        return response
+
+    def _finish(self, request, log):
+        match = getattr(request, "resolver_match", None)
+        if match is not None and log.statements:
+            self._report(match.route, request, log)
+
+    def _report(self, route, request, log):
+        report = report_for(route)
+        flagged = report.add_request(log)
+        maybe_write_report(report)
+        for s in flagged.values():
+            logger.warning("%s %s %s: %s ×%d, %.1f ms, %s — %s", request.method, request.path,
+                           ",".join(s["flags"]), s["source"], s["max_per_request"], s["max_ms"],
+                           s["max_rows"], s["fingerprint"][:300])
@@ -1,3 +1,971 @@
-from django.test import TestCase
+import datetime as dt
+import gzip
+import json
+import re
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from types import SimpleNamespace
 
-# Create your tests here.
+import numpy as np
+import shapely
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.conf import settings
+from django.contrib.gis.db.models.functions import AsWKB
+from django.db import connection
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+
+from . import (
+    async_views,
+    benchdata,
+    benchmark,
+    cluster_cache,
+    geomcodec,
+    instrumentation,
+    network,
+    pickups,
+    queries,
+    rankings,
+    sqlprofile,
+    views,
+)
+from .clustering import NOISE, SlidingWindowDBSCAN, grid_dbscan
+from .geo import to_local
+from .parallel import ClusterPool
+from .pickups import PickupStore, to_epoch
+from .payloads import PayloadCache, PreparedPayload
+from .search import RoadNameIndex
+from .transitions import TransitionIndex
+from .utils import dbscan_geo
+from .lookup import UNNAMED_ROAD
+from .models import (
+    BfmapWay,
+    Highway,
+    RoadDailyCount,
+    RoadDayFlow,
+    RoadDurationStats,
+    RoadHighwayMapping,
+    RoadHourlyFlow,
+)
+
+
+class UnmanagedTablesMixin:
+    """为 managed = False 的模型在测试库里建表（正式库里这些表不归 migrate 管）"""
+    unmanaged_models = ()
+
+    @classmethod
+    def setUpClass(cls):
+        existing = set(connection.introspection.table_names())
+        with connection.schema_editor() as editor:
+            for model in cls.unmanaged_models:
+                if model._meta.db_table not in existing:
+                    editor.create_model(model)
+        super().setUpClass()
+
+
+class RankingCacheTests(UnmanagedTablesMixin, TestCase):
+    unmanaged_models = (RoadDurationStats,)
+
+    @classmethod
+    def setUpTestData(cls):
+        rows = [(1, "primary", 50), (2, None, 40), (3, None, 30), (4, "primary", 20),
+                (5, "secondary", 10), (6, None, 5)]
+        RoadDurationStats.objects.bulk_create(
+            RoadDurationStats(road_id=gid, highway_name=highway, duration_category="short",
+                              trip_count=count)
+            for gid, highway, count in rows)
+
+    def setUp(self):
+        rankings.DURATION.invalidate()
+        self.addCleanup(rankings.DURATION.invalidate)
+
+    def _query(self, highway_name, n):
+        params = {"duration_category": "short", "n": str(n)}
+        if highway_name is not None:
+            params["highway_name"] = highway_name
+        return queries.top_roads_by_duration_category(params)
+
+    def test_unfiltered_ranking_with_null_highway_names(self):
+        rows = rankings.DURATION.top("short", None, 10)
+        self.assertEqual([r["road_id"] for r in rows], [1, 2, 3, 4, 5, 6])
+
+    def test_cache_matches_queryset(self):
+        for highway_name in (None, "", "primary", "secondary", "motorway"):
+            for n in (1, 3, 10):
+                with self.subTest(highway_name=highway_name, n=n):
+                    query = self._query(highway_name, n)
+                    self.assertEqual(query.cached(), list(query.queryset))
+
+
+def create_ways():
+    """三种等级、带 NULL 的小路网"""
+    Highway.objects.bulk_create([
+        Highway(id=1, name="primary", priority=1.0, maxspeed=60),
+        Highway(id=2, name="residential", priority=1.2, maxspeed=30),
+    ])
+    names = ["Zhongshan Road", "Hongqi Street", None, "zhongshan east road", "Xuefu Road"]
+    ways = []
+    for gid in range(1, 21):
+        line = shapely.linestrings([(126.6 + gid * 0.001 + k * 0.0005, 45.7 + k * 0.0003)
+                                    for k in range(2 + gid % 3)])
+        ways.append(BfmapWay(gid=gid, osm_id=None if gid % 7 == 0 else 1000 + gid,
+                             class_id=None if gid % 6 == 0 else 1 + gid % 3,
+                             road_name=names[gid % len(names)],
+                             geom=memoryview(shapely.to_wkb(line)), priority=1.0))
+    BfmapWay.objects.bulk_create(ways)
+
+
+def orm_ways(queryset=None, with_highway=False):
+    """原 list_all_bfmap_ways / filter_bfmap_ways 的逐行 ORM 输出"""
+    queryset = BfmapWay.objects.all() if queryset is None else queryset
+    highway_map = {h.id: h.name for h in Highway.objects.all()}
+    results = []
+    for way in queryset.order_by("gid").annotate(wkb=AsWKB("geom")):
+        coords = []
+        if way.wkb:
+            coords = [[x, y] for x, y in shapely.from_wkb(bytes(way.wkb)).coords]
+        row = {"gid": way.gid, "osm_id": way.osm_id, "class_id": way.class_id,
+               "road_name": way.road_name, "coord_list": coords}
+        if with_highway:
+            row["highway_type"] = highway_map.get(way.class_id)
+        results.append(row)
+    return results
+
+
+class RoadNetworkTests(UnmanagedTablesMixin, TestCase):
+    unmanaged_models = (BfmapWay, Highway)
+
+    @classmethod
+    def setUpTestData(cls):
+        create_ways()
+
+    def setUp(self):
+        network.invalidate()
+        self.addCleanup(network.invalidate)
+
+    def test_records_match_orm(self):
+        self.assertEqual(network.get_network().records(), orm_ways())
+
+    def test_select_matches_orm_filter(self):
+        net = network.get_network()
+        cases = [
+            ({"class_id": 2}, {"class_id": 2}),
+            ({"gid": 5}, {"gid": 5}),
+            ({"osm_id": 1003}, {"osm_id": 1003}),
+            ({"road_name": "zhongshan"}, {"road_name__icontains": "zhongshan"}),
+            ({"class_id": 1, "road_name": "road"}, {"class_id": 1, "road_name__icontains": "road"}),
+        ]
+        for kwargs, lookup in cases:
+            with self.subTest(**kwargs):
+                self.assertEqual(net.records(net.select(**kwargs)),
+                                 orm_ways(BfmapWay.objects.filter(**lookup)))
+
+    @override_settings(ROADS_NETWORK_CHECK_INTERVAL=0)
+    def test_signature_detects_updates_outside_orm_signals(self):
+        net = network.get_network()
+        # queryset.update 不发 post_save，只能靠签名发现
+        BfmapWay.objects.filter(gid=3).update(road_name="Renamed Road")
+        updated = network.get_network()
+        self.assertIsNot(updated, net)
+        self.assertEqual(updated.road_name[2], "Renamed Road")
+
+        Highway.objects.filter(id=2).update(name="secondary")
+        self.assertEqual(network.get_network().highway_name(2), "secondary")
+
+    @override_settings(ROADS_NETWORK_CHECK_INTERVAL=0)
+    def test_unchanged_tables_keep_snapshot(self):
+        net = network.get_network()
+        self.assertIs(network.get_network(), net)
+
+
+def decode_polyline(text, precision):
+    """逐字符的参考解码（Google 折线算法）→ [[lng, lat], …]"""
+    values, value, shift = [], 0, 0
+    for ch in text:
+        b = ord(ch) - 63
+        value |= (b & 0x1F) << shift
+        shift += 5
+        if b < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value, shift = 0, 0
+    lat = lng = 0
+    points = []
+    for dlat, dlng in zip(values[::2], values[1::2]):
+        lat += dlat
+        lng += dlng
+        points.append([lng / 10 ** precision, lat / 10 ** precision])
+    return points
+
+
+def decode_bin(body, count, precision):
+    """format=bin 响应体 → [(gid, class_id, [[lng, lat], …]), …]"""
+    gids = np.frombuffer(body, "<i8", count)
+    class_ids = np.frombuffer(body, "<i4", count, offset=8 * count)
+    counts = np.frombuffer(body, "<u4", count, offset=12 * count)
+    deltas = np.frombuffer(body, "<i4", offset=16 * count).reshape(-1, 2)
+    rows, start = [], 0
+    for gid, class_id, n in zip(gids.tolist(), class_ids.tolist(), counts.tolist()):
+        points = np.cumsum(deltas[start:start + n], axis=0) / 10 ** precision
+        rows.append((gid, class_id, points.tolist()))
+        start += n
+    return rows
+
+
+class GeometryCodecTests(UnmanagedTablesMixin, TestCase):
+    unmanaged_models = (BfmapWay, Highway)
+
+    @classmethod
+    def setUpTestData(cls):
+        create_ways()
+
+    def setUp(self):
+        network.invalidate()
+        self.addCleanup(network.invalidate)
+
+    def assertCoordsClose(self, decoded, expected, precision):
+        self.assertEqual(len(decoded), len(expected))
+        if expected:
+            np.testing.assert_allclose(decoded, expected, rtol=0, atol=0.5 / 10 ** precision + 1e-12)
+
+    def test_polyline_reference_vector(self):
+        # Google 文档里的示例：(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)
+        coords = np.array([[-120.2, 38.5], [-120.95, 40.7], [-126.453, 43.252]])
+        self.assertEqual(geomcodec.encode_polylines(coords, np.array([3]), 5),
+                         ["_p~iF~ps|U_ulLnnqC_mqNvxq`@"])
+
+    def test_polyline_round_trip(self):
+        expected = orm_ways()
+        for precision in (5, 6):
+            with self.subTest(precision=precision):
+                response = self.client.get("/api/bfmap_ways/",
+                                           {"format": "polyline", "precision": precision})
+                self.assertEqual(response.status_code, 200)
+                rows = json.loads(response.content)
+                self.assertEqual(len(rows), len(expected))
+                for row, old in zip(rows, expected):
+                    coords = old.pop("coord_list")
+                    self.assertCoordsClose(decode_polyline(row.pop("polyline"), precision),
+                                           coords, precision)
+                    self.assertEqual(row, old)
+                    old["coord_list"] = coords
+
+    def test_bin_round_trip(self):
+        for url, params, queryset in (
+                ("/api/bfmap_ways/", {}, None),
+                ("/api/bfmap_ways/filter/", {"class_id": 2}, BfmapWay.objects.filter(class_id=2))):
+            with self.subTest(url=url):
+                response = self.client.get(url, {**params, "format": "bin"})
+                self.assertEqual(response.status_code, 200)
+                count = int(response["X-Road-Count"])
+                precision = int(response["X-Geometry-Precision"])
+                rows = decode_bin(response.content, count, precision)
+                expected = orm_ways(queryset)
+                self.assertEqual(len(rows), len(expected))
+                for (gid, class_id, coords), old in zip(rows, expected):
+                    self.assertEqual(gid, old["gid"])
+                    self.assertEqual(class_id, -1 if old["class_id"] is None else old["class_id"])
+                    self.assertCoordsClose(coords, old["coord_list"], precision)
+
+    def test_errors_are_json_under_binary_format(self):
+        response = self.client.get("/api/bfmap_ways/", {"format": "bin", "precision": "99"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertIn("precision", json.loads(response.content)["detail"])
+
+
+class TextRoadIdTests(UnmanagedTablesMixin, TestCase):
+    unmanaged_models = (BfmapWay, Highway, RoadDailyCount)
+
+    @classmethod
+    def setUpTestData(cls):
+        create_ways()
+        RoadDailyCount.objects.bulk_create([
+            RoadDailyCount(road_id=road_id, date="2015-01-03", trip_count=count,
+                           highway_name="primary")
+            for road_id, count in (("3", 50), ("abc", 40), ("12", 30), ("", 20),
+                                   ("99999999999999999999", 10))
+        ])
+
+    def setUp(self):
+        network.invalidate()
+        self.addCleanup(network.invalidate)
+        rankings.DAILY.invalidate()
+        self.addCleanup(rankings.DAILY.invalidate)
+
+    def test_non_numeric_road_ids_keep_old_output(self):
+        # 原视图：按 trip_count 取前 n，路名按 str(gid) 对上，对不上的给 UNNAMED_ROAD
+        names = {str(w.gid): w.road_name for w in BfmapWay.objects.all()}
+        expected = [{"road_id": r.road_id, "trip_count": r.trip_count, "date": "2015-01-03",
+                     "road_name": names.get(r.road_id, UNNAMED_ROAD)}
+                    for r in RoadDailyCount.objects.order_by("-trip_count")]
+        for n in (10, 1000):        # 缓存命中 / 超过 K 直接查库
+            with self.subTest(n=n):
+                response = self.client.get("/api/top-roads/", {"date": "2015-01-03", "n": n})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(json.loads(response.content), expected)
+
+
+class BatchQueryTests(UnmanagedTablesMixin, TransactionTestCase):
+    """
+    子查询在线程池里用各自的数据库连接执行，看不到 TestCase 事务里没提交的数据，
+    所以用 TransactionTestCase，测试数据真正提交
+    """
+    unmanaged_models = (BfmapWay, Highway, RoadDailyCount)
+
+    def setUp(self):
+        TextRoadIdTests.setUpTestData.__func__(type(self))
+        # TransactionTestCase 只清空 managed 模型的表，这几张自己清
+        for model in self.unmanaged_models:
+            self.addCleanup(model.objects.all().delete)
+        self.invalidate_caches()
+        self.addCleanup(self.invalidate_caches)
+
+    def invalidate_caches(self):
+        network.invalidate()
+        rankings.DAILY.invalidate()
+
+    def test_results_match_individual_requests(self):
+        subqueries = [
+            {"id": "daily", "path": "top-roads/", "params": {"date": "2015-01-03", "n": 3}},
+            {"id": "same", "path": "/api/top-roads/?n=3&date=2015-01-03"},
+            {"id": "bad", "path": "top-roads/", "params": {"date": "2015-01-03", "n": 0}},
+            {"id": "ways", "path": "bfmap_ways/filter/", "params": {"class_id": 2}},
+            {"id": "deep", "path": "top-roads/", "params": {"date": "2015-01-03", "n": 1000}},
+        ]
+        urls = ["/api/top-roads/?date=2015-01-03&n=3", "/api/top-roads/?date=2015-01-03&n=3",
+                "/api/top-roads/?date=2015-01-03&n=0", "/api/bfmap_ways/filter/?class_id=2",
+                "/api/top-roads/?date=2015-01-03&n=1000"]
+        for workers in (1, 4):
+            with self.subTest(workers=workers), override_settings(ROADS_BATCH_WORKERS=workers):
+                # 冷缓存：排行缓存由子查询在各自线程里从库里建
+                self.invalidate_caches()
+                response = self.client.post("/api/batch/", {"queries": subqueries},
+                                            content_type="application/json")
+                self.assertEqual(response.status_code, 200)
+                results = json.loads(response.content)["results"]
+                self.assertEqual([r["id"] for r in results], ["daily", "same", "bad", "ways", "deep"])
+                self.assertTrue(all(r["body"] for r in results))
+                self.invalidate_caches()
+                for result, url in zip(results, urls):
+                    single = self.client.get(url)
+                    self.assertEqual(result["status"], single.status_code)
+                    self.assertEqual(result["body"], json.loads(single.content))
+
+    def test_rejects_binary_and_unknown_paths(self):
+        response = self.client.post("/api/batch/", {"queries": [
+            {"path": "bfmap_ways/", "params": {"format": "bin"}}, {"path": "nope/"}]},
+            content_type="application/json")
+        binary, unknown = json.loads(response.content)["results"]
+        # 二进制格式在子查询里要么被内容协商拒绝（406），要么在 batch 里判为非 JSON（400）
+        self.assertIn(binary["status"], (400, 406))
+        self.assertEqual(unknown["status"], 404)
+
+
+class RoadNameIndexTests(SimpleTestCase):
+    names = ["中山路", "中山东路", None, "Zhongshan Road", "zhongshan east road", "红旗大街",
+             "中山路", "ＡＢＣ Street", "Königstraße", "学府路", "", "Xuefu Road"]
+
+    def setUp(self):
+        self.index = RoadNameIndex(self.names)
+
+    def icontains(self, query):
+        return [i for i, name in enumerate(self.names) if name and query.lower() in name.lower()]
+
+    def test_matches_icontains_on_plain_names(self):
+        for query in ("中山", "中山路", "路", "东", "ROAD", "zhongshan e", "o", "Xuefu Road",
+                      "大街", "没有这条路", "Z"):
+            with self.subTest(query=query):
+                self.assertEqual(self.index.rows_matching(query).tolist(), self.icontains(query))
+
+    def test_normalized_matches_beyond_icontains(self):
+        # 模块说明里列出的差别：兼容字符、大小写折叠、首尾空白
+        self.assertEqual(self.index.rows_matching("abc").tolist(), [7])
+        self.assertEqual(self.icontains("abc"), [])
+        self.assertEqual(self.index.rows_matching("strasse").tolist(), [8])
+        self.assertEqual(self.index.rows_matching("  中山路 ").tolist(), [0, 6])
+        self.assertEqual(self.index.rows_matching("   ").tolist(), [])
+
+    def test_search_ranking(self):
+        self.assertEqual([self.index.names[i] for i in self.index.search("中山")],
+                         ["中山路", "中山东路"])
+
+
+class KeysetPaginationTests(UnmanagedTablesMixin, TestCase):
+    unmanaged_models = (BfmapWay, Highway, RoadHighwayMapping)
+
+    @classmethod
+    def setUpTestData(cls):
+        create_ways()
+        RoadHighwayMapping.objects.bulk_create([
+            RoadHighwayMapping(road_id=road_id, highway_name="primary" if road_id % 3 else "trunk",
+                               highway_id=1 if road_id % 3 else 2)
+            for road_id in (40, 5, 17, 3, 99, 23, 8, 61, 12, 30, 71)
+        ])
+
+    def setUp(self):
+        network.invalidate()
+        self.addCleanup(network.invalidate)
+
+    def follow(self, url, params):
+        """顺着 Link: rel="next" 翻完所有页，返回拼起来的结果和页数"""
+        response = self.client.get(url, params)
+        items, pages = [], 0
+        while True:
+            self.assertEqual(response.status_code, 200)
+            items += json.loads(response.content)
+            pages += 1
+            link = response.get("Link")
+            if link is None:
+                return items, pages
+            next_url = re.match(r"<http://testserver(.+)>; rel=\"next\"", link).group(1)
+            response = self.client.get(next_url)
+
+    def streamed(self, url, params, mode):
+        response = self.client.get(url, {**params, "stream": mode})
+        body = b"".join(response.streaming_content).decode("utf-8")
+        if mode == "ndjson":
+            return [json.loads(line) for line in body.splitlines()]
+        return json.loads(body)
+
+    def test_bfmap_ways_pages_add_up_to_full_list(self):
+        full = orm_ways()
+        for limit in (1, 7, 20, 50):
+            with self.subTest(limit=limit):
+                items, pages = self.follow("/api/bfmap_ways/", {"limit": limit})
+                self.assertEqual(items, full)
+                # 最后一页不带 Link，不会多出一个空页
+                self.assertEqual(pages, -(-len(full) // limit))
+        items, _ = self.follow("/api/bfmap_ways/", {"limit": 6, "after": 9})
+        self.assertEqual(items, [w for w in full if w["gid"] > 9])
+        for mode in ("json", "ndjson"):
+            with self.subTest(stream=mode):
+                self.assertEqual(self.streamed("/api/bfmap_ways/", {}, mode), full)
+
+    def test_roads_by_highway_type_pages_match_orm(self):
+        for params in ({"highway_name": "primary"}, {"highway_id": 2}):
+            expected = sorted(RoadHighwayMapping.objects.filter(**params)
+                              .values_list("road_id", flat=True))
+            with self.subTest(**params):
+                unpaged = json.loads(self.client.get("/api/roads-by-highway-type/", params).content)
+                self.assertEqual(sorted(unpaged), expected)
+                items, _ = self.follow("/api/roads-by-highway-type/", {**params, "limit": 2})
+                self.assertEqual(items, expected)
+                for mode in ("json", "ndjson"):
+                    self.assertEqual(self.streamed("/api/roads-by-highway-type/", params, mode),
+                                     expected)
+
+
+class FlowMatrixTests(UnmanagedTablesMixin, TestCase):
+    unmanaged_models = (BfmapWay, Highway, RoadHourlyFlow, RoadDayFlow)
+    days = [dt.date(2015, 1, 3), dt.date(2015, 1, 4), dt.date(2015, 1, 5)]
+
+    @classmethod
+    def setUpTestData(cls):
+        create_ways()
+        rng = np.random.default_rng(8)
+        hourly, daily = [], []
+        for road_id in [*range(1, 21), 999]:         # 999 不在路网里
+            for day in cls.days:
+                hours = sorted(rng.choice(24, size=rng.integers(0, 6), replace=False).tolist())
+                counts = rng.integers(1, 50, size=len(hours)).tolist()
+                hourly += [RoadHourlyFlow(biz_date=day, road_id=road_id, hour=h, traffic_cnt=c)
+                           for h, c in zip(hours, counts)]
+                if hours:
+                    daily.append(RoadDayFlow(biz_date=day, road_id=road_id, traffic_cnt=sum(counts)))
+        RoadHourlyFlow.objects.bulk_create(hourly)
+        RoadDayFlow.objects.bulk_create(daily)
+
+    def setUp(self):
+        network.invalidate()
+        self.addCleanup(network.invalidate)
+
+    def single_road(self, road_id, day):
+        """原 road_flow 单路段单日接口的结果，补零成 24 小时"""
+        response = self.client.get("/api/road-flow/", {"road_id": road_id, "date": day.isoformat()})
+        hours = [0] * 24
+        for row in json.loads(response.content):
+            hours[row["hour"]] = row["traffic_cnt"]
+        return hours
+
+    def test_road_flow_matrix_matches_single_road_queries(self):
+        road_ids = [7, 3, 999, 12, 404]
+        params = {"road_ids": "7,3,999,12,404,3", "start": "2015-01-03", "end": "2015-01-05"}
+        expected = [[self.single_road(r, d) for d in self.days] for r in road_ids]
+
+        nested = json.loads(self.client.get("/api/road-flow/", params).content)
+        self.assertEqual(nested["road_ids"], road_ids)
+        self.assertEqual(nested["dates"], [d.isoformat() for d in self.days])
+        self.assertEqual(nested["traffic_cnt"], expected)
+
+        columnar = json.loads(self.client.get("/api/road-flow/", {**params, "layout": "columnar"}).content)
+        self.assertEqual(columnar["traffic_cnt"], np.ravel(expected).tolist())
+
+    def test_out_of_range_hours_are_ignored(self):
+        expected = self.single_road(5, self.days[0])
+        RoadHourlyFlow.objects.bulk_create([
+            RoadHourlyFlow(biz_date=self.days[0], road_id=5, hour=24, traffic_cnt=7),
+            RoadHourlyFlow(biz_date=self.days[0], road_id=5, hour=99, traffic_cnt=7),
+        ])
+        response = self.client.get("/api/road-flow/", {"road_ids": "5", "start": "2015-01-03"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)["traffic_cnt"], [[expected]])
+
+    def test_network_flow_matches_orm(self):
+        gids = json.loads(self.client.get("/api/network-flow/gids/").content)["gids"]
+        self.assertEqual(gids, sorted(BfmapWay.objects.values_list("gid", flat=True)))
+        for day in self.days:
+            for hour, qs in ((None, RoadDayFlow.objects.filter(biz_date=day)),
+                             (8, RoadHourlyFlow.objects.filter(biz_date=day, hour=8))):
+                with self.subTest(day=day, hour=hour):
+                    by_road = dict(qs.values_list("road_id", "traffic_cnt"))
+                    expected = [by_road.get(gid, 0) for gid in gids]
+                    params = {"date": day.isoformat(), **({"hour": hour} if hour is not None else {})}
+                    body = json.loads(self.client.get("/api/network-flow/", params).content)
+                    self.assertEqual(body["traffic_cnt"], expected)
+                    raw = self.client.get("/api/network-flow/", {**params, "format": "bin"}).content
+                    self.assertEqual(np.frombuffer(raw, "<i4").tolist(), expected)
+
+
+class OffloadedViewTests(UnmanagedTablesMixin, TransactionTestCase):
+    """ASGI 下经 async_views.offloaded 在线程池里执行的接口，响应与同步视图相同"""
+    unmanaged_models = (BfmapWay, Highway, RoadHourlyFlow, RoadDayFlow)
+    days = FlowMatrixTests.days
+
+    def setUp(self):
+        FlowMatrixTests.setUpTestData.__func__(type(self))
+        for model in self.unmanaged_models:
+            self.addCleanup(model.objects.all().delete)
+        network.invalidate()
+        self.addCleanup(network.invalidate)
+
+    def test_matches_sync_views(self):
+        cases = [
+            (views.filter_bfmap_ways, "/api/bfmap_ways/filter/", {"road_name": "road"}, {}),
+            (views.filter_bfmap_ways, "/api/bfmap_ways/filter/",
+             {"near": "126.61,45.7", "k": 3, "format": "bin"}, {}),
+            (views.road_flow, "/api/road-flow/", {"road_ids": "3,7", "start": "2015-01-03",
+                                                  "end": "2015-01-05"}, {}),
+            (views.network_flow, "/api/network-flow/", {"date": "2015-01-04", "format": "bin"}, {}),
+            (views.network_flow_gids, "/api/network-flow/gids/", {}, {}),
+            (views.search_road_names, "/api/road-names/search/", {"q": "zhongshan"}, {}),
+            (views.search_road_names, "/api/road-names/search/", {"limit": "x"}, {}),
+            (views.bfmap_way_tile, "/api/tiles/14/14148/5830.mvt", {}, {"z": 14, "x": 14148, "y": 5830}),
+            (views.bfmap_way_tile, "/api/tiles/1/5/5.mvt", {}, {"z": 1, "x": 5, "y": 5}),
+        ]
+        for view, url, params, kwargs in cases:
+            with self.subTest(url=url, **params):
+                expected = self.client.get(url, params)
+                request = RequestFactory().get(url, params)
+                response = async_to_sync(async_views.offloaded(view))(request, **kwargs)
+                self.assertEqual(response.status_code, expected.status_code)
+                self.assertEqual(response["Content-Type"], expected["Content-Type"])
+                self.assertEqual(response.content, expected.content)
+
+
+class ClusterPoolTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        centres = np.array([[45.75, 126.63], [45.76, 126.65]])
+        latlng = np.concatenate([c + rng.normal(0, 0.0005, (150, 2)) for c in centres])
+        self.time = np.sort(rng.uniform(0, 7200, len(latlng)))
+        self.store = SimpleNamespace(version=1, directory=None, time=self.time,
+                                     lat=latlng[:, 0].copy(), lng=latlng[:, 1].copy(),
+                                     period=np.zeros(len(latlng), dtype=np.int8))
+
+    def test_matches_serial_dbscan(self):
+        with ClusterPool(self.store, workers=2) as pool:
+            clusters = pool.submit(0, 3600, None, 200, 20).result()
+        a, b = np.searchsorted(self.time, [0, 3600])
+        expected = dbscan_geo(np.column_stack((self.store.lat[a:b], self.store.lng[a:b])),
+                              eps_m=200, min_samples=20)
+        self.assertEqual(clusters, expected)
+
+    def test_retired_pool_finishes_leased_work(self):
+        pool = ClusterPool(self.store, workers=1).acquire()
+        future = pool.submit(0, 7200, None, 200, 20)
+        pool.retire()
+        self.assertEqual(len(future.result()), 2)
+        pool.release()
+        self.assertTrue(future.done() and not future.cancelled())
+
+
+    def test_pool_keeps_reading_its_store_version(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = Path(tmp.name) / "pickups"
+        columns = (self.time.astype(np.int64), self.store.lat, self.store.lng, self.store.period)
+        PickupStore(*columns, ["Morning Peak"]).save(path)
+        old = PickupStore.open(path)
+        # 建池之后、工作进程启动之前，存储换成了没有点的新版本
+        pool = ClusterPool(old, workers=1)
+        self.addCleanup(pool.shutdown)
+        empty = [c[:0] for c in columns]
+        PickupStore(*empty, ["Morning Peak"]).save(path)
+        self.assertEqual(len(PickupStore.open(path)), 0)
+        self.assertNotEqual(PickupStore.open(path).directory, old.directory)
+        self.assertEqual(len(pool.submit(0, 7200, None, 200, 20).result()), 2)
+
+    def test_save_prunes_old_versions(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = Path(tmp.name) / "pickups"
+        columns = (self.time.astype(np.int64), self.store.lat, self.store.lng, self.store.period)
+        for _ in range(5):
+            PickupStore(*columns, []).save(path)
+        versions = sorted(p for p in Path(tmp.name).iterdir() if p.name.startswith("pickups."))
+        self.assertEqual(len(versions), pickups.KEEP_VERSIONS)
+        self.assertEqual(path.resolve(), versions[-1])
+
+
+class PayloadCacheTests(SimpleTestCase):
+    def test_concurrent_misses_build_once(self):
+        cache, calls, results = PayloadCache(), [], []
+
+        def build():
+            calls.append(1)
+            time.sleep(0.05)
+            return {"value": 1}
+
+        threads = [threading.Thread(target=lambda: results.append(cache.get(1, "k", build)))
+                   for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual({id(r) for r in results}, {id(results[0])})
+        self.assertEqual(results[0].bodies["identity"], b'{"value":1}')
+
+    def test_slow_key_does_not_block_other_keys(self):
+        cache, started, release = PayloadCache(), threading.Event(), threading.Event()
+
+        def slow():
+            started.set()
+            release.wait(5)
+            return []
+
+        thread = threading.Thread(target=cache.get, args=(1, "slow", slow))
+        thread.start()
+        started.wait(5)
+        payload = cache.get(1, "fast", lambda: PreparedPayload(b"x", "application/octet-stream"))
+        self.assertEqual(payload.bodies["identity"], b"x")
+        self.assertTrue(thread.is_alive())
+        release.set()
+        thread.join()
+
+    def test_failed_build_is_retried(self):
+        cache = PayloadCache()
+
+        def broken():
+            raise RuntimeError("boom")
+
+        with self.assertRaises(RuntimeError):
+            cache.get(1, "k", broken)
+        self.assertEqual(len(cache.get(1, "k", lambda: [1])), 3)
+
+    def test_new_version_drops_old_payloads(self):
+        cache = PayloadCache()
+        first = cache.get(1, "k", lambda: [1])
+        self.assertIs(cache.get(1, "k", lambda: [2]), first)
+        self.assertEqual(cache.get(2, "k", lambda: [2]).bodies["identity"], b"[2]")
+
+
+class BfmapWaysEndpointTests(UnmanagedTablesMixin, TestCase):
+    unmanaged_models = (BfmapWay, Highway)
+
+    @classmethod
+    def setUpTestData(cls):
+        create_ways()
+
+    def setUp(self):
+        network.invalidate()
+        self.addCleanup(network.invalidate)
+
+    def test_list_matches_orm(self):
+        response = self.client.get("/api/bfmap_ways/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), orm_ways())
+
+    def test_gzip_and_etag(self):
+        plain = self.client.get("/api/bfmap_ways/")
+        zipped = self.client.get("/api/bfmap_ways/", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(zipped["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(zipped.content), plain.content)
+        cached = self.client.get("/api/bfmap_ways/", HTTP_IF_NONE_MATCH=plain["ETag"])
+        self.assertEqual(cached.status_code, 304)
+
+    def test_filter_matches_orm(self):
+        for params, lookup in (({"class_id": "2"}, {"class_id": 2}),
+                               ({"road_name": "Road"}, {"road_name__icontains": "Road"})):
+            with self.subTest(**params):
+                response = self.client.get("/api/bfmap_ways/filter/", params)
+                self.assertEqual(json.loads(response.content),
+                                 orm_ways(BfmapWay.objects.filter(**lookup), with_highway=True))
+
+
+class TransitionIndexTests(SimpleTestCase):
+    trips = {
+        1: [10, 11, 11, 12],
+        2: [11, 12, 11, 12],
+        3: [12],
+        4: [],
+        5: [13, 10, 11],
+        6: [10, 11, 12, 13],
+    }
+
+    def _delta(self, trip_ids):
+        lists = [self.trips[t] for t in trip_ids]
+        flat = np.array([r for ids in lists for r in ids], dtype=np.int64)
+        return TransitionIndex.delta(trip_ids, [len(ids) for ids in lists], flat)
+
+    def _build(self, *chunks):
+        index = TransitionIndex.empty()
+        for chunk in chunks:
+            index = index.merge(*self._delta(chunk), watermark=chunk[-1])
+        return index
+
+    def test_chunked_merge_matches_single_build(self):
+        whole = self._build([1, 2, 3, 4, 5, 6])
+        chunked = self._build([1, 2], [3], [4, 5, 6])
+        self.assertEqual(chunked.watermark, 6)
+        self.assertEqual(chunked.roads.tolist(), whole.roads.tolist())
+        self.assertEqual((chunked.succ != whole.succ).nnz, 0)
+        self.assertEqual((chunked.road_trips != whole.road_trips).nnz, 0)
+
+    def test_combined_deltas_match_chunked_merge(self):
+        base = self._build([1, 2])
+        combined = base.merge(*TransitionIndex.combine([self._delta([3]), self._delta([4, 5]),
+                                                        self._delta([6])]), watermark=6)
+        chunked = self._build([1, 2], [3], [4, 5], [6])
+        self.assertEqual(combined.watermark, 6)
+        self.assertEqual(combined.roads.tolist(), chunked.roads.tolist())
+        self.assertEqual(combined.trips.tolist(), chunked.trips.tolist())
+        self.assertEqual((combined.succ != chunked.succ).nnz, 0)
+        self.assertEqual((combined.road_trips != chunked.road_trips).nnz, 0)
+
+    def test_counts_match_brute_force(self):
+        succ, through = Counter(), {}
+        for trip_id, ids in self.trips.items():
+            collapsed = [r for i, r in enumerate(ids) if i == 0 or r != ids[i - 1]]
+            succ.update(set(zip(collapsed, collapsed[1:])))
+            for road in collapsed:
+                through.setdefault(road, set()).add(trip_id)
+
+        index = self._build([1, 2, 3], [4, 5, 6])
+        for road in (10, 11, 12, 13, 99):
+            with self.subTest(road=road):
+                expected = sorted(((b, n) for (a, b), n in succ.items() if a == road),
+                                  key=lambda x: (-x[1], x[0]))
+                self.assertEqual(index.neighbours(road, "next", 10), expected)
+                self.assertEqual(index.trip_count(road), len(through.get(road, ())))
+        self.assertEqual(index.trips_through([10, 12], "all").tolist(),
+                         sorted(through[10] & through[12]))
+        self.assertEqual(index.trips_through([13, 99], "any").tolist(), sorted(through[13]))
+
+
+def reference_dbscan(xy, eps, min_samples):
+    """教科书式 DBSCAN（两两距离 + 逐点扩展），作为对照"""
+    dist = np.hypot(*(xy[:, None, :] - xy[None, :, :]).transpose(2, 0, 1))
+    neighbours = [np.flatnonzero(row <= eps) for row in dist]
+    core = np.array([len(nb) >= min_samples for nb in neighbours])
+    labels = np.full(len(xy), NOISE)
+    cluster = 0
+    for i in np.flatnonzero(core):
+        if labels[i] != NOISE:
+            continue
+        labels[i], stack = cluster, [i]
+        while stack:
+            for j in neighbours[stack.pop()]:
+                if labels[j] == NOISE:
+                    labels[j] = cluster
+                    if core[j]:
+                        stack.append(j)
+        cluster += 1
+    return labels, core, dist
+
+
+class GridDBSCANTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(42)
+        blobs = [rng.normal(centre, spread, (n, 2)) for centre, spread, n in (
+            ((0, 0), 60, 120), ((600, 100), 90, 80), ((250, 700), 30, 40), ((900, 900), 150, 30))]
+        self.xy = np.concatenate(blobs + [rng.uniform(-500, 1500, (60, 2))])
+
+    def _assert_equivalent(self, labels, eps, min_samples):
+        expected, core, dist = reference_dbscan(self.xy, eps, min_samples)
+        # 噪声点完全一致
+        self.assertEqual((labels == NOISE).tolist(), (expected == NOISE).tolist())
+        # 核心点的簇划分一致（簇号可以不同）
+        pairs = set(zip(labels[core].tolist(), expected[core].tolist()))
+        self.assertEqual(len(pairs), len({a for a, _ in pairs}))
+        self.assertEqual(len(pairs), len({b for _, b in pairs}))
+        # 边界点归到 eps 内某个核心点所在的簇
+        for i in np.flatnonzero(~core & (labels != NOISE)):
+            near_core = np.flatnonzero(core & (dist[i] <= eps))
+            self.assertIn(labels[i], labels[near_core].tolist())
+
+    def test_matches_reference(self):
+        for eps, min_samples in ((40, 5), (80, 10), (150, 20), (300, 4)):
+            with self.subTest(eps=eps, min_samples=min_samples):
+                self._assert_equivalent(grid_dbscan(self.xy, eps, min_samples), eps, min_samples)
+
+    def test_sliding_windows_match_fresh_runs(self):
+        rng = np.random.default_rng(7)
+        ids = np.arange(len(self.xy))
+        order = rng.permutation(len(self.xy))          # 点的"时间"顺序
+        lat, lng = 45.75 + self.xy[order, 1] / 111_000, 126.63 + self.xy[order, 0] / 78_000
+        engine = SlidingWindowDBSCAN(80, 8)
+        for lo in range(0, 200, 20):
+            window = slice(lo, lo + 150)
+            labels = engine.fit(ids[window], lat[window], lng[window])
+            fresh = grid_dbscan(to_local(lat[window], lng[window]), 80, 8)
+            self.assertEqual(labels.tolist(), fresh.tolist())
+
+    def test_rejects_non_positive_eps(self):
+        for eps in (0, -5):
+            with self.subTest(eps=eps), self.assertRaises(ValueError):
+                grid_dbscan(self.xy, eps, 5)
+        with self.assertRaises(ValueError):
+            grid_dbscan(self.xy, 50, 0)
+
+    def test_endpoint_rejects_bad_params_sync_and_async(self):
+        cases = [
+            {"start": "2015-01-06T07:00", "end": "2015-01-06T08:00", "eps": "0"},
+            {"start": "2015-01-06T07:00", "end": "2015-01-06T08:00", "minpts": "x"},
+            {"start": "2015-01-06T07:00", "end": "not a date"},
+            {"start": "2015-01-06T07:00"},
+        ]
+        for params in cases:
+            with self.subTest(**params):
+                response = self.client.get("/api/pickup-clusters/", params)
+                self.assertEqual(response.status_code, 400)
+                request = RequestFactory().get("/api/pickup-clusters/", params)
+                async_response = async_to_sync(async_views.pickup_clusters)(request)
+                self.assertEqual(async_response.status_code, 400)
+                self.assertEqual(json.loads(async_response.content), json.loads(response.content))
+
+
+class PickupStoreDatesTests(SimpleTestCase):
+    def store(self, times):
+        n = len(times)
+        times = np.array(sorted(to_epoch(t) for t in times), dtype=np.int64)
+        return PickupStore(times, np.full(n, 45.75), np.full(n, 126.63), np.zeros(n, dtype=np.int8),
+                           ["Morning Peak"])
+
+    @override_settings(TIME_ZONE="Asia/Shanghai")
+    def test_dates_follow_local_time_zone(self):
+        utc = dt.timezone.utc
+        # 北京时间 1 月 6 日早高峰和深夜，UTC 分别落在 5 日和 6 日
+        store = self.store([dt.datetime(2015, 1, 5, 23, 30, tzinfo=utc),
+                            dt.datetime(2015, 1, 6, 0, 45, tzinfo=utc),
+                            dt.datetime(2015, 1, 6, 15, 30, tzinfo=utc)])
+        self.assertEqual(store.dates(), [dt.date(2015, 1, 6)])
+        [(start, end, period), _] = cluster_cache.standard_windows(dt.date(2015, 1, 6))
+        lo, hi = store.bounds(start, end)
+        self.assertEqual((period, hi - lo), ("Morning Peak", 2))
+
+    def test_dates_span_midnight(self):
+        store = self.store([dt.datetime(2015, 1, 5, 23, 0), dt.datetime(2015, 1, 6, 1, 0),
+                            dt.datetime(2015, 1, 8, 12, 0)])
+        self.assertEqual(store.dates(), [dt.date(2015, 1, 5), dt.date(2015, 1, 6), dt.date(2015, 1, 8)])
+        self.assertEqual(self.store([]).dates(), [])
+
+
+class BenchmarkTargetTests(SimpleTestCase):
+    def test_requires_declared_benchmark_database(self):
+        with override_settings(ROADS_BENCHMARK_DATABASE=None):
+            with self.assertRaises(benchdata.UnsafeDatabase):
+                benchdata.check_target()
+
+    def test_refuses_protected_database(self):
+        db = connection.settings_dict
+        with override_settings(ROADS_BENCHMARK_DATABASE="default",
+                               ROADS_PROTECTED_DATABASES=[(db["HOST"], db["NAME"])]):
+            with self.assertRaises(benchdata.UnsafeDatabase):
+                benchdata.check_target()
+        with override_settings(ROADS_BENCHMARK_DATABASE="default",
+                               ROADS_PROTECTED_DATABASES=[("10.0.0.1", "harbin_platform")]):
+            benchdata.check_target()
+
+    def test_metrics_scenario_succeeds_with_benchmark_settings(self):
+        scenario = next(s for s in benchmark.scenarios(benchdata.Dataset()) if s.name == "metrics")
+        client = benchmark.client()
+        with override_settings(ROADS_INSTRUMENTATION=True, ROADS_METRICS_ALLOWED_IPS=["127.0.0.1"]):
+            ok = benchmark.run_scenario(client, scenario, repeat=1, warmup=0)
+        with override_settings(ROADS_INSTRUMENTATION=False):
+            missing = benchmark.run_scenario(client, scenario, repeat=1, warmup=0)
+        self.assertEqual(benchmark.failed({"ok": ok, "missing": missing}), ["missing"])
+
+
+class SQLProfileTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        overrides = override_settings(ROADS_SQL_PROFILE=True, ROADS_SQL_PROFILE_DIR=self.dir.name,
+                                      ROADS_SQL_FLUSH_SECONDS=60)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def request_log(self):
+        log = sqlprofile.RequestLog()
+        log.add(sqlprofile.Statement("SELECT 1", "SELECT 1", (), 1.0, 1, "tests.py:1", None))
+        return log
+
+    def files(self):
+        return sorted(Path(self.dir.name).glob("*.json"))
+
+    def test_report_written_on_throttle_and_flush(self):
+        report = sqlprofile.RouteReport("api/throttle/")
+        for _ in range(3):
+            report.add_request(self.request_log())
+            sqlprofile.maybe_write_report(report)
+        [path] = self.files()
+        self.assertEqual(json.loads(path.read_text(encoding="utf-8"))["requests"], 1)
+
+        with sqlprofile._reports_lock:
+            sqlprofile._reports[report.route] = report
+        self.addCleanup(sqlprofile._reports.pop, report.route)
+        sqlprofile.flush_reports()
+        self.assertEqual(json.loads(path.read_text(encoding="utf-8"))["requests"], 3)
+        self.assertFalse(report.dirty)
+
+    def test_async_middleware(self):
+        route = "api/async-profile/"
+        self.addCleanup(sqlprofile._reports.pop, route, None)
+
+        async def view(request):
+            sqlprofile._log_var.get().add(self.request_log().statements[0])
+            return "response"
+
+        middleware = sqlprofile.SQLProfileMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        request = SimpleNamespace(method="GET", path="/" + route,
+                                  resolver_match=SimpleNamespace(route=route))
+        self.assertEqual(async_to_sync(middleware)(request), "response")
+        self.assertEqual(sqlprofile.report_for(route).requests, 1)
+        self.assertEqual(len(self.files()), 1)
+
+
+@override_settings(ROADS_INSTRUMENTATION=True)
+class MetricsAccessTests(SimpleTestCase):
+    def test_metrics_only_from_allowed_ips(self):
+        self.assertEqual(self.client.get("/api/metrics/").status_code, 200)
+        self.assertEqual(self.client.get("/api/metrics/", REMOTE_ADDR="10.1.2.3").status_code, 403)
+        with override_settings(ROADS_METRICS_ALLOWED_IPS=["10.1.2.3"]):
+            self.assertEqual(self.client.get("/api/metrics/", REMOTE_ADDR="10.1.2.3").status_code, 200)
+
+    def test_default_allow_list_is_localhost(self):
+        with self.settings():
+            del settings.ROADS_METRICS_ALLOWED_IPS
+            request = RequestFactory().get("/api/metrics/")
+            self.assertTrue(instrumentation.metrics_allowed(request))
+            request.META["REMOTE_ADDR"] = "203.0.113.7"
+            self.assertFalse(instrumentation.metrics_allowed(request))
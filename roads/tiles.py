@@ -0,0 +1,181 @@
+"""
+bfmap_ways 矢量瓦片（Mapbox Vector Tile）。
+
+    /api/tiles/<z>/<x>/<y>.mvt
+
+瓦片直接从内存路网快照切出：先用快照的 STRtree 挑出候选，按 zoom 去掉
+priority 不够的道路（priority 越小越重要，取自 Highway 表 / road-types.json），
+投影到瓦片坐标后按 zoom 简化、裁剪，再编码成 MVT。结果进 LRU；配置了
+ROADS_TILE_DIR 时同时落盘，多进程和重启后都能复用。
+"""
+import json
+from pathlib import Path
+
+import numpy as np
+import shapely
+from django.conf import settings
+
+from . import mvt
+from .cache import LRUCache
+from .files import write_atomic
+from .network import NULL_ID, get_network
+
+LAYER_NAME = "roads"
+MAX_ZOOM = 22
+BUFFER = 64          # 瓦片外扩的缓冲（瓦片坐标单位），避免线在瓦片边界断开
+MAX_LAT = 85.05112878
+
+# zoom ≤ 键 时只保留 priority ≤ 值 的道路；更高的 zoom 不做过滤
+DEFAULT_ZOOM_PRIORITY = {8: 1.1, 10: 1.3, 12: 1.7, 13: 2.5}
+# zoom ≤ 键 时的简化容差（瓦片坐标单位，EXTENT = 一个瓦片宽）
+DEFAULT_ZOOM_TOLERANCE = {10: 16.0, 13: 8.0, MAX_ZOOM: 4.0}
+
+ROAD_TYPES_FILE = Path(__file__).resolve().parent.parent / "road-types.json"
+
+_tile_cache = LRUCache(getattr(settings, "ROADS_TILE_CACHE_SIZE", 4096))
+_road_type_priorities = None
+
+
+def _zoom_lookup(table, z):
+    for max_zoom in sorted(table):
+        if z <= max_zoom:
+            return table[max_zoom]
+    return None
+
+
+def _file_priorities():
+    global _road_type_priorities
+    if _road_type_priorities is None:
+        with open(ROAD_TYPES_FILE, encoding="utf-8") as f:
+            tags = json.load(f)["tags"]
+        _road_type_priorities = {
+            v["id"]: v["priority"] for t in tags for v in t["values"]
+        }
+    return _road_type_priorities
+
+
+def class_priorities(network):
+    """class_id → priority，Highway 表优先，缺的用 road-types.json 补"""
+    priorities = dict(_file_priorities())
+    priorities.update({
+        cid: h["priority"] for cid, h in network.highways.items()
+        if h["priority"] is not None
+    })
+    return priorities
+
+
+def _tile_lat(t):
+    return float(np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * t)))))
+
+
+def tile_bbox(z, x, y, buffer=0.0):
+    """瓦片的经纬度范围 (minx, miny, maxx, maxy)，buffer 为瓦片宽度的比例"""
+    n = 2 ** z
+    x0, x1 = (x - buffer) / n, (x + 1 + buffer) / n
+    y0, y1 = (y - buffer) / n, (y + 1 + buffer) / n
+    return x0 * 360 - 180, _tile_lat(y1), x1 * 360 - 180, _tile_lat(y0)
+
+
+def project(coords, z, x, y, extent=mvt.EXTENT):
+    """经纬度 → 瓦片 (z, x, y) 内的坐标，左上角为原点"""
+    n = 2 ** z
+    wx = (coords[:, 0] + 180.0) / 360.0 * n
+    lat = np.radians(np.clip(coords[:, 1], -MAX_LAT, MAX_LAT))
+    wy = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi) / 2.0 * n
+    return np.column_stack(((wx - x) * extent, (wy - y) * extent))
+
+
+def tile_candidates(network, z, x, y):
+    """外包框与瓦片（含缓冲）相交、且 priority 达到该 zoom 门槛的行号"""
+    idx = network.query_bbox(*tile_bbox(z, x, y, BUFFER / mvt.EXTENT))
+
+    zoom_priority = getattr(settings, "ROADS_TILE_ZOOM_PRIORITY", DEFAULT_ZOOM_PRIORITY)
+    max_priority = _zoom_lookup(zoom_priority, z)
+    if max_priority is not None:
+        priorities = class_priorities(network)
+        allowed = [cid for cid, p in priorities.items() if p <= max_priority]
+        idx = idx[np.isin(network.class_id[idx], allowed)]
+    return idx
+
+
+def _gather(network, idx):
+    """把若干条路的坐标拼成一块连续数组，返回 (coords, owner)"""
+    starts = network.offsets[idx]
+    lengths = network.offsets[idx + 1] - starts
+    owner = np.repeat(np.arange(len(idx)), lengths)
+    first = np.cumsum(lengths) - lengths
+    take = np.arange(lengths.sum()) - np.repeat(first, lengths) + np.repeat(starts, lengths)
+    return network.coords[take], owner
+
+
+def render_tile(network, z, x, y, extent=mvt.EXTENT):
+    layer = mvt.Layer(LAYER_NAME, extent)
+    idx = tile_candidates(network, z, x, y)
+    idx = idx[network.offsets[idx + 1] - network.offsets[idx] >= 2]
+    if not len(idx):
+        return mvt.encode_tile([layer])
+
+    coords, owner = _gather(network, idx)
+    geoms = shapely.linestrings(project(coords, z, x, y, extent), indices=owner)
+
+    zoom_tolerance = getattr(settings, "ROADS_TILE_ZOOM_TOLERANCE", DEFAULT_ZOOM_TOLERANCE)
+    tolerance = _zoom_lookup(zoom_tolerance, z) or 0.0
+    if tolerance:
+        geoms = shapely.simplify(geoms, tolerance, preserve_topology=False)
+    geoms = shapely.clip_by_rect(geoms, -BUFFER, -BUFFER, extent + BUFFER, extent + BUFFER)
+
+    parts, part_owner = shapely.get_parts(geoms, return_index=True)
+    keep = shapely.get_type_id(parts) == shapely.GeometryType.LINESTRING
+    parts, part_owner = parts[keep], part_owner[keep]
+    xy, point_part = shapely.get_coordinates(parts, return_index=True)
+    xy = np.rint(xy).astype(np.int64)
+
+    # 取整后去掉连续重复点
+    same = np.zeros(len(xy), dtype=bool)
+    same[1:] = (point_part[1:] == point_part[:-1]) & (xy[1:] == xy[:-1]).all(axis=1)
+    xy, point_part = xy[~same], point_part[~same]
+    bounds = np.searchsorted(point_part, np.arange(len(parts) + 1))
+
+    features = {}
+    for p in range(len(parts)):
+        s, e = bounds[p], bounds[p + 1]
+        if e - s >= 2:
+            features.setdefault(int(part_owner[p]), []).append(xy[s:e])
+
+    for k, lines in features.items():
+        i = idx[k]
+        class_id = int(network.class_id[i])
+        class_id = None if class_id == NULL_ID else class_id
+        layer.add_line(int(network.gid[i]), lines, {
+            "class_id": class_id,
+            "highway": network.highway_name(class_id),
+            "road_name": network.road_name[i],
+        })
+    return mvt.encode_tile([layer])
+
+
+def _disk_path(network, z, x, y):
+    tile_dir = getattr(settings, "ROADS_TILE_DIR", None)
+    if not tile_dir:
+        return None
+    return Path(tile_dir) / network.fingerprint / str(z) / str(x) / f"{y}.mvt"
+
+
+def get_tile(z, x, y):
+    """取瓦片字节：内存 LRU → 磁盘 → 现切"""
+    network = get_network()
+    key = (network.version, z, x, y)
+    data = _tile_cache.get(key)
+    if data is not None:
+        return data
+
+    path = _disk_path(network, z, x, y)
+    if path is not None and path.exists():
+        data = path.read_bytes()
+    else:
+        data = render_tile(network, z, x, y)
+        if path is not None:
+            write_atomic(path, data)
+
+    _tile_cache.set(key, data)
+    return data
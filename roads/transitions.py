@@ -0,0 +1,342 @@
+"""
+路段转移矩阵与路段 → 轨迹倒排索引。
+
+由 trip_road_data 的 road_ids 构建（连续重复的路段先合并成一个）：
+
+    succ        R×R CSR，succ[a, b] = 从 a 直接驶入 b 的轨迹数（同一轨迹只计一次）
+    pred        succ 的转置（CSR），查前驱
+    road_trips  R×T CSR（只存 indices），第 r 行是经过路段 r 的轨迹下标，升序
+
+roads / trips 分别是升序的路段 gid 和轨迹 id，行列号靠 searchsorted 换算。
+
+增量：watermark 记录已处理到的最大轨迹 id，之后只读 id 更大的轨迹，不重读历史。
+每读一批只算出这批的 COO 增量，全部读完后拼成一个增量、与已有矩阵合并一次：
+逐批合并每次都要重建整个 CSR，总耗时随历史长度平方增长。配置了 ROADS_TRANSITION_DIR 时由
+`manage.py build_transition_index` 写成 .npy 文件，各进程 mmap 打开；否则
+本进程在后台线程里从数据库构建，建好之前接口返回 503（IndexNotReady），之后每隔
+ROADS_TRANSITION_CHECK_INTERVAL 秒在后台读入新轨迹，期间继续用旧索引应答。
+"""
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import scipy.sparse as sp
+from django.conf import settings
+from django.db import connection
+
+from .trip_geometry import parse_id_lists
+
+logger = logging.getLogger("roads.transitions")
+
+SOURCE_TABLE = "trip_road_data"
+LOAD_CHUNK = 50_000
+META_FILE = "meta.json"
+ARRAYS = ("roads", "trips", "succ_indptr", "succ_indices", "succ_data",
+          "road_trips_indptr", "road_trips_indices")
+
+
+class IndexNotReady(Exception):
+    """索引还在后台构建（没有预先生成的文件），稍后重试"""
+
+
+def _empty_index():
+    return np.empty(0, dtype=np.int64)
+
+
+def _unique(keys):
+    """整数数组排序去重（比 np.unique 的哈希路径快）"""
+    keys = np.sort(keys)
+    return keys[np.concatenate(([True], keys[1:] != keys[:-1]))] if len(keys) else keys
+
+
+def _remap(old_keys, new_keys, idx):
+    """old_keys 下的行列号 → new_keys 下的行列号（old_keys ⊆ new_keys，均升序）"""
+    return np.searchsorted(new_keys, old_keys)[idx]
+
+
+class TransitionIndex:
+    def __init__(self, roads, trips, succ, road_trips, watermark=None):
+        self.roads = roads
+        self.trips = trips
+        self.succ = succ
+        self.road_trips = road_trips
+        self.watermark = watermark
+        self._pred = None
+
+    @classmethod
+    def empty(cls):
+        return cls(_empty_index(), _empty_index(),
+                   sp.csr_matrix((0, 0), dtype=np.int32), sp.csr_matrix((0, 0), dtype=np.int8))
+
+    @property
+    def pred(self):
+        if self._pred is None:
+            self._pred = self.succ.T.tocsr()
+        return self._pred
+
+    def row_of(self, road_ids):
+        """路段 gid → 行号，不存在的为 -1"""
+        road_ids = np.asarray(road_ids, dtype=np.int64)
+        pos = np.searchsorted(self.roads, road_ids)
+        pos[pos >= len(self.roads)] = 0
+        found = self.roads[pos] == road_ids if len(self.roads) else np.zeros(len(road_ids), bool)
+        return np.where(found, pos, -1)
+
+    # ---- 查询 --------------------------------------------------------------
+    def trip_count(self, road_id):
+        row = int(self.row_of([road_id])[0])
+        if row < 0:
+            return 0
+        return int(self.road_trips.indptr[row + 1] - self.road_trips.indptr[row])
+
+    def neighbours(self, road_id, direction="next", k=10):
+        """最常见的后继（next）/前驱（prev）路段：[(gid, 轨迹数), ...]，按轨迹数降序"""
+        row = int(self.row_of([road_id])[0])
+        if row < 0:
+            return []
+        matrix = self.succ if direction == "next" else self.pred
+        lo, hi = matrix.indptr[row], matrix.indptr[row + 1]
+        cols, counts = matrix.indices[lo:hi], matrix.data[lo:hi]
+        # 一行只有路口相连的几条路段，整行排序即可；同票数按 gid 升序，结果稳定
+        order = np.lexsort((self.roads[cols], -counts))[:k]
+        return list(zip(self.roads[cols[order]].tolist(), counts[order].tolist()))
+
+    def trips_through(self, road_ids, mode="all"):
+        """经过全部（all）/任一（any）给定路段的轨迹 id，升序"""
+        rows = self.row_of(road_ids)
+        if mode == "all" and (rows < 0).any():
+            return _empty_index()
+        rows = rows[rows >= 0]
+        if not len(rows):
+            return _empty_index()
+        indptr, indices = self.road_trips.indptr, self.road_trips.indices
+        lists = sorted((indices[indptr[r]:indptr[r + 1]] for r in rows), key=len)
+        result = lists[0]
+        for cols in lists[1:]:
+            if mode == "all":
+                result = np.intersect1d(result, cols, assume_unique=True)
+                if not len(result):
+                    break
+            else:
+                result = np.union1d(result, cols)
+        return self.trips[result]
+
+    # ---- 构建 / 增量 --------------------------------------------------------
+    @staticmethod
+    def delta(trip_ids, counts, flat):
+        """一批轨迹 → (路段, 轨迹, 转移 COO, 倒排 COO)，行列号相对于这批自己的路段/轨迹表"""
+        trip_ids = np.asarray(trip_ids, dtype=np.int64)
+        trip_of = np.repeat(np.arange(len(trip_ids)), counts)
+        # 合并连续重复的路段
+        keep = np.ones(len(flat), dtype=bool)
+        keep[1:] = (flat[1:] != flat[:-1]) | (trip_of[1:] != trip_of[:-1])
+        flat, trip_of = flat[keep], trip_of[keep]
+
+        roads, road_idx = np.unique(flat, return_inverse=True)
+        n_roads, n_trips = len(roads), len(trip_ids)
+        same_trip = trip_of[1:] == trip_of[:-1]
+        # (轨迹, a, b) / (路段, 轨迹) 压成一个 int64 再去重，比 unique(axis=0) 快得多
+        keys = (trip_of[1:] * n_roads + road_idx[:-1]) * n_roads + road_idx[1:]
+        keys = _unique(keys[same_trip])                      # 同一轨迹同一转移只计一次
+        transitions = np.column_stack((keys // n_roads % n_roads, keys % n_roads))
+        keys = _unique(road_idx * n_trips + trip_of)
+        visits = np.column_stack((keys // n_trips, keys % n_trips))
+        return roads, trip_ids, transitions, visits
+
+    @staticmethod
+    def combine(deltas):
+        """多批 delta() 的结果拼成一个（轨迹按批次顺序首尾相接），路段表只做一次并集"""
+        if len(deltas) == 1:
+            return deltas[0]
+        roads = _unique(np.concatenate([d[0] for d in deltas]))
+        trip_ids = np.concatenate([d[1] for d in deltas])
+        transitions, visits, offset = [], [], 0
+        for chunk_roads, chunk_trips, chunk_transitions, chunk_visits in deltas:
+            remap = np.searchsorted(roads, chunk_roads)
+            transitions.append(remap[chunk_transitions].reshape(-1, 2))
+            visits.append(np.column_stack((remap[chunk_visits[:, 0]], chunk_visits[:, 1] + offset)))
+            offset += len(chunk_trips)
+        return roads, trip_ids, np.concatenate(transitions), np.concatenate(visits)
+
+    def merge(self, roads, trip_ids, transitions, visits, watermark):
+        """把 delta() 的结果并入，返回新的 TransitionIndex（本对象不变）"""
+        all_roads = np.union1d(self.roads, roads)
+        all_trips = np.concatenate([self.trips, trip_ids])   # 新轨迹 id 都大于 watermark，仍升序
+        n_roads, n_trips = len(all_roads), len(all_trips)
+
+        old = self.succ.tocoo()
+        succ = sp.coo_matrix(
+            (np.concatenate([old.data, np.ones(len(transitions), dtype=np.int32)]),
+             (np.concatenate([_remap(self.roads, all_roads, old.row),
+                              _remap(roads, all_roads, transitions[:, 0])]),
+              np.concatenate([_remap(self.roads, all_roads, old.col),
+                              _remap(roads, all_roads, transitions[:, 1])]))),
+            shape=(n_roads, n_roads),
+        ).tocsr()
+        succ.sum_duplicates()
+
+        old = self.road_trips.tocoo()
+        rows = np.concatenate([_remap(self.roads, all_roads, old.row),
+                               _remap(roads, all_roads, visits[:, 0])])
+        cols = np.concatenate([old.col, len(self.trips) + visits[:, 1]]).astype(np.int32)
+        road_trips = sp.csr_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)),
+                                   shape=(n_roads, n_trips))
+        road_trips.sort_indices()
+        return TransitionIndex(all_roads, all_trips, succ.astype(np.int32), road_trips, watermark)
+
+    def extend_from_db(self, chunk_size=LOAD_CHUNK):
+        """
+        读入 id > watermark 的轨迹，按 id 键集分页，每页只算增量，读完后合并一次；
+        没有新轨迹时返回自身
+        """
+        deltas = []
+        watermark = self.watermark
+        with connection.cursor() as cursor:
+            while True:
+                where, params = ("", []) if watermark is None else ("WHERE id > %s", [watermark])
+                cursor.execute(f"SELECT id, road_ids::text FROM {SOURCE_TABLE} {where} "
+                               f"ORDER BY id LIMIT %s", [*params, chunk_size])
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                ids, texts = zip(*rows)
+                deltas.append(self.delta(*parse_id_lists(ids, texts)))
+                watermark = ids[-1]
+        if not deltas:
+            return self
+        return self.merge(*self.combine(deltas), watermark=watermark)
+
+    # ---- 持久化 ------------------------------------------------------------
+    def save(self, directory):
+        directory = Path(directory)
+        directory.parent.mkdir(parents=True, exist_ok=True)
+        tmp = Path(tempfile.mkdtemp(dir=directory.parent, prefix=f".{directory.name}-"))
+        arrays = {
+            "roads": self.roads, "trips": self.trips,
+            "succ_indptr": self.succ.indptr, "succ_indices": self.succ.indices,
+            "succ_data": self.succ.data,
+            "road_trips_indptr": self.road_trips.indptr,
+            "road_trips_indices": self.road_trips.indices,
+        }
+        for name, arr in arrays.items():
+            np.save(tmp / f"{name}.npy", arr)
+        meta = {"watermark": self.watermark, "built_at": time.time()}
+        (tmp / META_FILE).write_text(json.dumps(meta), encoding="utf-8")
+        if directory.exists():
+            old = directory.with_name(f".{directory.name}-old-{os.getpid()}")
+            directory.rename(old)
+            tmp.rename(directory)
+            shutil.rmtree(old, ignore_errors=True)
+        else:
+            tmp.rename(directory)
+
+    @classmethod
+    def open(cls, directory, mmap=True):
+        directory = Path(directory)
+        meta = json.loads((directory / META_FILE).read_text(encoding="utf-8"))
+        a = {name: np.load(directory / f"{name}.npy", mmap_mode="r" if mmap else None)
+             for name in ARRAYS}
+        n_roads, n_trips = len(a["roads"]), len(a["trips"])
+        succ = sp.csr_matrix((a["succ_data"], a["succ_indices"], a["succ_indptr"]),
+                             shape=(n_roads, n_roads))
+        road_trips = sp.csr_matrix(
+            (np.ones(len(a["road_trips_indices"]), dtype=np.int8),
+             a["road_trips_indices"], a["road_trips_indptr"]),
+            shape=(n_roads, n_trips))
+        return cls(a["roads"], a["trips"], succ, road_trips, meta["watermark"])
+
+
+_index = None
+_index_stamp = None
+_checked_at = None
+_updating = False
+_lock = threading.Lock()
+
+
+def _index_dir():
+    directory = getattr(settings, "ROADS_TRANSITION_DIR", None)
+    return Path(directory) if directory else None
+
+
+def _start_update(base):
+    """在后台线程里 base.extend_from_db()，完成后替换 _index；已有更新在跑时什么也不做"""
+    global _updating
+
+    def target():
+        global _index, _index_stamp, _checked_at, _updating
+        try:
+            index = base.extend_from_db()
+            with _lock:
+                _index, _index_stamp = index, None
+                _checked_at = time.monotonic()
+        except Exception:
+            logger.exception("路段转移索引构建失败")
+        finally:
+            connection.close()
+            with _lock:
+                _updating = False
+
+    with _lock:
+        if _updating:
+            return
+        _updating = True
+    threading.Thread(target=target, name="roads-transition-index", daemon=True).start()
+
+
+def get_transition_index():
+    """
+    当前进程的 TransitionIndex：
+    配了 ROADS_TRANSITION_DIR 且文件已生成 → mmap 打开，meta.json 变了就重开；
+    否则在后台从数据库构建，建好之前抛 IndexNotReady；之后每隔
+    ROADS_TRANSITION_CHECK_INTERVAL 秒在后台增量读入新轨迹，期间返回旧索引。
+    """
+    global _index, _index_stamp
+    directory = _index_dir()
+    if directory is not None and (directory / META_FILE).exists():
+        stamp = (directory / META_FILE).stat().st_mtime_ns
+        if _index is not None and _index_stamp == stamp:
+            return _index
+        with _lock:
+            if _index is None or _index_stamp != stamp:
+                _index, _index_stamp = TransitionIndex.open(directory), stamp
+            return _index
+
+    index = _index if _index_stamp is None else None
+    interval = getattr(settings, "ROADS_TRANSITION_CHECK_INTERVAL", 300)
+    if index is None:
+        _start_update(TransitionIndex.empty())
+        raise IndexNotReady("路段转移索引正在构建，请稍后重试")
+    if _checked_at is None or time.monotonic() - _checked_at >= interval:
+        _start_update(index)
+    return index
+
+
+def load_now():
+    """
+    在当前线程里拿到可用的索引（基准测试计时前用）：已有就直接返回，
+    否则同步从数据库构建，失败直接抛出而不是像请求时那样返回 503 重试
+    """
+    global _index, _index_stamp, _checked_at
+    directory = _index_dir()
+    if directory is not None and (directory / META_FILE).exists():
+        return get_transition_index()
+    with _lock:
+        if _index is not None and _index_stamp is None:
+            return _index
+    index = TransitionIndex.empty().extend_from_db()
+    with _lock:
+        _index, _index_stamp = index, None
+        _checked_at = time.monotonic()
+    return index
+
+
+def on_flows_refreshed(sender, **kwargs):
+    """有新轨迹入库并刷新后，下次请求立即检查增量"""
+    global _checked_at
+    _checked_at = None
@@ -0,0 +1,80 @@
+"""
+轨迹坐标拼接（原 get_location.ipynb）。
+
+路段几何只在路网快照里解码一次（gid 升序 + offsets + 扁平 coords），
+一条轨迹的坐标就是按 road_ids 依次取 coords 的切片拼起来；相邻两段
+首尾重合的点只保留一个，与 notebook 的规则相同：
+
+    if i > 0 and full_coords and coords[0] == full_coords[-1]: coords = coords[1:]
+
+一批轨迹一次性算出所有切片的起止，再用一次 fancy index 取出全部点，
+不逐点循环。输出是 COPY 文本格式的 "id\\tcoord_list(JSON)" 行。
+
+只依赖 numpy，可以在多进程的工作进程里运行。
+"""
+import json
+
+import numpy as np
+
+_network = None
+
+
+def init_worker(gid, offsets, coords):
+    global _network
+    _network = (gid, offsets, coords)
+
+
+def parse_id_lists(trip_ids, texts):
+    """
+    一批 '{1,2,3}'（数组列转文本）或 '[1, 2, 3]'（trip_road_data 的文本列），
+    整批一次解析。空列表的轨迹去掉；返回 (trip_ids, 每条的长度, 扁平 int64 数组)。
+    """
+    texts = [(t or "").strip("{}[] ") for t in texts]
+    keep = [i for i, t in enumerate(texts) if t]
+    texts = [texts[i] for i in keep]
+    counts = np.array([t.count(",") + 1 for t in texts], dtype=np.int64)
+    flat = (np.array(",".join(texts).split(","), dtype=np.int64) if texts
+            else np.empty(0, dtype=np.int64))
+    return [trip_ids[i] for i in keep], counts, flat
+
+
+def assemble(trip_ids, road_id_texts, network=None):
+    """
+    一批轨迹 → COPY 文本（str）和行数。road_ids 为空的轨迹跳过（不更新），
+    路段全都不在路网里的轨迹写空列表。
+    """
+    gid, offsets, coords = network or _network
+    trip_ids, counts, flat = parse_id_lists(trip_ids, road_id_texts)
+    if not trip_ids:
+        return "", 0
+
+    # 找不到或没有几何的 gid 丢掉
+    trip_of = np.repeat(np.arange(len(trip_ids)), counts)
+    pos = np.searchsorted(gid, flat)
+    pos[pos >= len(gid)] = 0
+    found = gid[pos] == flat if len(gid) else np.zeros(len(flat), dtype=bool)
+    found &= offsets[pos + 1] > offsets[pos]
+    seg, trip_of = pos[found], trip_of[found]
+
+    starts, ends = offsets[seg], offsets[seg + 1]
+    # 同一轨迹里，本段首点与上一段末点相同则去掉首点
+    drop = np.zeros(len(seg), dtype=np.int64)
+    if len(seg) > 1:
+        same_trip = trip_of[1:] == trip_of[:-1]
+        joint = np.all(coords[starts[1:]] == coords[ends[:-1] - 1], axis=1)
+        drop[1:] = same_trip & joint
+    first = starts + drop
+    kept = ends - first
+
+    total = int(kept.sum())
+    seg_start = np.cumsum(kept) - kept
+    point_idx = np.arange(total) - np.repeat(seg_start, kept) + np.repeat(first, kept)
+    points = coords[point_idx].tolist()
+    per_trip = np.bincount(trip_of, weights=kept, minlength=len(trip_ids)).astype(np.int64)
+
+    lines = []
+    at = 0
+    for trip_id, n in zip(trip_ids, per_trip.tolist()):
+        lines.append(f"{trip_id}\t{json.dumps(points[at:at + n], separators=(',', ':'))}\n")
+        at += n
+    return "".join(lines), len(lines)
@@ -0,0 +1,93 @@
+"""
+轨迹 CSV → trip_road_data 的解析部分（原 process_traj.ipynb）。
+
+trips 列是一串 Python 列表字面量，第 3、4、6 个列表分别是 road_ids、
+timestamps、extended_road_ids。notebook 用 re.findall(r'\[.*?\]') 切出列表再
+ast.literal_eval；这里用 str.find 顺序找 '[' 和之后第一个 ']'（与非贪婪正则
+切出的片段相同），再用 C 实现的 json.loads 解析数字列表，写回库里的文本
+与原来 str(list) 的结果一致。
+
+只依赖标准库，可以直接在多进程的工作进程里运行。
+"""
+import csv
+import json
+import os
+import sys
+import time
+
+TRIPS_COLUMN = "trips"
+LIST_COLUMNS = ("road_ids", "timestamps", "extended_road_ids")
+LIST_INDICES = (3, 4, 6)
+CHUNK_ROWS = 50_000
+
+# 一条轨迹的 trips 字段可能有几十 KB，超过 csv 模块默认的 128KB 上限就会报错
+csv.field_size_limit(min(sys.maxsize, 2 ** 31 - 1))
+
+
+def extract_lists(text, indices=LIST_INDICES):
+    """取 text 里第 indices 个 [...] 片段并解析；缺失或解析失败的位置为 None"""
+    wanted = {n: k for k, n in enumerate(indices)}
+    result = [None] * len(indices)
+    last = max(indices)
+    pos = n = 0
+    while n <= last:
+        start = text.find("[", pos)
+        if start < 0:
+            break
+        end = text.find("]", start + 1)
+        if end < 0:
+            break
+        k = wanted.get(n)
+        if k is not None:
+            try:
+                result[k] = json.loads(text[start:end + 1])
+            except ValueError:
+                pass
+        pos = end + 1
+        n += 1
+    return result
+
+
+def output_columns(header):
+    """原 CSV 表头 → trip_road_data 里对应的列（去掉 trips，追加三个列表列）"""
+    return [c for c in header if c != TRIPS_COLUMN] + list(LIST_COLUMNS)
+
+
+def convert_file(path, out_path, chunk_rows=CHUNK_ROWS):
+    """
+    流式读取一个轨迹 CSV，解析 trips 列，三个列表都非空的行写到 out_path
+    （COPY ... FORMAT csv 可直接读取）。返回统计信息。
+    """
+    started = time.perf_counter()
+    rows_in = rows_out = 0
+    with open(path, newline="", encoding="utf-8") as src, \
+            open(out_path, "w", newline="", encoding="utf-8") as dst:
+        reader = csv.reader(src)
+        header = next(reader)
+        trips_at = header.index(TRIPS_COLUMN)
+        keep = [i for i, c in enumerate(header) if i != trips_at]
+        writer = csv.writer(dst, lineterminator="\n")
+
+        batch = []
+        for row in reader:
+            rows_in += 1
+            lists = extract_lists(row[trips_at])
+            if not all(isinstance(v, list) and v for v in lists):
+                continue
+            batch.append([row[i] for i in keep] + [str(v) for v in lists])
+            if len(batch) >= chunk_rows:
+                writer.writerows(batch)
+                rows_out += len(batch)
+                batch.clear()
+        writer.writerows(batch)
+        rows_out += len(batch)
+
+    return {
+        "path": path,
+        "staging": out_path,
+        "columns": output_columns(header),
+        "rows_in": rows_in,
+        "rows": rows_out,
+        "bytes": os.path.getsize(path),
+        "seconds": time.perf_counter() - started,
+    }
@@ -1,16 +1,60 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
-urlpatterns = [
+sync_urlpatterns = [
     path('ways/', views.list_ways),
     path('road-flow/',  views.road_flow),
     path('road-day-flow/', views.road_day_flow),
+    path('network-flow/', views.network_flow),
+    path('network-flow/gids/', views.network_flow_gids),
+    path('flows/refresh/', views.flow_refresh),
     path('bfmap_ways/', views.list_all_bfmap_ways),
     path('bfmap_ways/filter/', views.filter_bfmap_ways),
+    path('road-names/search/', views.search_road_names),
+    path('tiles/<int:z>/<int:x>/<int:y>.mvt', views.bfmap_way_tile),
     path('top-roads/', views.top_n_roads_by_day),
     path('top-roads-by-hour/', views.top_n_roads_by_hour),
     path('top-roads-by-peak/', views.top_n_roads_by_peak_period),
     path('roads-by-highway-type/', views.roads_by_highway_type),
     path('top-roads-by-duration/', views.top_n_roads_by_duration_category),
     path('pickup-clusters/', views.pickup_clusters),
-]
\ No newline at end of file
+    path('pickup-clusters/batch/', views.pickup_clusters_batch),
+    path('pickup-heatmap/', views.pickup_heatmap),
+    path('road-transitions/', views.road_transitions),
+    path('road-transitions/trips/', views.road_transition_trips),
+    path('batch/', views.batch_query),
+    path('metrics/', views.metrics),
+]
+
+urlpatterns = sync_urlpatterns
+
+# ASGI 部署时，有异步版本的只读接口换成 async_views 里的视图；其余只读接口
+# 用 async_views.offloaded 放进线程池，不挤在 Django 唯一的 thread_sensitive 线程上。
+# 写操作、流式批量聚类和 ways/（服务端游标绑定线程）保持同步
+if getattr(settings, 'ROADS_ASYNC_VIEWS', False):
+    from . import async_views
+
+    _async_views = {
+        'bfmap_ways/': async_views.list_all_bfmap_ways,
+        'road-day-flow/': async_views.road_day_flow,
+        'top-roads/': async_views.top_n_roads_by_day,
+        'top-roads-by-hour/': async_views.top_n_roads_by_hour,
+        'top-roads-by-peak/': async_views.top_n_roads_by_peak_period,
+        'top-roads-by-duration/': async_views.top_n_roads_by_duration_category,
+        'roads-by-highway-type/': async_views.roads_by_highway_type,
+        'pickup-clusters/': async_views.pickup_clusters,
+        'bfmap_ways/filter/': async_views.offloaded(views.filter_bfmap_ways),
+        'road-flow/': async_views.offloaded(views.road_flow),
+        'network-flow/': async_views.offloaded(views.network_flow),
+        'network-flow/gids/': async_views.offloaded(views.network_flow_gids),
+        'road-names/search/': async_views.offloaded(views.search_road_names),
+        'tiles/<int:z>/<int:x>/<int:y>.mvt': async_views.offloaded(views.bfmap_way_tile),
+        'pickup-heatmap/': async_views.offloaded(views.pickup_heatmap),
+        'road-transitions/': async_views.offloaded(views.road_transitions),
+        'road-transitions/trips/': async_views.offloaded(views.road_transition_trips),
+    }
+    urlpatterns = [
+        path(str(p.pattern), _async_views[str(p.pattern)]) if str(p.pattern) in _async_views else p
+        for p in sync_urlpatterns
+    ]
@@ -1,36 +1,25 @@
 import numpy as np
-from collections import defaultdict
-from sklearn.cluster import DBSCAN
 
-KMS_PER_RADIAN = 6371.0088  # 地球平均半径
+from .clustering import check_params, grid_dbscan, summarize
+from .geo import to_local
+from .instrumentation import phase
 
 def dbscan_geo(points, eps_m=200, min_samples=20):
     """
-    points: [(lat, lng), ...]  (°)
+    points: [(lat, lng), ...] 或 n×2 数组 (°)
     eps_m : 聚类半径（米）
     return: [{'id': 0, 'size': 42, 'centroid': [lat, lng]}, ...]
+
+    投影到哈尔滨局部平面后用网格 DBSCAN（见 clustering.py）。核心点与簇的划分
+    与原来的 sklearn DBSCAN(haversine) 相同（除距离恰好在 eps 附近的点对），
+    同时挨着两个簇的边界点归到最近的核心点所在的簇，可能与 sklearn 不同。
     """
-    if not points:
+    check_params(eps_m, min_samples)
+    if len(points) == 0:
         return []
 
-    coords_rad = np.radians(points)           # DBSCAN(haversine) 需弧度
-    eps = eps_m / 1000.0 / KMS_PER_RADIAN     # 米 → 弧度
-
-    labels = DBSCAN(eps=eps, min_samples=min_samples,
-                    metric='haversine').fit(coords_rad).labels_
-
-    clusters = defaultdict(list)
-    for lbl, (lat, lng) in zip(labels, points):
-        if lbl != -1:                         # -1 = 噪声点
-            clusters[lbl].append((lat, lng))
-
-    results = []
-    for cid, pts in clusters.items():
-        arr = np.array(pts)
-        centroid = [arr[:, 0].mean(), arr[:, 1].mean()]
-        results.append({
-            "id": int(cid),
-            "size": len(pts),
-            "centroid": centroid              # 直接给前端就能画
-        })
-    return results
+    arr = np.asarray(points, dtype=np.float64)
+    with phase("dbscan"):
+        labels = grid_dbscan(to_local(arr[:, 0], arr[:, 1]), eps_m, min_samples)
+    with phase("summarize"):
+        return summarize(labels, arr[:, 0], arr[:, 1])
@@ -1,95 +1,197 @@
-from django.db.models import OuterRef, Subquery
-from rest_framework.decorators import api_view
+import numpy as np
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotFound, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework.decorators import api_view, renderer_classes
 from rest_framework.response import Response
-from shapely import wkb
-from datetime import datetime
-from .utils import dbscan_geo
+from datetime import date, datetime, timedelta
+from . import batch, cluster_cache, geomcodec, heatmap, instrumentation, listing, queries, refresh, transitions
+from .cache import LRUCache
+from .flows import HOURS_PER_DAY, date_range, hourly_flow_matrix, network_flow_array
+from .geo import HARBIN_ORIGIN, from_local
+from .instrumentation import phase
+from .lookup import attach_road_names
+from .network import get_network
+from .payloads import PreparedPayload, bfmap_ways_payload, encode_json, payload_response
+from .pickups import get_pickup_store
+from .renderers import ArrowStreamRenderer, OctetStreamRenderer, PolylineJSONRenderer, with_formats
+from .tiles import MAX_ZOOM, get_tile
 from .models import (
-    BfmapWay,
-    Highway,
-    RoadDailyCount,
-    RoadDayFlow,
-    RoadDurationStats,
-    RoadHighwayMapping,
-    RoadHourlyCount,
+    FlowRefreshLog,
     RoadHourlyFlow,
-    RoadPeakPeriodCount,
     Way,
-    TaxiPickup,
 )
 
+MAX_NEAREST = 100
+MAX_NAME_SUGGESTIONS = 50
+MAX_FLOW_DAYS = 92
+MAX_FLOW_ROADS = 500
+MAX_BATCH_WINDOWS = 1000
+MAX_TRANSITION_K = 200
+MAX_TRANSITION_ROADS = 50
+MAX_TRANSITION_TRIPS = 10000
+TRANSITION_RETRY_AFTER = 30        # 秒，索引构建中返回 503 时的 Retry-After
+WAYS_PAGE_SIZE = 100
+
+# network-flow 的预编码结果，按 (快照版本, 刷新代次, 日期, 小时, 格式) 缓存
+_network_flow_payloads = LRUCache(maxsize=256)
+
+
+GEOMETRY_FORMATS = with_formats(OctetStreamRenderer, ArrowStreamRenderer, PolylineJSONRenderer)
+
 
 @api_view(["GET"])
+@renderer_classes(GEOMETRY_FORMATS)
 def list_all_bfmap_ways(request):
-    all_ways = BfmapWay.objects.all()
-
-    results = []
-    for way in all_ways:
-        coords = []
-        if way.geom:
-            shapely_geom = wkb.loads(bytes(way.geom.ewkb))  # 解析 LineString
-            coords = [[pt[0], pt[1]] for pt in shapely_geom.coords]
-
-        results.append({
-            "gid": way.gid,
-            "osm_id": way.osm_id,
-            "class_id": way.class_id,
-            "road_name": way.road_name,
-            "coord_list": coords,
-        })
-    return Response(results)
+    """
+    /api/bfmap_ways/                          全量（预编码，支持 ETag、gzip/br）
+    /api/bfmap_ways/?limit=1000&after=<gid>   按 gid 分页，下一页见 Link 响应头
+    /api/bfmap_ways/?stream=json|ndjson       流式输出（见 listing.py）
+    &format=json|polyline|bin|arrow&precision=6  几何编码（见 geomcodec.py）；
+    format=polyline 时记录里没有 coord_list，几何在 "polyline" 字段
+    """
+    try:
+        params = listing.parse(request.GET)
+        fmt, precision = geomcodec.parse(request.GET, params.stream)
+    except ValueError as e:
+        return Response({"detail": f"无效的参数: {e}"}, status=400)
+
+    network = get_network()
+    if params.stream:
+        chunks = listing.network_chunks(network, params.after, fmt=fmt, precision=precision)
+        return listing.stream_response(chunks, params.stream)
+    if not params.requested:
+        return payload_response(request, bfmap_ways_payload(network, fmt=fmt, precision=precision))
+    if fmt in geomcodec.BINARY:
+        idx, next_after = listing.network_rows(network, params.after, params.limit)
+        return listing.with_next(geomcodec.response(network, idx, fmt, precision),
+                                 request, next_after, params.limit)
+    records, next_after = listing.network_page(network, params.after, params.limit, fmt, precision)
+    return listing.page_response(request, records, next_after, params.limit)
+
+
+def _float_list(value, count, name):
+    parts = value.split(",")
+    if len(parts) != count:
+        raise ValueError(f"{name} 需要 {count} 个逗号分隔的数字")
+    return [float(p) for p in parts]
 
 
 @api_view(["GET"])
+@renderer_classes(GEOMETRY_FORMATS)
 def filter_bfmap_ways(request):
-    queryset = BfmapWay.objects.all()
+    """
+    /api/bfmap_ways/filter/?gid=&osm_id=&class_id=&road_name=
+                           &bbox=minlng,minlat,maxlng,maxlat
+                           &near=lng,lat&k=10
+                           &format=json|polyline|bin|arrow&precision=6
+    bbox 返回与矩形相交的路段；near 按距离返回最近的 k 条，附 distance_m（米），
+    bin / arrow 格式下距离按顺序放在响应头 X-Distance-M（逗号分隔）
+    """
+    try:
+        filters = {
+            key: int(request.GET[key])
+            for key in ("gid", "osm_id", "class_id")
+            if request.GET.get(key)
+        }
+    except ValueError:
+        return Response({"detail": "gid、osm_id、class_id 必须为整数"}, status=400)
 
-    gid = request.GET.get("gid")
-    osm_id = request.GET.get("osm_id")
-    class_id = request.GET.get("class_id")
     road_name = request.GET.get("road_name")
+    bbox = request.GET.get("bbox")
+    near = request.GET.get("near")
+    try:
+        bbox = _float_list(bbox, 4, "bbox") if bbox else None
+        near = _float_list(near, 2, "near") if near else None
+        k = int(request.GET.get("k", 10))
+        if not (0 < k <= MAX_NEAREST):
+            raise ValueError(f"k 必须在 1 到 {MAX_NEAREST} 之间")
+        fmt, precision = geomcodec.parse(request.GET)
+    except ValueError as e:
+        return Response({"detail": f"无效的参数: {e}"}, status=400)
 
-    if gid:
-        queryset = queryset.filter(gid=gid)
-    if osm_id:
-        queryset = queryset.filter(osm_id=osm_id)
-    if class_id:
-        queryset = queryset.filter(class_id=class_id)
-    if road_name:
-        queryset = queryset.filter(road_name__icontains=road_name)
-
-    # 获取 class_id → highway name 映射
-    class_ids = queryset.values_list('class_id', flat=True).distinct()
-    highway_map = {
-        h.id: h.name for h in Highway.objects.filter(id__in=class_ids)
-    }
-
-    results = []
-    for way in queryset:
-        coords = []
-        if way.geom:
-            try:
-                shapely_geom = wkb.loads(bytes(way.geom.ewkb))
-                coords = [[pt[0], pt[1]] for pt in shapely_geom.coords]
-            except Exception as e:
-                print(f"Error parsing geometry for gid {way.gid}: {e}")
-
-        results.append({
-            "gid": way.gid,
-            "osm_id": way.osm_id,
-            "class_id": way.class_id,
-            "road_name": way.road_name,
-            "highway_type": highway_map.get(way.class_id),
-            "coord_list": coords
-        })
+    network = get_network()
+    # 只按 class_id 过滤时直接用预编码的子集
+    if set(filters) == {"class_id"} and not (road_name or bbox or near):
+        return payload_response(
+            request, bfmap_ways_payload(network, filters["class_id"], fmt, precision)
+        )
 
+    with phase("filter"):
+        idx = network.select(road_name=road_name, **filters)
+        if bbox:
+            idx = np.intersect1d(idx, network.query_bbox(*bbox), assume_unique=True)
+    if near:
+        filtered = filters or road_name or bbox
+        with phase("nearest"):
+            idx, dist = network.nearest(near[0], near[1], k,
+                                        candidates=idx if filtered else None)
+
+    if fmt in geomcodec.BINARY:
+        resp = geomcodec.response(network, idx, fmt, precision, with_highway=True)
+        if near:
+            resp["X-Distance-M"] = ",".join(str(round(d, 1)) for d in dist.tolist())
+        return resp
+    with phase("serialize"):
+        results = geomcodec.records(network, idx, fmt, precision, with_highway=True)
+    if near:
+        for r, d in zip(results, dist.tolist()):
+            r["distance_m"] = round(d, 1)
     return Response(results)
 
 
+@api_view(["GET"])
+def search_road_names(request):
+    """
+    /api/road-names/search/?q=中山&limit=10
+    返回: [{"road_name": "中山路", "gids": [12, 57, ...]}, ...]
+    """
+    query = request.GET.get("q", "")
+    try:
+        limit = int(request.GET.get("limit", 10))
+        if not (0 < limit <= MAX_NAME_SUGGESTIONS):
+            raise ValueError(f"limit 必须在 1 到 {MAX_NAME_SUGGESTIONS} 之间")
+    except ValueError as e:
+        return Response({"detail": f"无效的参数: {e}"}, status=400)
+
+    network = get_network()
+    index = network.name_index
+    return Response([
+        {"road_name": index.names[i], "gids": network.gid[index.rows[i]].tolist()}
+        for i in index.search(query, limit)
+    ])
+
+
+@require_GET
+def bfmap_way_tile(request, z, x, y):
+    """
+    /api/tiles/<z>/<x>/<y>.mvt
+    返回: application/vnd.mapbox-vector-tile，图层名 roads
+    """
+    if z > MAX_ZOOM or x >= 2 ** z or y >= 2 ** z:
+        return HttpResponseNotFound()
+
+    resp = HttpResponse(get_tile(z, x, y),
+                        content_type="application/vnd.mapbox-vector-tile")
+    resp["Cache-Control"] = "public, max-age=300"
+    return resp
+
+
 @api_view(["GET"])
 def list_ways(request):
-    ways = Way.objects.all().values("id", "tags", "nodes")[:100]
-    return Response(list(ways))
+    """
+    /api/ways/?limit=100&after=<id>   按 id 分页（默认每页 WAYS_PAGE_SIZE 条），下一页见 Link 响应头
+    /api/ways/?stream=json|ndjson     整表流式输出
+    """
+    try:
+        params = listing.parse(request.GET, default_limit=WAYS_PAGE_SIZE)
+    except ValueError as e:
+        return Response({"detail": f"无效的参数: {e}"}, status=400)
+
+    ways = Way.objects.values("id", "tags", "nodes")
+    if params.stream:
+        return listing.stream_response(listing.iter_chunks(ways, "id", params.after), params.stream)
+    rows, next_after = listing.page(ways, "id", params.after, params.limit)
+    return listing.page_response(request, rows, next_after, params.limit)
 
 
 @api_view(["GET"])
@@ -97,7 +199,17 @@ def road_flow(request):
     """
     /api/road-flow/?road_id=<ID>&date=<YYYY-MM-DD>
     返回: [{"hour":0,"traffic_cnt":12}, … ]
+
+    多路段 / 日期区间（一次查询，缺失补 0）：
+    /api/road-flow/?road_ids=3,7,12&start=2015-01-03&end=2015-01-07&layout=columnar
+    返回:
+      {"road_ids": [3, 7, 12], "dates": ["2015-01-03", …], "hours": 24,
+       "traffic_cnt": [[[h0, …, h23], …每天], …每条路]}
+    layout=columnar 时 traffic_cnt 按 路段→日期→小时 展平成一维数组
     """
+    if any(request.GET.get(k) for k in ("road_ids", "start", "end")):
+        return _road_flow_matrix(request)
+
     road_id = request.GET.get("road_id")
     day = request.GET.get("date")  # yyyy-mm-dd
 
@@ -112,6 +224,44 @@ def road_flow(request):
 
     return Response(list(qs))
 
+def _road_flow_matrix(request):
+    road_ids_param = request.GET.get("road_ids") or request.GET.get("road_id")
+    start_param = request.GET.get("start") or request.GET.get("date")
+    end_param = request.GET.get("end") or start_param
+    layout = request.GET.get("layout", "nested")
+
+    if not (road_ids_param and start_param):
+        return Response({"detail": "road_ids 和 start（或 date）都要传"}, status=400)
+    if layout not in ("nested", "columnar"):
+        return Response({"detail": "layout 必须是 nested 或 columnar"}, status=400)
+
+    try:
+        road_ids = list(dict.fromkeys(
+            int(s) for s in road_ids_param.split(",") if s.strip()
+        ))
+        start = date.fromisoformat(start_param)
+        end = date.fromisoformat(end_param)
+    except ValueError:
+        return Response({"detail": "road_ids 必须是整数列表，start/end 格式为 YYYY-MM-DD"},
+                        status=400)
+
+    if end < start:
+        return Response({"detail": "end 不能早于 start"}, status=400)
+    if (end - start).days + 1 > MAX_FLOW_DAYS or len(road_ids) > MAX_FLOW_ROADS:
+        return Response(
+            {"detail": f"一次最多 {MAX_FLOW_ROADS} 条路段、{MAX_FLOW_DAYS} 天"},
+            status=400,
+        )
+
+    matrix = hourly_flow_matrix(road_ids, start, end)
+    return Response({
+        "road_ids": road_ids,
+        "dates": [d.isoformat() for d in date_range(start, end)],
+        "hours": HOURS_PER_DAY,
+        "traffic_cnt": matrix.ravel().tolist() if layout == "columnar" else matrix.tolist(),
+    })
+
+
 @api_view(['GET'])
 def road_day_flow(request):
     """
@@ -123,31 +273,93 @@ def road_day_flow(request):
         {"road_id":12, "traffic_cnt":18}
       ]
     """
-    road_ids_param = request.GET.get('road_ids')
-    date_param     = request.GET.get('date')
-
-    if not (road_ids_param and date_param):
-        return Response(
-            {"detail": "road_ids 和 date 都要传"},
-            status=400
-        )
-
     try:
-        req_ids = [int(s) for s in road_ids_param.split(',') if s.strip()]
-    except ValueError:
-        return Response({"detail": "road_ids 必须是整数列表"}, status=400)
+        req_ids, qs = queries.road_day_flow(request.GET)
+    except queries.BadRequest as e:
+        return Response({"detail": e.detail}, status=400)
+    return Response(queries.fill_road_day_flow(req_ids, qs))
+
 
-    # 查数据库
-    qs = (RoadDayFlow.objects
-            .filter(biz_date=date_param, road_id__in=req_ids)
-            .values('road_id', 'traffic_cnt'))
+@api_view(["GET"])
+@renderer_classes(with_formats(OctetStreamRenderer))
+def network_flow_gids(request):
+    """
+    /api/network-flow/gids/?format=json|bin
+    返回 network-flow 数组对应的 gid 顺序；bin 为小端 int64。
+    响应头 X-Road-Network 为路网内容摘要，变化说明顺序变了。
+    """
+    fmt = request.GET.get("format", "json")
+    if fmt not in ("json", "bin"):
+        return Response({"detail": "format 必须是 json 或 bin"}, status=400)
+
+    network = get_network()
+    key = (network.version, "gids", fmt)
+    payload = _network_flow_payloads.get(key)
+    if payload is None:
+        if fmt == "bin":
+            payload = PreparedPayload(network.gid.astype("<i8").tobytes(),
+                                      content_type="application/octet-stream")
+        else:
+            payload = PreparedPayload(encode_json({
+                "network": network.fingerprint, "gids": network.gid.tolist(),
+            }))
+        _network_flow_payloads.set(key, payload)
+
+    resp = payload_response(request, payload)
+    resp["X-Road-Network"] = network.fingerprint
+    return resp
 
-    result_map = {rid: 0 for rid in req_ids}
-    for row in qs:
-        result_map[row['road_id']] = row['traffic_cnt']
 
-    resp = [{'road_id': rid, 'traffic_cnt': result_map[rid]} for rid in req_ids]
-    return Response(resp)
+@api_view(["GET"])
+@renderer_classes(with_formats(OctetStreamRenderer))
+def network_flow(request):
+    """
+    /api/network-flow/?date=2015-01-03&hour=8&format=json|bin
+    全路网流量（不传 hour 为全天），按 /api/network-flow/gids/ 的 gid 顺序排列。
+    json: {"network": "<摘要>", "date": "...", "hour": 8, "traffic_cnt": [...]}
+    bin : 小端 int32 数组，长度等于路段数
+    """
+    fmt = request.GET.get("format", "json")
+    hour = request.GET.get("hour")
+    try:
+        day = date.fromisoformat(request.GET.get("date", ""))
+        hour = int(hour) if hour else None
+        if hour is not None and not (0 <= hour <= 23):
+            raise ValueError("hour 必须在 0 到 23 之间")
+        if fmt not in ("json", "bin"):
+            raise ValueError("format 必须是 json 或 bin")
+    except ValueError as e:
+        return Response({"detail": f"无效的参数（date 格式为 YYYY-MM-DD）: {e}"}, status=400)
+
+    network = get_network()
+    key = (network.version, refresh.generation(), day, hour, fmt)
+    payload = _network_flow_payloads.get(key)
+    if payload is None:
+        flow = network_flow_array(network, day, hour)
+        if fmt == "bin":
+            payload = PreparedPayload(flow.astype("<i4").tobytes(),
+                                      content_type="application/octet-stream")
+        else:
+            payload = PreparedPayload(encode_json({
+                "network": network.fingerprint,
+                "date": day.isoformat(),
+                "hour": hour,
+                "traffic_cnt": flow.tolist(),
+            }))
+        _network_flow_payloads.set(key, payload)
+
+    resp = payload_response(request, payload)
+    resp["X-Road-Network"] = network.fingerprint
+    return resp
+
+
+def _top_roads_response(query):
+    # n 不超过预计算的 K 时直接走排行缓存
+    records = query.cached()
+    if records is None:
+        records = list(query.queryset)
+    attach_road_names(records, key=query.gid_key)
+    return Response(records)
 
 
 @api_view(["GET"])
@@ -156,41 +368,11 @@ def top_n_roads_by_day(request):
     /api/top-roads/?date=<YYYY-MM-DD>&n=<count>&highway_name=<highway_name>
     返回: [{"road_id": "xyz", "trip_count": 100}, ... ]
     """
-    target_date = request.GET.get("date")  # yyyy-mm-dd
-    top_n_str = request.GET.get("n")
-    highway_name = request.GET.get("highway_name")
-
-    if not (target_date and top_n_str):
-        return Response({"detail": "date 和 n 都是必须的参数"}, status=400)
-
     try:
-        top_n = int(top_n_str)
-        if top_n <= 0:
-            raise ValueError("n 必须是正整数")
-    except ValueError as e:
-        return Response({"detail": f"无效的n参数: {e}"}, status=400)
-
-
-    qs = RoadDailyCount.objects.filter(date=target_date)
-
-    if highway_name:
-        qs = qs.filter(highway_name=highway_name)
-
-    records = list(
-        qs.order_by("-trip_count").values('road_id', 'trip_count', 'date')[:top_n]
-    )
-
-    # 获取 road_id 对应的 road_name
-    road_ids = [r["road_id"] for r in records]
-    name_map = {
-        str(w.gid): w.road_name for w in BfmapWay.objects.filter(gid__in=road_ids)
-    }
-
-    # 添加 road_name 字段
-    for r in records:
-        r["road_name"] = name_map.get(str(r["road_id"]), "未命名路段")
-
-    return Response(records)
+        query = queries.top_roads_by_day(request.GET)
+    except queries.BadRequest as e:
+        return Response({"detail": e.detail}, status=400)
+    return _top_roads_response(query)
 
 
 @api_view(["GET"])
@@ -199,43 +381,11 @@ def top_n_roads_by_hour(request):
     /api/top-roads-by-hour/?hour=<hour_of_day>&n=<count>&highway_name=<highway_name>
     返回: [{"road_id": "xyz", "trip_count": 100}, ... ]
     """
-    hour_str = request.GET.get("hour")
-    top_n_str = request.GET.get("n")
-    highway_name = request.GET.get("highway_name")
-
-    if not (hour_str and top_n_str):
-        return Response({"detail": "hour 和 n 都是必须的参数"}, status=400)
-
     try:
-        hour = int(hour_str)
-        top_n = int(top_n_str)
-        if not (0 <= hour <= 23):
-            raise ValueError("hour 必须在 0 到 23 之间")
-        if top_n <= 0:
-            raise ValueError("n 必须是正整数")
-    except ValueError as e:
-        return Response({"detail": f"无效的参数: {e}"}, status=400)
-
-    qs = RoadHourlyCount.objects.filter(hour_of_day=hour)
-
-    if highway_name:
-        qs = qs.filter(highway_name=highway_name)
-
-    records = list(
-        qs.order_by("-trip_count").values("road_id", "trip_count", "hour_of_day")[:top_n]
-    )
-
-    # 获取 road_id 对应的 road_name
-    road_ids = [r["road_id"] for r in records]
-    name_map = {
-        str(w.gid): w.road_name for w in BfmapWay.objects.filter(gid__in=road_ids)
-    }
-
-    # 添加 road_name 字段
-    for r in records:
-        r["road_name"] = name_map.get(str(r["road_id"]), "未命名路段")
-
-    return Response(records)
+        query = queries.top_roads_by_hour(request.GET)
+    except queries.BadRequest as e:
+        return Response({"detail": e.detail}, status=400)
+    return _top_roads_response(query)
 
 
 @api_view(["GET"])
@@ -244,159 +394,322 @@ def top_n_roads_by_peak_period(request):
     /api/top-roads-by-peak/?peak_period=Morning Peak&n=10&highway_name=<optional>
     返回: [{"road_id": "xyz", "trip_count": 100, "peak_period": "Morning Peak"}, ... ]
     """
-    peak_period = request.GET.get("peak_period")
-    top_n_str = request.GET.get("n")
-    highway_name = request.GET.get("highway_name")
+    try:
+        query = queries.top_roads_by_peak_period(request.GET)
+    except queries.BadRequest as e:
+        return Response({"detail": e.detail}, status=400)
+    return _top_roads_response(query)
 
-    if not (peak_period and top_n_str):
-        return Response({"detail": "peak_period 和 n 是必须的参数"}, status=400)
 
+@api_view(["GET"])
+def roads_by_highway_type(request):
+    """
+    /api/roads-by-highway-type/?highway_name=xxx 或 ?highway_id=123
+    返回: [road_id1, road_id2, ...]
+    可加 &limit=1000&after=<road_id> 按 road_id 分页，或 &stream=json|ndjson 流式输出
+    """
     try:
-        top_n = int(top_n_str)
-        if top_n <= 0:
-            raise ValueError("n 必须是正整数")
+        qs = queries.roads_by_highway_type(request.GET)
+        params = listing.parse(request.GET)
+    except queries.BadRequest as e:
+        return Response({"detail": e.detail}, status=400)
     except ValueError as e:
-        return Response({"detail": f"无效的n参数: {e}"}, status=400)
+        return Response({"detail": f"无效的参数: {e}"}, status=400)
 
-    # 查询 top-N 记录
-    qs = RoadPeakPeriodCount.objects.filter(peak_period=peak_period)
-    if highway_name:
-        qs = qs.filter(highway_name=highway_name)
+    if params.stream:
+        return listing.stream_response(
+            ([row["road_id"] for row in rows] for rows in listing.iter_chunks(qs, "road_id", params.after)),
+            params.stream)
+    if params.requested:
+        rows, next_after = listing.page(qs, "road_id", params.after, params.limit)
+        return listing.page_response(request, [row["road_id"] for row in rows],
+                                     next_after, params.limit)
+    return Response(list(qs.values_list("road_id", flat=True)))
+
+
+@api_view(["GET"])
+def top_n_roads_by_duration_category(request):
+    """
+    /api/top-roads-by-duration/?duration_category=<category>&n=<count>&highway_name=<optional>
+    返回: [{"road_id": "xyz", "trip_count": 100, "duration_category": "short", "highway_name": "xxx"}, ... ]
+    """
+    try:
+        query = queries.top_roads_by_duration_category(request.GET)
+    except queries.BadRequest as e:
+        return Response({"detail": e.detail}, status=400)
+    return _top_roads_response(query)
 
-    records = list(
-        qs.order_by("-trip_count").values("road_id", "trip_count", "peak_period")[:top_n]
-    )
 
-    # 获取 road_id 对应的 road_name
-    road_ids = [r["road_id"] for r in records]
-    name_map = {
-        str(w.gid): w.road_name for w in BfmapWay.objects.filter(gid__in=road_ids)
-    }
+@api_view(['GET'])
+def pickup_clusters(request):
+    """
+    GET /api/pickup-clusters/?start=2015-01-06T14:00&end=2015-01-06T15:00
+                            &period=Morning%20Peak&eps=200&minpts=20
+    """
+    # 1) 解析参数（与异步视图共用 queries.pickup_clusters）---------------------
+    try:
+        query = queries.pickup_clusters(request.GET)
+    except queries.BadRequest as e:
+        return Response(e.body(), status=400)
 
-    # 添加 road_name 字段
-    for r in records:
-        r["road_name"] = name_map.get(str(r["road_id"]), "未命名路段")
+    # 2) 取数据并聚类 --------------------------------------------------------
+    # 先查结果缓存；未命中时在列存储里二分查找时间窗，用滑窗引擎聚类
+    clusters = cluster_cache.get_clusters(get_pickup_store(), query.start, query.end,
+                                          query.period, query.eps, query.minpts)
 
-    return Response(records)
+    # 3) 返回 GeoJSON-like -------------------------------------------------
+    return Response(cluster_cache.feature_collection(clusters))
 
 
-@api_view(["GET"])
-def roads_by_highway_type(request):
+def _cluster_windows(data):
     """
-    /api/roads-by-highway-type/?highway_name=xxx 或 ?highway_id=123
-    返回: [road_id1, road_id2, ...]
+    批量聚类的时间窗：windows=[{start, end, period?}, ...]，
+    或 start/end/step_minutes 把区间切成等长的窗口（period 对全部窗口生效）
+    """
+    if "windows" in data:
+        windows = [
+            (datetime.fromisoformat(w["start"]), datetime.fromisoformat(w["end"]), w.get("period"))
+            for w in data["windows"]
+        ]
+    else:
+        start = datetime.fromisoformat(data["start"])
+        end = datetime.fromisoformat(data["end"])
+        step = timedelta(minutes=int(data.get("step_minutes", 60)))
+        if step <= timedelta(0):
+            raise ValueError("step_minutes 必须为正数")
+        windows = []
+        while start < end and len(windows) <= MAX_BATCH_WINDOWS:
+            windows.append((start, min(start + step, end), data.get("period")))
+            start += step
+    if not windows:
+        raise ValueError("没有时间窗")
+    if len(windows) > MAX_BATCH_WINDOWS:
+        raise ValueError(f"时间窗最多 {MAX_BATCH_WINDOWS} 个")
+    return windows
+
+
+@api_view(["POST"])
+def pickup_clusters_batch(request):
     """
-    highway_name = request.GET.get("highway_name")
-    highway_id = request.GET.get("highway_id")
+    POST /api/pickup-clusters/batch/
+    {"windows": [{"start": "2015-01-06T07:00", "end": "2015-01-06T08:00", "period": "Morning Peak"}, ...],
+     "eps": 200, "minpts": 100}
+    或 {"start": "2015-01-06T00:00", "end": "2015-01-07T00:00", "step_minutes": 60, ...}
 
-    if not (highway_name or highway_id):
-        return Response({"detail": "highway_name 或 highway_id 必须传一个"}, status=400)
+    多进程并行聚类，按完成顺序流式返回 NDJSON，每行一个窗口：
+    {"index": 0, "start": "...", "end": "...", "period": ..., "type": "FeatureCollection", "features": [...]}
+    """
+    data = request.data
+    try:
+        eps, minpts = queries.cluster_params(data)
+        windows = _cluster_windows(data)
+    except queries.BadRequest as e:
+        return Response(e.body(), status=400)
+    except (KeyError, TypeError, ValueError) as e:
+        return Response({"detail": f"无效的参数: {e}"}, status=400)
 
-    qs = RoadHighwayMapping.objects.all()
-    if highway_name:
-        qs = qs.filter(highway_name=highway_name)
-    if highway_id:
+    store = get_pickup_store()
+
+    def lines():
+        # 响应流完（或客户端断开、生成器被关闭）才归还进程池
+        pool = cluster_cache.acquire_pool(store)
         try:
-            highway_id = int(highway_id)
-        except ValueError:
-            return Response({"detail": "highway_id 必须为整数"}, status=400)
-        qs = qs.filter(highway_id=highway_id)
+            for i, clusters in cluster_cache.cluster_windows(store, windows, eps, minpts, pool):
+                start, end, period = windows[i]
+                line = {"index": i, "start": start.isoformat(), "end": end.isoformat(),
+                        "period": period, **cluster_cache.feature_collection(clusters)}
+                yield encode_json(line) + b"\n"
+        finally:
+            pool.release()
 
-    road_ids = list(qs.values_list("road_id", flat=True))
-    return Response(road_ids)
+    return StreamingHttpResponse(lines(), content_type="application/x-ndjson")
 
 
 @api_view(["GET"])
-def top_n_roads_by_duration_category(request):
+@renderer_classes(with_formats(OctetStreamRenderer))
+def pickup_heatmap(request):
     """
-    /api/top-roads-by-duration/?duration_category=<category>&n=<count>&highway_name=<optional>
-    返回: [{"road_id": "xyz", "trip_count": 100, "duration_category": "short", "highway_name": "xxx"}, ... ]
+    GET /api/pickup-heatmap/?shape=hex&size=500&start=2015-01-06T07:00&end=2015-01-06T09:00
+                            &period=Morning%20Peak&bbox=minlng,minlat,maxlng,maxlat&format=json|bin
+    shape : square | hex（默认 hex）；size：格子宽度（米），取值见 heatmap.RESOLUTIONS
+    start/end/period/bbox 均可选，不传 start/end 为全部数据
+    json: GeoJSON FeatureCollection，每个格子一个 Polygon，properties 为 {i, j, count}
+    bin : 每个格子 12 字节（小端 int32 i, int32 j, uint32 count），格子坐标到经纬度的换算
+          见响应头 X-Heatmap-Shape / X-Heatmap-Size / X-Heatmap-Origin（lat,lng 局部平面原点）
     """
-    highway_name = request.GET.get("highway_name")
-    duration_category = request.GET.get("duration_category")
-    top_n_str = request.GET.get("n")
+    shape = request.GET.get("shape", heatmap.HEX)
+    period = request.GET.get("period")
+    fmt = request.GET.get("format", "json")
+    try:
+        size = int(request.GET.get("size", 500))
+        if shape not in heatmap.SHAPES:
+            raise ValueError("shape 必须是 square 或 hex")
+        if size not in heatmap.RESOLUTIONS:
+            raise ValueError(f"size 必须是 {', '.join(map(str, heatmap.RESOLUTIONS))} 之一")
+        start = request.GET.get("start")
+        end = request.GET.get("end")
+        start = datetime.fromisoformat(start) if start else None
+        end = datetime.fromisoformat(end) if end else None
+        bbox = request.GET.get("bbox")
+        bbox = _float_list(bbox, 4, "bbox") if bbox else None
+        if fmt not in ("json", "bin"):
+            raise ValueError("format 必须是 json 或 bin")
+    except ValueError as e:
+        return Response({"detail": f"无效的参数: {e}"}, status=400)
 
-    if not (duration_category and top_n_str):
-        return Response({"detail": "duration_category 和 n 是必须的参数"}, status=400)
+    store = get_pickup_store()
+    with phase("aggregate"):
+        cells, counts = heatmap.aggregate(store, shape, size, start, end, period)
+    if bbox and len(cells):
+        lat, lng = from_local(heatmap.cell_centers(cells, shape, size))
+        inside = (lng >= bbox[0]) & (lat >= bbox[1]) & (lng <= bbox[2]) & (lat <= bbox[3])
+        cells, counts = cells[inside], counts[inside]
+    i, j = heatmap.decode_cells(cells)
+
+    if fmt == "bin":
+        records = np.empty(len(cells), dtype=[("i", "<i4"), ("j", "<i4"), ("count", "<u4")])
+        records["i"], records["j"], records["count"] = i, j, counts
+        resp = HttpResponse(records.tobytes(), content_type="application/octet-stream")
+        resp["X-Heatmap-Shape"] = shape
+        resp["X-Heatmap-Size"] = str(size)
+        resp["X-Heatmap-Origin"] = "{},{}".format(*HARBIN_ORIGIN)
+        return resp
+
+    with phase("serialize"):
+        rings = heatmap.cell_polygons(cells, shape, size).tolist()
+        features = [{
+            "type": "Feature",
+            "geometry": {"type": "Polygon", "coordinates": [ring]},
+            "properties": {"i": ci, "j": cj, "count": n},
+        } for ring, ci, cj, n in zip(rings, i.tolist(), j.tolist(), counts.tolist())]
+    return Response({
+        "type": "FeatureCollection",
+        "shape": shape,
+        "size": size,
+        "max_count": int(counts.max()) if len(counts) else 0,
+        "features": features,
+    })
 
-    if duration_category not in ['short', 'mid', 'long']:
-        return Response({"detail": "duration_category 必须是 'short', 'mid', 或 'long' 之一"}, status=400)
 
-    try:
-        top_n = int(top_n_str)
-        if top_n <= 0:
-            raise ValueError("n 必须是正整数")
-    except ValueError as e:
-        return Response({"detail": f"无效的n参数: {e}"}, status=400)
+@api_view(["GET", "POST"])
+def flow_refresh(request):
+    """
+    GET  /api/flows/refresh/            最近 20 次增量刷新记录
+    POST /api/flows/refresh/            后台启动一次增量刷新，返回 202
+         {"dates": ["2015-01-03", ...]}  可选，额外强制重算的日期
+    """
+    if request.method == "GET":
+        return Response(list(FlowRefreshLog.objects.values(
+            "id", "trigger", "status", "started_at", "finished_at",
+            "from_trip_id", "to_trip_id", "dates", "views", "detail",
+        )[:20]))
 
-    qs = RoadDurationStats.objects.filter(duration_category=duration_category)
+    try:
+        dates = refresh.parse_dates(request.data.get("dates"))
+    except (TypeError, ValueError) as e:
+        return Response({"detail": f"无效的参数（dates 为 YYYY-MM-DD 列表）: {e}"}, status=400)
+    try:
+        refresh.start_background(dates=dates)
+    except refresh.RefreshBusy as e:
+        return Response({"detail": str(e)}, status=409)
+    return Response({"detail": "已开始刷新"}, status=202)
 
-    if highway_name:
-        qs = qs.filter(highway_name=highway_name)
 
-    records = list(
-        qs.order_by("-trip_count")
-        .values("road_id", "trip_count", "duration_category", "highway_name")[:top_n]
-    )
+def _not_ready(exc):
+    return Response({"detail": str(exc)}, status=503,
+                    headers={"Retry-After": str(TRANSITION_RETRY_AFTER)})
 
-    # 获取 road_id 对应的 road_name (路段名)
-    road_ids = [r["road_id"] for r in records]
-    name_map = {
-        str(w.gid): w.road_name for w in BfmapWay.objects.filter(gid__in=road_ids)
-    }
 
-    # 添加 road_name 字段
-    for r in records:
-        r["road_name"] = name_map.get(str(r["road_id"]), "未命名路段")
+@api_view(["GET"])
+def road_transitions(request):
+    """
+    GET /api/road-transitions/?road_id=123&direction=next|prev&k=10
+    经过 road_id 的轨迹下一条（next）/上一条（prev）最常走的路段；
+    trip_count 为轨迹数，share 为占经过 road_id 的轨迹数的比例
+    """
+    direction = request.GET.get("direction", "next")
+    try:
+        road_id = int(request.GET["road_id"])
+        k = int(request.GET.get("k", 10))
+        if direction not in ("next", "prev"):
+            raise ValueError("direction 必须是 next 或 prev")
+        if not 1 <= k <= MAX_TRANSITION_K:
+            raise ValueError(f"k 取值 1~{MAX_TRANSITION_K}")
+    except KeyError:
+        return Response({"detail": "必须提供 road_id 参数"}, status=400)
+    except ValueError as e:
+        return Response({"detail": f"无效的参数: {e}"}, status=400)
 
-    return Response(records)
+    try:
+        index = transitions.get_transition_index()
+    except transitions.IndexNotReady as e:
+        return _not_ready(e)
+    total = index.trip_count(road_id)
+    records = [
+        {"road_id": gid, "trip_count": n, "share": round(n / total, 4)}
+        for gid, n in index.neighbours(road_id, direction, k)
+    ]
+    attach_road_names(records)
+    return Response({"road_id": road_id, "direction": direction,
+                     "total_trips": total, "roads": records})
 
 
-@api_view(['GET'])
-def pickup_clusters(request):
+@api_view(["GET"])
+def road_transition_trips(request):
     """
-    GET /api/pickup-clusters/?start=2015-01-06T14:00&end=2015-01-06T15:00
-                            &period=Morning%20Peak&eps=200&minpts=20
+    GET /api/road-transitions/trips/?road_ids=1,2,3&mode=all|any&limit=1000
+    经过全部（all，默认）/任一（any）给定路段的轨迹 id，升序；count 为总数，trip_ids 最多 limit 个
     """
-    # 1) 解析参数 -----------------------------------------------------------
-    start  = request.GET.get('start')   # ISO-8601 字符串
-    end    = request.GET.get('end')
-    period = request.GET.get('period')      # 可选
-    eps    = int(request.GET.get('eps',    200))   # m
-    minpts = int(request.GET.get('minpts', 100))
+    mode = request.GET.get("mode", "all")
+    try:
+        road_ids = [int(v) for v in request.GET.get("road_ids", "").split(",") if v.strip()]
+        limit = int(request.GET.get("limit", 1000))
+        if not road_ids:
+            raise ValueError("必须提供 road_ids")
+        if len(road_ids) > MAX_TRANSITION_ROADS:
+            raise ValueError(f"road_ids 最多 {MAX_TRANSITION_ROADS} 个")
+        if mode not in ("all", "any"):
+            raise ValueError("mode 必须是 all 或 any")
+        if not 0 <= limit <= MAX_TRANSITION_TRIPS:
+            raise ValueError(f"limit 取值 0~{MAX_TRANSITION_TRIPS}")
+    except ValueError as e:
+        return Response({"detail": f"无效的参数: {e}"}, status=400)
 
-    if not (start and end):
-        return Response({"error": "必须提供 start 和 end 参数"},
-                        status=400)
+    try:
+        index = transitions.get_transition_index()
+    except transitions.IndexNotReady as e:
+        return _not_ready(e)
+    trip_ids = index.trips_through(road_ids, mode)
+    return Response({"road_ids": road_ids, "mode": mode, "count": len(trip_ids),
+                     "trip_ids": trip_ids[:limit].tolist()})
 
-    start_dt = datetime.fromisoformat(start)
-    end_dt   = datetime.fromisoformat(end)
-
-    # 2) 取数据 ------------------------------------------------------------
-    qs = TaxiPickup.objects.filter(pickup_time__gte=start_dt,
-                                   pickup_time__lt=end_dt)
-    if period:
-        qs = qs.filter(period=period)
-
-    points = list(qs.values_list('lat', 'lng'))      # [(lat,lng),...]
-
-    # 3) 聚类 --------------------------------------------------------------
-    clusters = dbscan_geo(points, eps_m=eps, min_samples=minpts)
-
-    # 4) 返回 GeoJSON-like -------------------------------------------------
-    features = [{
-        "type": "Feature",
-        "geometry": {
-            "type": "Point",
-            "coordinates": [c["centroid"][1], c["centroid"][0]]  # lng,lat
-        },
-        "properties": {
-            "cluster_id": c["id"],
-            "size":       c["size"]
-        }
-    } for c in clusters]
 
-    return Response({
-        "type": "FeatureCollection",
-        "features": features
-    })
+@api_view(["POST"])
+def batch_query(request):
+    """
+    POST /api/batch/
+    {"queries": [{"id": "daily", "path": "top-roads/", "params": {"date": "2015-01-03", "n": 10}},
+                 {"id": "hourly", "path": "top-roads-by-hour/?hour=8&n=10"}, ...]}
+    并发执行多个 GET 接口，返回 {"results": [{"id": "daily", "status": 200, "body": [...]}, ...]}，
+    顺序与 queries 一致；相同的子查询只执行一次。子查询出错只影响自己的 status/body
+    """
+    try:
+        subqueries = batch.parse_queries(request.data)
+    except batch.BatchError as e:
+        return Response({"detail": f"无效的参数: {e}"}, status=400)
+    results = batch.run(request, subqueries)
+    return HttpResponse(batch.encode_results(subqueries, results), content_type="application/json")
+
+
+@require_GET
+def metrics(request):
+    """
+    /api/metrics/
+    Prometheus 文本格式的按接口直方图（见 instrumentation.py）；ROADS_INSTRUMENTATION
+    关闭时 404；只允许 ROADS_METRICS_ALLOWED_IPS 里的地址抓取（默认本机）
+    """
+    if not instrumentation.enabled():
+        return HttpResponseNotFound()
+    if not instrumentation.metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(instrumentation.REGISTRY.render(), content_type=instrumentation.CONTENT_TYPE)